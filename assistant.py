@@ -0,0 +1,292 @@
+## OpenAI Assistant Lifecycle--------------------------------------------------------------------------------
+"""Looks up the OpenAI assistant once per process and manages the chat threads.
+
+The assistant is resolved lazily on first use and shared by all sessions. An
+assistant with the same name from an earlier start is reused (its instructions and
+model are updated if they changed), so restarts do not leave a new assistant behind
+every time. Each session keeps one thread for its whole conversation. The vehicles
+relevant to a question are selected locally (see retrieval.py) and sent inline with
+the question as context, nothing is uploaded.
+
+Answers are streamed token by token. Without streaming (an older SDK, a stand-in
+server without server-sent events, or ``WELINK_ASSISTANT_STREAMING=0``) the run is
+polled with bounded backoff until it reaches a terminal state or times out. A stream
+that breaks on the connection before any text arrived falls back to polling: the run
+it had already started is polled, a new one is only created if the stream never got
+that far. Any other API error is raised to the caller as an ``openai.OpenAIError``.
+
+For local testing point the client to a stand-in server through the standard OpenAI
+environment variables, e.g. ``OPENAI_BASE_URL=http://127.0.0.1:8001/v1``.
+"""
+
+import os
+import threading
+import time
+
+from openai import APIConnectionError, OpenAI, OpenAIError
+
+
+ASSISTANT_NAME = "Shared Mobility Retrieval Assistant"
+ASSISTANT_MODEL = "gpt-4-1106-preview"
+ASSISTANT_TOOLS = []
+ASSISTANT_STREAMING = os.environ.get("WELINK_ASSISTANT_STREAMING", "1") != "0"
+
+## Polling fallback: start fast, back off to at most 2 s and give up after 2 minutes--------------------
+
+RUN_TIMEOUT_SECONDS = 120
+POLL_INITIAL_DELAY_SECONDS = 0.2
+POLL_MAX_DELAY_SECONDS = 2.0
+TERMINAL_RUN_STATES = {"completed", "failed", "cancelled", "expired", "requires_action"}
+
+
+## Tell the Chat Bot, what its Purpose is--------------------
+
+PROMPT_ENGINEERING = """
+    - You are a chatbot that helps customers with more information about available shared mobility data of means of transport such as cars, scooters, bicycles or similar.
+    - You need to answer questions based on the vehicle data sent with each question after "Vehicle data:".
+    - In the vehicle data, every station is a list of the values named in "fields". Its "provider" value is the id of an entry in "providers", which holds the provider's name, email, phone and app links. "omitted" counts the less relevant vehicles that were left out.
+    - If the customer asks somtheing related to his current location, use the location given in the additional instructions of the run.
+    - If you can't find any answers, reply: "Sorry, I can't help you with this problem right now. As shared mobility providers update their data, I may be able to provide better answers in the future.
+
+    There are five types of common questions:
+        1. "What types of vehicles are currently available for rent in my area?"
+            Use the location given in the additional instructions of the run.
+            Your give a list of all vehicles, their further informations and their providers statet in the vehicle data as an answer.
+
+        2. "How can I reserve a specific vehicle or check its availability for a particular date and time?"
+            Answer in the follwing way:
+            "To reserve a vehicle 1. download the app, the links to the ios and andorid app are provided on the tiles.
+            2. Create a user account in the app. 3. Type in the address of the car that you found on WeLink 4. rent the vehicle."
+
+        3. "What are the rental rates and are there any ongoing promotions or discounts?"
+            Answer in the follwing way:
+            "Currently you dont have any information about pricing. Users have to check the app."
+
+        4. "Can you provide details on the pickup and drop-off locations near me?"
+            Answer in the follwing way:
+            "Currently you dont have any information about pricing. Users have to check the app."
+
+        5. "What is the process for extending my rental period, and are there any additional charges associated with it?"
+            Answer in the follwing way:
+            "Users have to check the app."
+
+    Never mention the raw vehicle data format or field names.
+    Always return the answer nicely formated.
+    Always be polite
+
+    End the conversation with a "good travel 🛵"
+
+    """
+
+
+def make_client():
+
+    ## If you want to try out the code, you need to input your own Open AI API key (OPENAI_API_KEY)--------------------
+
+    return OpenAI(api_key=os.environ.get("OPENAI_API_KEY", "_"), base_url=os.environ.get("OPENAI_BASE_URL") or None)
+
+
+## Contribution for the function: https://github.com/theailifestyle/AssistantsAPI
+
+def process_message_with_citations(message):
+    """Extract content and annotations from the message and format citations as footnotes."""
+
+    message_content = message.content[0].text
+    annotations = message_content.annotations if hasattr(message_content, "annotations") else []
+    citations = []
+
+    ## Iterate over the annotations and add footnotes--------------------
+
+    for index, annotation in enumerate(annotations):
+
+        ## Replace the text with a footnote--------------------
+
+        message_content.value = message_content.value.replace(annotation.text, f" [{index + 1}]")
+
+        ## Gather citations based on annotation attributes--------------------
+
+        if (file_citation := getattr(annotation, "file_citation", None)):
+            citations.append(f"[{index + 1}] {file_citation.quote} from {file_citation.file_id}")
+
+    ## Add footnotes to the end of the message content--------------------
+
+    return message_content.value + "\n\n" + "\n".join(citations)
+
+
+class RunError(RuntimeError):
+    """An assistant run ended in a state other than completed, or timed out."""
+
+
+def _run_error(run):
+    last_error = getattr(run, "last_error", None)
+    detail = f": {last_error.message}" if last_error is not None else ""
+    return RunError(f"The assistant run ended with status '{run.status}'{detail}")
+
+
+def poll_run(client, thread_id, run, timeout=RUN_TIMEOUT_SECONDS, clock=time.monotonic, sleep=time.sleep):
+    """Poll a run with bounded exponential backoff until it reaches a terminal state."""
+
+    deadline = clock() + timeout
+    delay = POLL_INITIAL_DELAY_SECONDS
+    while run.status not in TERMINAL_RUN_STATES:
+        if clock() >= deadline:
+
+            ## The run is abandoned either way, a failed cancel must not hide the timeout--------------------
+
+            try:
+                client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+            except OpenAIError:
+                pass
+            raise RunError(f"The assistant did not answer within {timeout} seconds")
+        sleep(delay)
+        delay = min(delay * 2, POLL_MAX_DELAY_SECONDS)
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+    return run
+
+
+class _StreamingUnavailable(Exception):
+    """Streaming failed before any text was shown. ``run`` is the run the stream had already started, if any."""
+
+    def __init__(self, run=None):
+        super().__init__()
+        self.run = run
+
+
+def _stream_run(client, thread_id, assistant_id, on_text, run_kwargs):
+    """Run with streamed events, calling ``on_text`` for every text delta. Returns the final run."""
+
+    stream_runs = getattr(client.beta.threads.runs, "stream", None)
+    if stream_runs is None:
+        raise _StreamingUnavailable()
+
+    received = False
+    stream = None
+    try:
+        with stream_runs(thread_id=thread_id, assistant_id=assistant_id, **run_kwargs) as stream:
+            for delta in stream.text_deltas:
+                received = True
+                on_text(delta)
+            return stream.get_final_run()
+    except APIConnectionError as error:
+
+        ## Only a broken connection falls back to polling, and only if nothing was shown yet, otherwise the answer would appear twice--------------------
+        # Errors the API answered with (e.g. a run already active on the thread) would only fail again, they go to the caller
+
+        if received:
+            raise
+        raise _StreamingUnavailable(getattr(stream, "current_run", None)) from error
+
+
+def run_and_collect(client, thread_id, assistant_id, after_message_id, on_text=None, timeout=RUN_TIMEOUT_SECONDS, stream=ASSISTANT_STREAMING, **run_kwargs):
+    """Run the assistant on the thread and return the formatted assistant messages of that run.
+
+    Text is passed to ``on_text`` as it streams in. Only messages newer than
+    ``after_message_id`` (the user's prompt) are fetched afterwards.
+    """
+
+    run = started = None
+    if stream:
+        try:
+            run = _stream_run(client, thread_id, assistant_id, on_text or (lambda delta: None), run_kwargs)
+        except _StreamingUnavailable as unavailable:
+            started = unavailable.run
+
+    if run is None:
+
+        ## A run the stream already started is polled instead of starting a second one on the thread--------------------
+
+        if started is None or not getattr(started, "id", None):
+            started = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, **run_kwargs)
+        run = poll_run(client, thread_id, started, timeout=timeout)
+
+    if run.status != "completed":
+        raise _run_error(run)
+
+    messages = client.beta.threads.messages.list(thread_id=thread_id, order="asc", after=after_message_id)
+    return [
+        process_message_with_citations(message)
+        for message in messages
+        if message.role == "assistant" and message.run_id == run.id
+    ]
+
+
+class AssistantManager:
+    """Process-wide owner of the assistant and the chat threads."""
+
+    def __init__(self, client=None, instructions=PROMPT_ENGINEERING, model=ASSISTANT_MODEL, tools=ASSISTANT_TOOLS, name=ASSISTANT_NAME,
+                 streaming=ASSISTANT_STREAMING):
+        self._client = client
+        self.instructions = instructions
+        self.model = model
+        self.tools = tools
+        self.name = name
+        self.streaming = streaming
+        self._assistant_id = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = make_client()
+        return self._client
+
+    def _find_assistant(self):
+        """The newest assistant with our name, or None."""
+
+        for assistant in self.client.beta.assistants.list(order="desc", limit=100):
+            if assistant.name == self.name:
+                return assistant
+        return None
+
+    @property
+    def assistant_id(self):
+        """Id of the shared assistant, reused from an earlier start or created on first use."""
+
+        with self._lock:
+            if self._assistant_id is None:
+
+                ## This Open AI Assistant API is still in its Beta version--------------------
+
+                assistant = self._find_assistant()
+                if assistant is None:
+                    assistant = self.client.beta.assistants.create(
+                        name=self.name,
+                        instructions=self.instructions,
+                        model=self.model,
+                        tools=self.tools,
+                    )
+                elif assistant.instructions != self.instructions or assistant.model != self.model:
+                    assistant = self.client.beta.assistants.update(
+                        assistant.id,
+                        instructions=self.instructions,
+                        model=self.model,
+                        tools=self.tools,
+                    )
+                self._assistant_id = assistant.id
+            return self._assistant_id
+
+    def create_thread(self):
+        return self.client.beta.threads.create().id
+
+
+class ChatSession:
+    """Per-session chat state: one thread."""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.thread_id = manager.create_thread()
+
+    def add_user_message(self, prompt, context=None):
+        """Add the prompt (and inline context) to the thread. Returns the message id."""
+
+        if context:
+            prompt = f"{prompt}\n\nVehicle data:\n{context}"
+
+        message = self.manager.client.beta.threads.messages.create(thread_id=self.thread_id, role="user", content=prompt)
+        return message.id
+
+    def ask(self, prompt, on_text=None, context=None, **run_kwargs):
+        """Send the prompt and return the assistant's formatted answers, streaming text to ``on_text``."""
+
+        message_id = self.add_user_message(prompt, context)
+        return run_and_collect(self.manager.client, self.thread_id, self.manager.assistant_id, message_id, on_text, stream=self.manager.streaming, **run_kwargs)
@@ -0,0 +1,94 @@
+## Compact Assistant Payload--------------------------------------------------------------------------------
+"""Purpose-built JSON export of the vehicles for the OpenAI assistant.
+
+``DataFrame.to_json()`` repeats the provider name, email, phone and both store links
+for every station and includes columns the assistant never uses. This export emits
+every provider once and lets stations reference it by a small integer id, keeps only
+the fields the prompt asks about, rounds distances to whole meters and stops adding
+stations (nearest first) once the size budget is used up.
+"""
+
+import json
+
+import pandas as pd
+
+
+## Roughly 4 bytes per token for this kind of JSON--------------------
+
+PAYLOAD_MAX_BYTES = 48_000
+BYTES_PER_TOKEN = 4
+
+PROVIDER_FIELDS = {
+    "name": "provider name",
+    "email": "provider email",
+    "phone": "provider phone",
+    "ios": "iOS link",
+    "android": "Android link",
+}
+STATION_FIELDS = ["provider", "vehicle type", "further information", "address", "distance m", "available"]
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _clean(value):
+
+    ## pd.isna also covers np.float32 NaN, the availability of a selection without station status--------------------
+
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    return value
+
+
+def build_assistant_payload(vehicles, location=None, max_bytes=PAYLOAD_MAX_BYTES, max_tokens=None):
+    """Serialize the vehicles (sorted nearest first) into the compact assistant format.
+
+    Returns UTF-8 encoded JSON. If the budget (``max_bytes`` or ``max_tokens``) is too small
+    for all vehicles, only the nearest ones that fit are kept and ``omitted`` says how many not.
+    """
+
+    if max_tokens is not None:
+        max_bytes = min(max_bytes, max_tokens * BYTES_PER_TOKEN)
+
+    providers = {}
+    provider_rows = []
+    station_rows = []
+
+    ## Fixed overhead of the envelope, so the budget check below only has to add the rows--------------------
+
+    used = len(_dumps({"location": location, "fields": STATION_FIELDS, "providers": [], "stations": [], "omitted": len(vehicles)}).encode())
+
+    columns = [vehicles[name].to_numpy() for name in ("vehicle type", "further information", "address", "Distance", "vehicles available")]
+    provider_columns = [vehicles[name].to_numpy() for name in PROVIDER_FIELDS.values()]
+
+    for i, (provider_id, (vehicle_type, information, address, distance, available)) in enumerate(zip(vehicles.index, zip(*columns))):
+        new_provider = None
+        ref = providers.get(provider_id)
+        if ref is None:
+            ref = len(provider_rows)
+            new_provider = {"id": ref, **{key: _clean(column[i]) for key, column in zip(PROVIDER_FIELDS, provider_columns)}}
+
+        available = _clean(available)
+        row = [ref, _clean(vehicle_type), _clean(information), _clean(address), int(round(distance)), None if available is None else int(available)]
+
+        size = len(_dumps(row).encode()) + 1
+        if new_provider is not None:
+            size += len(_dumps(new_provider).encode()) + 1
+        if used + size > max_bytes:
+            break
+
+        used += size
+        if new_provider is not None:
+            providers[provider_id] = ref
+            provider_rows.append(new_provider)
+        station_rows.append(row)
+
+    payload = {
+        "location": location,
+        "fields": STATION_FIELDS,
+        "providers": provider_rows,
+        "stations": station_rows,
+        "omitted": len(vehicles) - len(station_rows),
+    }
+    return _dumps(payload).encode()
@@ -0,0 +1,83 @@
+## Benchmark: row-wise apply vs. vectorized geometry and distances--------------------------------------------------------------------------------
+"""Compare the old ``apply`` based Point/haversine construction with the helpers in spatial.py.
+
+Run from the repository root:
+
+    python benchmarks/bench_distance.py              # 10k, 100k and 1M points
+    python benchmarks/bench_distance.py 10000 50000  # custom sizes
+
+The row-wise baseline runs up to ``--apply-limit`` points (default 1M, so the default
+run measures the full 1M-point speedup). At 1M it takes minutes; use
+``--apply-limit 100000`` to skip it above 100k, or ``--apply-limit 0`` to only time
+the vectorized path.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from haversine import haversine, Unit
+from shapely.geometry import Point
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spatial import haversine_m, points_from_arrays
+
+
+## St. Gallen main station as query point, stations spread over Switzerland--------------------
+
+ORIGIN = (47.4233, 9.3695)
+
+
+def make_stations(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "latitude": rng.uniform(45.8, 47.8, n),
+        "longitude": rng.uniform(5.9, 10.5, n),
+    })
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def run(n, apply_limit):
+    df = make_stations(n)
+
+    t_vec_geom, _ = timed(lambda: points_from_arrays(df["longitude"], df["latitude"]))
+    t_vec_dist, vec = timed(lambda: haversine_m(ORIGIN[0], ORIGIN[1], df["latitude"], df["longitude"]))
+
+    row = {"points": n, "vectorized geometry s": t_vec_geom, "vectorized distance s": t_vec_dist}
+
+    if n <= apply_limit:
+        t_row_geom, _ = timed(lambda: df.apply(lambda r: Point(r["longitude"], r["latitude"]), axis=1))
+        t_row_dist, ref = timed(lambda: df.apply(lambda r: haversine(ORIGIN, (r["latitude"], r["longitude"]), unit=Unit.METERS), axis=1))
+
+        row.update({
+            "apply geometry s": t_row_geom,
+            "apply distance s": t_row_dist,
+            "geometry speedup": t_row_geom / t_vec_geom,
+            "distance speedup": t_row_dist / t_vec_dist,
+            "max abs diff m": float(np.max(np.abs(ref.to_numpy() - vec))),
+        })
+
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sizes", nargs="*", type=int, default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--apply-limit", type=int, default=1_000_000, help="largest size that also runs the row-wise apply baseline (0: never)")
+    args = parser.parse_args()
+
+    results = pd.DataFrame([run(n, args.apply_limit) for n in args.sizes]).set_index("points")
+    print(results.to_string(float_format=lambda x: f"{x:.4g}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+## Benchmark: the pipeline stage by stage--------------------------------------------------------------------------------
+"""Wall time and peak memory of every stage of the WeLink pipeline, fully offline.
+
+The feeds come from the recorded fixtures (see fixtures.py) or, if there are none, a
+synthetic St. Gallen sized feed set. Each run covers the 1×, 10× and 100× station
+scale-ups. Nominatim and the OpenAI API are replaced by the stubs in stubs.py.
+
+Run from the repository root:
+
+    python benchmarks/bench_stages.py                           # 1x, 10x and 100x
+    python benchmarks/bench_stages.py --scales 1 10 --repeat 5
+    python benchmarks/bench_stages.py --save baseline.json      # record a baseline
+    python benchmarks/bench_stages.py --baseline baseline.json  # fail on regressions
+
+With ``--baseline`` the exit code is 1 if the median time of a stage grew by more
+than ``--threshold`` (default 1.25, i.e. 25 %) or its peak memory by more than
+``--memory-threshold``. Stages faster than ``--min-seconds`` are not compared on
+time, their timings are mostly noise. Stages whose dependency is not installed (e.g.
+openai for the assistant stage) are reported as unavailable and not compared.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+from stubs import StubGeolocator, StubOpenAIServer
+
+from districts import Districts, ST_GALLEN_DISTRICT_IDS
+from feed_cache import FeedCache
+from station_status import StationStatusStore
+from welink_core import BASE_FEEDS, MobilitySnapshot, add_addresses, build_providers, build_stations
+
+
+ORIGIN = fixtures.CENTER
+RADIUS_M = 3000
+QUESTION = "Are there any e-bikes within 500 m?"
+
+
+## Stages--------------------------------------------------------------------------------
+# Every stage gets the shared context, returns (result, number of items processed) and
+# must give the same result when it is called again, because it is timed repeatedly.
+
+def stage_fetch(ctx):
+    feed_cache = FeedCache(client_factory=lambda: fixtures.FixtureClient(ctx["feed_set"]))
+    feed_cache.get_many(BASE_FEEDS + ("station_status",))
+    return feed_cache, len(ctx["feed_set"]["station_information"]["data"]["stations"])
+
+
+def stage_build(ctx):
+    feed_cache = ctx["fetch"]
+    providers = build_providers(feed_cache.get("providers").get("data").get("providers"))
+    stations = build_stations(feed_cache.get("station_information").get("data").get("stations"))
+    return (providers, stations), len(stations)
+
+
+def stage_districts(ctx):
+    districts = Districts.load(use_cache=False)
+    return districts, len(districts.ids)
+
+
+def stage_region(ctx):
+    region = ctx["districts"].region(ST_GALLEN_DISTRICT_IDS)
+    stations = ctx["build"][1]
+    mask = region.contains(stations["longitude"].to_numpy(), stations["latitude"].to_numpy())
+    return region, int(mask.sum())
+
+
+def stage_index(ctx):
+    providers, stations = ctx["build"]
+    snapshot = MobilitySnapshot(providers, stations, ctx["region"], version=("benchmark",))
+    return snapshot, len(snapshot)
+
+
+def stage_status(ctx):
+    status_store = StationStatusStore()
+    stations = ctx["fetch"].get("station_status").get("data").get("stations")
+    status_store.apply(stations)
+    return status_store, len(stations)
+
+
+def stage_query(ctx):
+    snapshot, status_store = ctx["index"], ctx["status"]
+    for latitude, longitude in ctx["query_points"]:
+        snapshot.nearby(latitude, longitude, RADIUS_M, status_store=status_store)
+    vehicles = snapshot.nearby(*ORIGIN, RADIUS_M, status_store=status_store)
+    return vehicles, len(ctx["query_points"]) + 1
+
+
+def stage_slider(ctx):
+
+    ## One selection per location, then every slider position is a binary search over its sorted distances--------------------
+
+    selection = ctx["index"].select(*ORIGIN, RADIUS_M, status_store=ctx["status"])
+    counts = [len(selection.visible(meters)) for meters in range(1, RADIUS_M + 1, 10)]
+    return counts, len(counts)
+
+
+def _reverse_geocoder(ctx, path):
+    from geocoding import ReverseGeocodeCache
+
+    return ReverseGeocodeCache(path=path, geolocator=StubGeolocator(ctx["geocode_latency"]), min_delay_seconds=0)
+
+
+def stage_geocode_cold(ctx):
+    with tempfile.TemporaryDirectory() as directory:
+        vehicles = add_addresses(ctx["query"], _reverse_geocoder(ctx, os.path.join(directory, "cold.sqlite")))
+    return vehicles, len(vehicles)
+
+
+def stage_geocode_warm(ctx):
+    path = os.path.join(ctx["tmp"], "warm.sqlite")
+    if "warm_geocoder" not in ctx:
+        ctx["warm_geocoder"] = _reverse_geocoder(ctx, path)
+        add_addresses(ctx["query"], ctx["warm_geocoder"])
+    vehicles = add_addresses(ctx["query"], ctx["warm_geocoder"])
+    return vehicles, len(vehicles)
+
+
+def _vehicles(ctx):
+    vehicles = ctx.get("geocode_warm", ctx.get("geocode_cold"))
+    if vehicles is None:
+        vehicles = ctx["query"].assign(address="Stubstrasse 1, 9000 St. Gallen")
+    return vehicles
+
+
+def stage_tiles(ctx):
+    from tiles import TileRenderer
+
+    vehicles = _vehicles(ctx)
+    tiles = TileRenderer().render(vehicles, ("benchmark",))
+    return tiles, len(tiles)
+
+
+def stage_map(ctx):
+    from map_render import render_map_html
+    from spatial import metric_circle
+
+    vehicles = _vehicles(ctx)
+    html = render_map_html(*ORIGIN, metric_circle(*ORIGIN, RADIUS_M), vehicles)
+    return len(html), len(vehicles)
+
+
+def stage_payload(ctx):
+    from assistant_payload import build_assistant_payload
+
+    vehicles = _vehicles(ctx)
+    payload = build_assistant_payload(vehicles, location="St. Gallen")
+    return payload, len(vehicles)
+
+
+def stage_retrieval(ctx):
+    from retrieval import VehicleRetriever
+
+    vehicles = _vehicles(ctx)
+    context = VehicleRetriever(vehicles).context(QUESTION, location="St. Gallen")
+    return context, len(vehicles)
+
+
+def stage_unknown_status(ctx):
+    from assistant_payload import build_assistant_payload
+    from tiles import TileRenderer
+
+    ## Regression check: without station status every availability is a float32 NaN, which must render as unknown--------------------
+
+    selection = ctx["index"].select(*ORIGIN, RADIUS_M)
+    vehicles = selection.frame(ctx["index"]).assign(address="Stubstrasse 1, 9000 St. Gallen")
+    tiles = TileRenderer().render(vehicles, ("benchmark",))
+    payload = json.loads(build_assistant_payload(vehicles))
+    assert all("Availability unknown" in tile for tile in tiles)
+    assert all(station[-1] is None for station in payload["stations"])
+    return tiles, len(tiles)
+
+
+def stage_router(ctx):
+    from intent_router import PRESET_QUESTIONS, IntentRouter
+
+    router = IntentRouter()
+    vehicles = _vehicles(ctx)
+    for question in PRESET_QUESTIONS + [QUESTION]:
+        route = router.route(question)
+        if route.local:
+            router.answer(route, vehicles, "St. Gallen")
+    return router.stats(), len(PRESET_QUESTIONS) + 1
+
+
+def stage_assistant(ctx):
+    from openai import OpenAI
+    from assistant import AssistantManager, ChatSession
+
+    if "assistant_manager" not in ctx:
+        ctx["assistant_manager"] = AssistantManager(client=OpenAI(api_key="stub", base_url=ctx["openai_server"].base_url, max_retries=0), streaming=False)
+    answers = ChatSession(ctx["assistant_manager"]).ask(QUESTION, context=ctx.get("retrieval"))
+    return answers, 1
+
+
+STAGES = [
+    ("fetch", stage_fetch),
+    ("build", stage_build),
+    ("districts", stage_districts),
+    ("region", stage_region),
+    ("index", stage_index),
+    ("status", stage_status),
+    ("query", stage_query),
+    ("slider", stage_slider),
+    ("geocode_cold", stage_geocode_cold),
+    ("geocode_warm", stage_geocode_warm),
+    ("tiles", stage_tiles),
+    ("map", stage_map),
+    ("payload", stage_payload),
+    ("retrieval", stage_retrieval),
+    ("unknown_status", stage_unknown_status),
+    ("router", stage_router),
+    ("assistant", stage_assistant),
+]
+
+## Later stages fall back to a placeholder if these are left out; the core stages cannot be skipped--------------------
+
+OPTIONAL_STAGES = {"slider", "geocode_cold", "geocode_warm", "tiles", "map", "payload", "retrieval", "unknown_status", "router", "assistant"}
+
+
+## Runner--------------------------------------------------------------------------------
+
+def measure(stage, ctx, repeat):
+    """Time ``repeat`` calls, then one more call under tracemalloc for the peak memory."""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result, items = stage(ctx)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        stage(ctx)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "peak_mib": peak / 2**20,
+        "items": items,
+    }
+
+
+def query_points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return list(zip(ORIGIN[0] + rng.uniform(-0.02, 0.02, n), ORIGIN[1] + rng.uniform(-0.04, 0.04, n)))
+
+
+def run_scale(feed_set, repeat, skip=(), queries=200, geocode_latency=0.0):
+    """Measure all stages on one feed set. Returns {stage: measurement}."""
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, StubOpenAIServer() as openai_server:
+        ctx = {"feed_set": feed_set, "tmp": tmp, "openai_server": openai_server, "query_points": query_points(queries), "geocode_latency": geocode_latency}
+        for name, stage in STAGES:
+            if name in skip:
+                continue
+            try:
+                ctx[name], results[name] = measure(stage, ctx, repeat)
+            except ImportError as error:
+                results[name] = {"unavailable": str(error)}
+    return results
+
+
+def print_results(scale, results, out=sys.stdout):
+    print(f"\n{scale}x stations", file=out)
+    print(f"{'stage':<14}{'median ms':>12}{'min ms':>12}{'peak MiB':>11}{'items':>10}", file=out)
+    for name, result in results.items():
+        if "unavailable" in result:
+            print(f"{name:<14}  unavailable ({result['unavailable']})", file=out)
+            continue
+        print(f"{name:<14}{result['median_s'] * 1e3:>12.2f}{result['min_s'] * 1e3:>12.2f}{result['peak_mib']:>11.2f}{result['items']:>10}", file=out)
+
+
+def compare(results, baseline, threshold, memory_threshold, min_seconds):
+    """List of regressions of ``results`` against ``baseline`` (both {scale: {stage: measurement}})."""
+
+    regressions = []
+    for scale, stages in results.items():
+        for name, current in stages.items():
+            previous = baseline.get(scale, {}).get(name)
+            if previous is None or "unavailable" in current or "unavailable" in previous:
+                continue
+            if max(current["median_s"], previous["median_s"]) >= min_seconds and current["median_s"] > previous["median_s"] * threshold:
+                regressions.append(f"{scale}x {name}: {previous['median_s'] * 1e3:.2f} ms -> {current['median_s'] * 1e3:.2f} ms")
+            if current["peak_mib"] > max(previous["peak_mib"], 0.1) * memory_threshold:
+                regressions.append(f"{scale}x {name}: {previous['peak_mib']:.2f} MiB -> {current['peak_mib']:.2f} MiB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 10, 100], help="station scale-up factors")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per stage")
+    parser.add_argument("--queries", type=int, default=200, help="radius queries in the query stage")
+    parser.add_argument("--fixtures", default=fixtures.FIXTURES_DIR, help="directory with recorded GBFS feeds")
+    parser.add_argument("--skip", nargs="+", default=[], choices=sorted(OPTIONAL_STAGES), help="stages to leave out")
+    parser.add_argument("--geocode-latency", type=float, default=0.0, help="seconds the stub geocoder takes per address")
+    parser.add_argument("--save", help="write the results as JSON, e.g. as a baseline")
+    parser.add_argument("--baseline", help="compare against a saved run and exit with 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=1.25, help="allowed time ratio against the baseline")
+    parser.add_argument("--memory-threshold", type=float, default=1.25, help="allowed peak memory ratio against the baseline")
+    parser.add_argument("--min-seconds", type=float, default=0.005, help="stages faster than this are not compared on time")
+    args = parser.parse_args(argv)
+
+    feed_set = fixtures.load(args.fixtures)
+    if feed_set is None:
+        print(f"No recorded feeds in {args.fixtures}, using the synthetic feed set (record with: python benchmarks/fixtures.py record)")
+        feed_set = fixtures.synthetic()
+
+    results = {}
+    for scale in args.scales:
+        results[str(scale)] = run_scale(fixtures.scale_feeds(feed_set, scale), args.repeat, args.skip, args.queries, args.geocode_latency)
+        print_results(scale, results[str(scale)])
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.memory_threshold, args.min_seconds)
+        if regressions:
+            print("\nRegressions against " + args.baseline + ":\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions against " + args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+## Benchmark: startup time--------------------------------------------------------------------------------
+"""Import time of the app and its dependencies, each measured in a fresh interpreter.
+
+A container restart starts from a cold interpreter, so every measurement runs in its
+own subprocess and nothing is shared through ``sys.modules``. The app modules are
+timed including everything they import at module level. With ``--first-run`` the
+first script run of the app (up to the address input) is timed as well, through
+Streamlit's AppTest.
+
+Run from the repository root:
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 5 --first-run
+    python benchmarks/bench_startup.py --save startup.json
+
+To compare against an older version, run the same command in a checkout of it (e.g.
+``git worktree add /tmp/welink-old <commit>``) and compare the two outputs.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_SCRIPT = os.path.join(REPO_DIR, "sourcecode_welink.py")
+
+DEPENDENCIES = ["pandas", "geopandas", "shapely", "scipy", "folium", "geopy", "openai", "requests", "streamlit"]
+APP_MODULES = [
+    "instrumentation", "tiles", "intent_router", "geocoding", "feed_cache", "districts",
+    "spatial", "welink_core", "snapshot_store", "map_render", "retrieval", "assistant",
+]
+
+_IMPORT_CODE = """
+import sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+_FIRST_RUN_CODE = """
+import sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({script!r}, default_timeout=120)
+app.run()
+print(time.perf_counter() - start)
+print(len([module for module in {heavy!r} if module in sys.modules]))
+"""
+
+
+def _run(code):
+    """stdout lines of ``code`` run in a fresh interpreter, or None if it failed (e.g. a missing dependency)."""
+
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=REPO_DIR)
+    if result.returncode != 0:
+        return None
+    return result.stdout.split()
+
+
+def time_import(module, repeat):
+    """Median seconds to import ``module`` from a cold interpreter, or None if it cannot be imported."""
+
+    timings = []
+    for _ in range(repeat):
+        output = _run(_IMPORT_CODE.format(repo=REPO_DIR, module=module))
+        if output is None:
+            return None
+        timings.append(float(output[0]))
+    return statistics.median(timings)
+
+
+def time_first_run(repeat):
+    """Median seconds of the first script run, and how many heavy dependencies it loaded."""
+
+    timings = []
+    loaded = None
+    for _ in range(repeat):
+        output = _run(_FIRST_RUN_CODE.format(repo=REPO_DIR, script=APP_SCRIPT, heavy=[module for module in DEPENDENCIES if module != "streamlit"]))
+        if output is None:
+            return None, None
+        timings.append(float(output[0]))
+        loaded = int(output[1])
+    return statistics.median(timings), loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import and first-run time of the WeLink app, each in a fresh interpreter.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--first-run", action="store_true", help="also time the first script run through streamlit's AppTest")
+    parser.add_argument("--save", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for group, modules in (("dependencies", DEPENDENCIES), ("app modules", APP_MODULES)):
+        print(f"\n{group}")
+        for module in modules:
+            seconds = time_import(module, args.repeat)
+            results[module] = seconds
+            print(f"  {module:<18}" + ("not installed" if seconds is None else f"{seconds * 1e3:9.1f} ms"))
+
+    if args.first_run:
+        seconds, loaded = time_first_run(args.repeat)
+        results["first_run"] = seconds
+        if seconds is None:
+            print("\nfirst run           unavailable (streamlit or a dependency of the first screen is missing)")
+        else:
+            print(f"\nfirst run          {seconds * 1e3:9.1f} ms, {loaded} of {len(DEPENDENCIES) - 1} heavy dependencies loaded")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+## Benchmark Fixtures--------------------------------------------------------------------------------
+"""Recorded and synthetic GBFS feeds for the offline benchmarks.
+
+Record the live feeds once (needs network access):
+
+    python benchmarks/fixtures.py record                 # into benchmarks/fixtures/gbfs
+    python benchmarks/fixtures.py record --out /tmp/gbfs
+
+Each feed is stored as the raw JSON payload (``<feed>.json``). If no recording exists,
+the benchmarks fall back to a synthetic St. Gallen sized feed set, so they always run
+offline. ``scale_feeds`` turns either into the 10× and 100× variants by adding jittered
+copies of every station.
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "gbfs")
+FIXTURE_FEEDS = ("providers", "station_information", "station_status")
+
+## Center and extent of the synthetic stations: the city of St. Gallen--------------------
+
+CENTER = (47.4233, 9.3695)
+SPREAD_DEG = (0.03, 0.06)
+
+## About 200 m, so scaled copies stay in the same neighbourhood (and region) as the original--------------------
+
+JITTER_DEG = 0.002
+
+VEHICLE_TYPES = ["Bike", "E-Bike", "E-Scooter", "E-Moped", "E-Car", "Car", "Cargo-E-Bike"]
+
+
+def record(directory=FIXTURES_DIR, feeds=FIXTURE_FEEDS):
+    """Download the current GBFS feeds and store them as fixtures."""
+
+    from feed_cache import HTTPFeedClient
+
+    client = HTTPFeedClient()
+    os.makedirs(directory, exist_ok=True)
+    for feed in feeds:
+
+        ## Store the raw payload as served--------------------
+
+        response = client.session.get(client.feed_urls[feed], timeout=30)
+        response.raise_for_status()
+        with open(os.path.join(directory, f"{feed}.json"), "wb") as f:
+            f.write(response.content)
+        print(f"{feed}: {len(response.content) / 1e6:.1f} MB")
+
+
+def load(directory=FIXTURES_DIR, feeds=FIXTURE_FEEDS):
+    """Recorded feeds as {feed: payload}, or None if the directory holds no complete recording."""
+
+    paths = {feed: os.path.join(directory, f"{feed}.json") for feed in feeds}
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+    feed_set = {}
+    for feed, path in paths.items():
+        with open(path, encoding="utf-8") as f:
+            feed_set[feed] = json.load(f)
+    return feed_set
+
+
+def _payload(data, last_updated=0):
+    return {"last_updated": last_updated, "ttl": 60, "version": "2.3", "data": data}
+
+
+def synthetic(n_stations=400, n_providers=12, seed=0):
+    """A feed set shaped like the sharedmobility.ch feeds, with stations spread over St. Gallen."""
+
+    rng = np.random.default_rng(seed)
+    providers = []
+    for i in range(n_providers):
+        providers.append({
+            "provider_id": f"provider-{i}",
+            "name": f"Provider {i}",
+            "vehicle_type": VEHICLE_TYPES[i % len(VEHICLE_TYPES)],
+            "email": f"info@provider-{i}.example" if i % 3 else None,
+            "phone_number": f"+41 71 000 00 {i:02d}" if i % 4 else None,
+            "rental_apps": {
+                "ios": {"store_uri": f"https://apps.apple.com/app/provider-{i}"},
+                "android": {"store_uri": f"https://play.google.com/store/apps/details?id=provider{i}"},
+            } if i % 5 else None,
+        })
+
+    latitudes = CENTER[0] + rng.uniform(-SPREAD_DEG[0], SPREAD_DEG[0], n_stations)
+    longitudes = CENTER[1] + rng.uniform(-SPREAD_DEG[1], SPREAD_DEG[1], n_stations)
+    owners = rng.integers(0, n_providers, n_stations)
+    stations = [
+        {"station_id": f"station-{i}", "name": f"Station {i}", "lat": float(lat), "lon": float(lon), "provider_id": f"provider-{owner}"}
+        for i, (lat, lon, owner) in enumerate(zip(latitudes, longitudes, owners))
+    ]
+    status = [
+        {"station_id": station["station_id"], "num_bikes_available": int(available), "is_renting": bool(renting), "last_reported": 0}
+        for station, available, renting in zip(stations, rng.integers(0, 8, n_stations), rng.random(n_stations) > 0.05)
+    ]
+    return {
+        "providers": _payload({"providers": providers}),
+        "station_information": _payload({"stations": stations}),
+        "station_status": _payload({"stations": status}),
+    }
+
+
+def scale_feeds(feed_set, factor, seed=0):
+    """Copy of the feed set with ``factor`` times the stations (and their status), jittered around the originals."""
+
+    if factor == 1:
+        return feed_set
+
+    rng = np.random.default_rng(seed)
+    stations = feed_set["station_information"]["data"]["stations"]
+    status = feed_set.get("station_status", {}).get("data", {}).get("stations", [])
+
+    scaled_stations = list(stations)
+    scaled_status = list(status)
+    for copy_index in range(1, factor):
+        offsets = rng.normal(0, JITTER_DEG, (len(stations), 2))
+        suffix = f"~x{copy_index}"
+        for station, (d_lat, d_lon) in zip(stations, offsets):
+            scaled_stations.append({**station, "station_id": f"{station['station_id']}{suffix}", "lat": station["lat"] + d_lat, "lon": station["lon"] + d_lon})
+        scaled_status.extend({**row, "station_id": f"{row['station_id']}{suffix}"} for row in status)
+
+    scaled = copy.copy(feed_set)
+    scaled["station_information"] = {**feed_set["station_information"], "data": {**feed_set["station_information"]["data"], "stations": scaled_stations}}
+    if "station_status" in feed_set:
+        scaled["station_status"] = {**feed_set["station_status"], "data": {**feed_set["station_status"]["data"], "stations": scaled_status}}
+    return scaled
+
+
+class FixtureClient:
+    """Stand-in for HTTPFeedClient that serves a feed set from memory.
+
+    Payloads are kept serialized and parsed on every request, so the fetch stage still
+    includes the JSON decoding the real client does.
+    """
+
+    def __init__(self, feed_set):
+        self._raw = {feed: json.dumps(payload).encode() for feed, payload in feed_set.items()}
+
+    def feed_size(self, feed_name):
+        return len(self._raw[feed_name])
+
+    def request_feed(self, feed_name):
+        return json.loads(self._raw[feed_name])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record GBFS fixtures for the offline benchmarks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="Download the current feeds as fixtures (needs network).")
+    record_parser.add_argument("--out", default=FIXTURES_DIR)
+    args = parser.parse_args(argv)
+
+    record(args.out)
+
+
+if __name__ == "__main__":
+    main()
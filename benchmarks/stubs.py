@@ -0,0 +1,227 @@
+## Offline Stubs for the Benchmarks--------------------------------------------------------------------------------
+"""Stand-ins for Nominatim and the OpenAI API, so the benchmarks never touch the network.
+
+StubGeolocator answers ``reverse`` with a made-up address after an optional fixed
+latency. StubOpenAIServer is a tiny HTTP server implementing the part of the
+Assistants API the app uses (assistants, threads, messages, runs). Runs complete
+immediately. The stub does not stream, so the client has to poll (streaming off in
+AssistantManager, or ``WELINK_ASSISTANT_STREAMING=0`` for the app). Point the OpenAI
+client to it with ``OPENAI_BASE_URL=<server.base_url>``.
+"""
+
+import itertools
+import json
+import re
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+StubLocation = namedtuple("StubLocation", ["address", "latitude", "longitude"])
+
+
+class StubGeolocator:
+    """Nominatim replacement with a deterministic address per coordinate."""
+
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+
+    def reverse(self, query, language=None, **kwargs):
+        self.calls += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        latitude, longitude = query
+        return StubLocation(f"Stubstrasse {int(abs(latitude * 1e4)) % 200 + 1}, 9000 St. Gallen, Switzerland", latitude, longitude)
+
+
+class _AssistantsState:
+    def __init__(self, answer_latency_seconds):
+        self.answer_latency_seconds = answer_latency_seconds
+        self.ids = itertools.count(1)
+        self.assistants = {}
+        self.threads = {}
+        self.runs = {}
+        self.lock = threading.Lock()
+
+    def new_id(self, prefix):
+        return f"{prefix}_stub{next(self.ids)}"
+
+
+def _message(message_id, thread_id, role, text, run_id=None):
+    return {
+        "id": message_id,
+        "object": "thread.message",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "role": role,
+        "run_id": run_id,
+        "assistant_id": None,
+        "file_ids": [],
+        "metadata": {},
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+    }
+
+
+def _run(run_id, thread_id, assistant_id, status):
+    return {
+        "id": run_id,
+        "object": "thread.run",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "assistant_id": assistant_id,
+        "status": status,
+        "model": "stub",
+        "instructions": "",
+        "tools": [],
+        "file_ids": [],
+        "metadata": {},
+        "last_error": None,
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def do_POST(self):
+        state = self.server.state
+        path = urlparse(self.path).path
+        body = self._body()
+
+        if path.endswith("/assistants"):
+            assistant = {"id": state.new_id("asst"), "object": "assistant", "created_at": 0, "name": body.get("name"),
+                         "model": body.get("model"), "instructions": body.get("instructions"), "tools": [], "file_ids": [], "metadata": {}}
+            with state.lock:
+                state.assistants[assistant["id"]] = assistant
+            return self._send(200, assistant)
+
+        match = re.search(r"/assistants/([^/]+)$", path)
+        if match:
+            with state.lock:
+                assistant = state.assistants[match.group(1)]
+                assistant.update({key: body[key] for key in ("model", "instructions") if key in body})
+            return self._send(200, assistant)
+        if path.endswith("/threads"):
+            thread_id = state.new_id("thread")
+            with state.lock:
+                state.threads[thread_id] = []
+            return self._send(200, {"id": thread_id, "object": "thread", "created_at": 0, "metadata": {}})
+
+        match = re.search(r"/threads/([^/]+)/messages$", path)
+        if match:
+            thread_id = match.group(1)
+            message = _message(state.new_id("msg"), thread_id, "user", body.get("content", ""))
+            with state.lock:
+                state.threads[thread_id].append(message)
+            return self._send(200, message)
+
+        match = re.search(r"/threads/([^/]+)/runs$", path)
+        if match:
+            if body.get("stream"):
+                return self._send(400, {"error": {"message": "The stub server does not stream", "type": "invalid_request_error"}})
+            thread_id = match.group(1)
+            if state.answer_latency_seconds:
+                time.sleep(state.answer_latency_seconds)
+            run = _run(state.new_id("run"), thread_id, body.get("assistant_id"), "completed")
+            with state.lock:
+                question = state.threads[thread_id][-1]["content"][0]["text"]["value"]
+                state.threads[thread_id].append(_message(state.new_id("msg"), thread_id, "assistant", f"Stub answer to: {question[:80]}", run["id"]))
+                state.runs[run["id"]] = run
+            return self._send(200, run)
+
+        match = re.search(r"/threads/[^/]+/runs/([^/]+)/cancel$", path)
+        if match:
+            with state.lock:
+                run = state.runs[match.group(1)]
+                run["status"] = "cancelled"
+            return self._send(200, run)
+
+        return self._send(404, {"error": {"message": f"Unknown path {path}"}})
+
+    def do_GET(self):
+        state = self.server.state
+        url = urlparse(self.path)
+
+        if url.path.endswith("/assistants"):
+            with state.lock:
+                assistants = list(state.assistants.values())[::-1]
+            return self._send(200, {
+                "object": "list",
+                "data": assistants,
+                "first_id": assistants[0]["id"] if assistants else None,
+                "last_id": assistants[-1]["id"] if assistants else None,
+                "has_more": False,
+            })
+
+        match = re.search(r"/threads/[^/]+/runs/([^/]+)$", url.path)
+        if match:
+            with state.lock:
+                return self._send(200, state.runs[match.group(1)])
+
+        match = re.search(r"/threads/([^/]+)/messages$", url.path)
+        if match:
+            query = parse_qs(url.query)
+            with state.lock:
+                messages = list(state.threads[match.group(1)])
+            after = query.get("after", [None])[0]
+            if after is not None:
+                ids = [message["id"] for message in messages]
+                messages = messages[ids.index(after) + 1:] if after in ids else messages
+            if query.get("order", ["desc"])[0] == "desc":
+                messages = messages[::-1]
+            return self._send(200, {
+                "object": "list",
+                "data": messages,
+                "first_id": messages[0]["id"] if messages else None,
+                "last_id": messages[-1]["id"] if messages else None,
+                "has_more": False,
+            })
+
+        return self._send(404, {"error": {"message": f"Unknown path {url.path}"}})
+
+
+class StubOpenAIServer:
+    """Assistants API stand-in on a local port, usable as a context manager."""
+
+    def __init__(self, host="127.0.0.1", port=0, answer_latency_seconds=0.0):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.state = _AssistantsState(answer_latency_seconds)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
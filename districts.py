@@ -0,0 +1,182 @@
+## Swiss District Boundaries--------------------------------------------------------------------------------
+"""District polygons from ch-districts.geojson, loaded once per process.
+
+Districts are addressed by their stable feature ``id`` (BFS district number)
+instead of by row position. A Region dissolves the selected districts into one
+prepared geometry and answers "which stations lie inside" for whole coordinate
+arrays with a bounding-box prefilter followed by a vectorized point-in-polygon
+test. The parsed polygons can be persisted as WKB next to the GeoJSON so a cold
+start does not need to parse the 800 KB file again.
+
+The STRtree over the districts also answers which district a coordinate lies in
+(``locate``, ``assign``), which districts a search radius touches (``near``) and which
+districts border each other (``neighbors``). The region served by the app is chosen
+with ``WELINK_DISTRICTS``: a comma separated list of district ids, ``all`` for the
+whole country, or unset for St. Gallen.
+"""
+
+import json
+import os
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+
+
+DISTRICTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ch-districts.geojson")
+
+## Canton St. Gallen (Wahlkreise 1721-1728) plus the enclosed Appenzell Innerrhoden (1600)--------------------
+# These are the districts the app always used; they used to be selected by dropping rows 0-70 and 80-147
+
+ST_GALLEN_DISTRICT_IDS = (1600, 1721, 1722, 1723, 1724, 1725, 1726, 1727, 1728)
+
+ALL_DISTRICTS = "all"
+REGION_DISTRICTS = os.environ.get("WELINK_DISTRICTS", "")
+
+## Meters per degree of latitude, for the bounding box of a search radius--------------------
+
+_METERS_PER_DEGREE = 111_195
+
+
+def _cache_path(path):
+    return os.path.splitext(path)[0] + ".wkb.npz"
+
+
+def _read_wkb_cache(path):
+    cache_path = _cache_path(path)
+    try:
+        if os.path.getmtime(cache_path) < os.path.getmtime(path):
+            return None
+        with np.load(cache_path) as cached:
+            ids, offsets, blob = cached["ids"], cached["offsets"], cached["wkb"].tobytes()
+    except (OSError, KeyError, ValueError):
+        return None
+    wkb = [blob[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+    return ids, shapely.from_wkb(wkb)
+
+
+def _write_wkb_cache(path, ids, geometries):
+    wkb = shapely.to_wkb(geometries)
+    offsets = np.cumsum([0] + [len(item) for item in wkb])
+    try:
+        np.savez(_cache_path(path), ids=ids, offsets=offsets, wkb=np.frombuffer(b"".join(wkb), dtype=np.uint8))
+    except OSError:
+        pass
+
+
+class Districts:
+    """All district polygons of the GeoJSON, indexed by BFS district number."""
+
+    def __init__(self, ids, geometries):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.geometries = np.asarray(geometries, dtype=object)
+        self._position = {int(district_id): i for i, district_id in enumerate(self.ids)}
+        self.tree = STRtree(self.geometries)
+        self._neighbors = None
+
+    @classmethod
+    def load(cls, path=DISTRICTS_PATH, use_cache=True):
+        """Load the districts, preferring the WKB cache when it is newer than the GeoJSON."""
+
+        cached = _read_wkb_cache(path) if use_cache else None
+        if cached is not None:
+            return cls(*cached)
+
+        with open(path, encoding="utf-8") as f:
+            features = json.load(f)["features"]
+
+        ids = np.array([int(feature["id"]) for feature in features], dtype=np.int64)
+        geometries = np.array([shape(feature["geometry"]) for feature in features], dtype=object)
+
+        if use_cache:
+            _write_wkb_cache(path, ids, geometries)
+        return cls(ids, geometries)
+
+    def geometry(self, district_id):
+        return self.geometries[self._position[int(district_id)]]
+
+    def region(self, district_ids=None):
+        """Dissolve the given districts (all of them if None) into one Region."""
+
+        if district_ids is None:
+            district_ids = self.ids.tolist()
+        missing = [d for d in district_ids if int(d) not in self._position]
+        if missing:
+            raise KeyError(f"Unknown district id(s): {missing}")
+        return Region(district_ids, shapely.union_all([self.geometry(d) for d in district_ids]), districts=self)
+
+    def assign(self, longitudes, latitudes):
+        """District id of every point, -1 for points outside all districts."""
+
+        points = shapely.points(np.asarray(longitudes, dtype=np.float64), np.asarray(latitudes, dtype=np.float64))
+        district_of = np.full(len(points), -1, dtype=np.int64)
+        point_positions, tree_positions = self.tree.query(points, predicate="within")
+
+        ## A point on a shared border lies in two districts, the first one wins--------------------
+
+        district_of[point_positions[::-1]] = self.ids[tree_positions[::-1]]
+        return district_of
+
+    def locate(self, longitude, latitude):
+        """Id of the district containing the point, or None."""
+
+        district_id = self.assign([longitude], [latitude])[0]
+        return None if district_id < 0 else int(district_id)
+
+    def near(self, latitude, longitude, meters):
+        """Ids of the districts that may hold points within ``meters`` of (latitude, longitude)."""
+
+        d_lat = meters / _METERS_PER_DEGREE
+        d_lon = d_lat / max(np.cos(np.radians(latitude)), 1e-6)
+        box = shapely.box(longitude - d_lon, latitude - d_lat, longitude + d_lon, latitude + d_lat)
+        return self.ids[self.tree.query(box, predicate="intersects")].tolist()
+
+    def neighbors(self, district_id):
+        """Ids of the districts sharing a border with ``district_id``."""
+
+        if self._neighbors is None:
+            left, right = self.tree.query(self.geometries, predicate="intersects")
+            neighbors = {int(district_id): [] for district_id in self.ids}
+            for i, j in zip(left, right):
+                if i != j:
+                    neighbors[int(self.ids[i])].append(int(self.ids[j]))
+            self._neighbors = neighbors
+        return self._neighbors.get(int(district_id), [])
+
+
+def region_district_ids(value=REGION_DISTRICTS):
+    """District ids configured by ``WELINK_DISTRICTS`` (None for the whole country)."""
+
+    value = value.strip()
+    if not value:
+        return ST_GALLEN_DISTRICT_IDS
+    if value.lower() == ALL_DISTRICTS:
+        return None
+    return tuple(int(district_id) for district_id in value.split(",") if district_id.strip())
+
+
+class Region:
+    """A dissolved, prepared region geometry with a fast vectorized containment test."""
+
+    def __init__(self, district_ids, geometry, districts=None):
+        self.district_ids = tuple(int(d) for d in district_ids)
+        self.districts = districts
+        self.geometry = geometry
+        shapely.prepare(self.geometry)
+        self.bounds = self.geometry.bounds
+
+    def contains(self, longitudes, latitudes):
+        """Boolean mask of the points lying inside the region."""
+
+        x = np.asarray(longitudes, dtype=np.float64)
+        y = np.asarray(latitudes, dtype=np.float64)
+
+        ## Cheap bounding-box prefilter; only the candidates get the exact polygon test--------------------
+
+        min_x, min_y, max_x, max_y = self.bounds
+        mask = (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+        candidates = np.flatnonzero(mask)
+        if len(candidates):
+            mask[candidates] = shapely.contains_xy(self.geometry, x[candidates], y[candidates])
+        return mask
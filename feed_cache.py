@@ -0,0 +1,283 @@
+## GBFS Feed Cache--------------------------------------------------------------------------------
+"""Process-wide cache for the sharedmobility.ch GBFS feeds.
+
+All Streamlit sessions share one FeedCache. Entries are keyed by feed name and
+expire according to the ``last_updated`` and ``ttl`` fields every GBFS payload
+publishes, so the upstream is asked at most once per published update no matter
+how many users are rerunning the app. Sessions that hit a stale entry at the same
+time wait on one in-flight fetch instead of starting their own.
+
+``get_many`` refreshes several feeds concurrently, so a refresh takes about as long
+as the slowest feed instead of the sum of all of them. The feeds are downloaded by
+HTTPFeedClient over one pooled keep-alive session with gzip and conditional requests
+(ETag / If-Modified-Since); a feed that did not change is not parsed again and keeps
+its version. The version of a feed is a digest of its ``data`` section, not the fetch
+time or ``last_updated`` (which publishers bump on every poll), so a refresh that
+brings the same content does not invalidate anything built from it. Every feed has its own timeout, and a feed that fails does not keep the
+others from being served.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger("welink.feeds")
+
+GBFS_URL = "https://sharedmobility.ch/gbfs.json"
+GBFS_LANGUAGE = "en"
+
+## (connect, read) timeouts in seconds; free_bike_status is by far the largest feed--------------------
+
+DEFAULT_FEED_TIMEOUT = (3.05, 10)
+FEED_TIMEOUTS = {"free_bike_status": (3.05, 30)}
+MAX_CONCURRENT_FEEDS = 8
+
+## Some feeds publish ttl=0, which would turn the cache into a pass-through--------------------
+
+MIN_TTL_SECONDS = 15
+DEFAULT_TTL_SECONDS = 60
+
+
+def feed_expiry(payload, fetched_at, min_ttl=MIN_TTL_SECONDS):
+    """Return the unix time at which a fetched GBFS payload becomes stale."""
+
+    ttl = payload.get("ttl")
+    ttl = DEFAULT_TTL_SECONDS if ttl is None else max(float(ttl), min_ttl)
+
+    ## The gbfs client may already have turned last_updated into a datetime--------------------
+
+    last_updated = payload.get("last_updated")
+    if isinstance(last_updated, datetime):
+        last_updated = last_updated.timestamp()
+    try:
+        published_at = float(last_updated)
+    except (TypeError, ValueError):
+        published_at = fetched_at
+
+    ## Never trust a skewed upstream clock beyond one ttl, and never expire before min_ttl--------------------
+
+    expires_at = min(published_at + ttl, fetched_at + ttl)
+    return max(expires_at, fetched_at + min_ttl)
+
+
+class HTTPFeedClient:
+    """Downloads GBFS feeds over one pooled keep-alive session, with conditional requests."""
+
+    def __init__(self, url=GBFS_URL, language=GBFS_LANGUAGE, session=None, timeouts=None, default_timeout=DEFAULT_FEED_TIMEOUT):
+        self.url = url
+        self.language = language
+        self.timeouts = {**FEED_TIMEOUTS, **(timeouts or {})}
+        self.default_timeout = default_timeout
+        self._validators = {}
+        self._lock = threading.Lock()
+
+        ## One connection pool for all feeds, large enough for all concurrent downloads--------------------
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_CONCURRENT_FEEDS, pool_maxsize=MAX_CONCURRENT_FEEDS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        session.headers.setdefault("Accept-Encoding", "gzip, deflate")
+        self.session = session
+
+        self.feed_urls = self._discover()
+
+    def _discover(self):
+        """Feed name to URL from gbfs.json (GBFS 2.x lists the feeds per language, 3.x does not)."""
+
+        data = self._get(self.url, self.default_timeout).json()["data"]
+        feeds = data["feeds"] if "feeds" in data else data.get(self.language, next(iter(data.values())))["feeds"]
+        return {feed["name"]: feed["url"] for feed in feeds}
+
+    def _get(self, url, timeout, headers=None):
+        response = self.session.get(url, timeout=timeout, headers=headers)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    def request_feed(self, feed_name):
+        """Return the parsed payload of ``feed_name``.
+
+        If the server answers 304 Not Modified, the previously returned payload object is
+        returned again, so callers can tell an unchanged feed by identity.
+        """
+
+        url = self.feed_urls[feed_name]
+        with self._lock:
+            validator = self._validators.get(feed_name)
+
+        headers = {}
+        if validator is not None:
+            etag, last_modified, _ = validator
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        response = self._get(url, self.timeouts.get(feed_name, self.default_timeout), headers)
+        if response.status_code == 304 and validator is not None:
+            return validator[2]
+
+        payload = response.json()
+        with self._lock:
+            self._validators[feed_name] = (response.headers.get("ETag"), response.headers.get("Last-Modified"), payload)
+        return payload
+
+
+def content_version(payload):
+    """Digest of the ``data`` section of a payload, the same for every fetch of the same content."""
+
+    data = payload.get("data") if isinstance(payload, dict) else payload
+    return hashlib.blake2b(json.dumps(data, separators=(",", ":"), default=str).encode(), digest_size=12).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("payload", "fetched_at", "expires_at", "version")
+
+    def __init__(self, payload, fetched_at, expires_at, version):
+        self.payload = payload
+        self.fetched_at = fetched_at
+        self.expires_at = expires_at
+        self.version = version
+
+
+class FeedCache:
+    """Thread-safe, single-flight cache of GBFS feeds keyed by feed name."""
+
+    def __init__(self, client_factory=None, clock=time.time, min_ttl=MIN_TTL_SECONDS):
+        self._client_factory = client_factory or HTTPFeedClient
+        self._client = None
+        self._clock = clock
+        self._min_ttl = min_ttl
+        self._entries = {}
+        self._feed_locks = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0, "not_modified": 0, "stale_served": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _feed_lock(self, feed_name):
+        with self._lock:
+            return self._feed_locks.setdefault(feed_name, threading.Lock())
+
+    def _get_client(self):
+
+        ## Building the client downloads gbfs.json, so it is done once and shared as well--------------------
+
+        with self._feed_lock("gbfs.json"):
+            if self._client is None:
+                self._client = self._client_factory()
+            return self._client
+
+    def _fresh_entry(self, feed_name):
+        entry = self._entries.get(feed_name)
+        if entry is not None and entry.expires_at > self._clock():
+            return entry
+        return None
+
+    def get(self, feed_name):
+        """Return the payload of ``feed_name``, fetching it only if the cached copy is stale."""
+
+        entry = self._fresh_entry(feed_name)
+        if entry is not None:
+            self._count("hits")
+            return entry.payload
+
+        with self._feed_lock(feed_name):
+
+            ## Another session may have refreshed the feed while we were waiting for the lock--------------------
+
+            entry = self._fresh_entry(feed_name)
+            if entry is not None:
+                self._count("hits")
+                return entry.payload
+
+            previous = self._entries.get(feed_name)
+            try:
+                payload = self._get_client().request_feed(feed_name)
+            except Exception:
+
+                ## Keep serving the last good copy if the upstream is temporarily unavailable--------------------
+
+                if previous is None:
+                    raise
+                self._count("stale_served")
+                return previous.payload
+
+            fetched_at = self._clock()
+
+            ## An unchanged feed keeps its version, so nothing built from it has to be rebuilt--------------------
+
+            if previous is not None and payload is previous.payload:
+                previous.expires_at = feed_expiry(payload, fetched_at, self._min_ttl)
+                self._count("not_modified")
+                return payload
+
+            self._entries[feed_name] = _Entry(payload, fetched_at, feed_expiry(payload, fetched_at, self._min_ttl), content_version(payload))
+            self._count("misses" if previous is None else "refreshes")
+            return payload
+
+    def _get_or_none(self, feed_name):
+        try:
+            return self.get(feed_name)
+        except Exception:
+            logger.exception("Could not fetch the %s feed", feed_name)
+            return None
+
+    def get_many(self, feed_names, max_workers=MAX_CONCURRENT_FEEDS):
+        """Return {feed: payload} for all ``feed_names``, fetching the stale ones concurrently.
+
+        A feed that fails and has no cached copy is left out of the result (and logged);
+        the others are still returned.
+        """
+
+        payloads = {}
+        stale = []
+        for feed_name in feed_names:
+            entry = self._fresh_entry(feed_name)
+            if entry is not None:
+                self._count("hits")
+                payloads[feed_name] = entry.payload
+            else:
+                stale.append(feed_name)
+
+        if len(stale) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(stale)), thread_name_prefix="gbfs") as pool:
+                fetched = dict(zip(stale, pool.map(self._get_or_none, stale)))
+        else:
+            fetched = {feed_name: self._get_or_none(feed_name) for feed_name in stale}
+
+        payloads.update((feed_name, payload) for feed_name, payload in fetched.items() if payload is not None)
+        return payloads
+
+    def stale(self, feed_names):
+        """The feeds of ``feed_names`` that are not cached or have expired, without fetching anything."""
+
+        return [feed_name for feed_name in feed_names if self._fresh_entry(feed_name) is None]
+
+    def version(self, feed_name):
+        """Return the content version of the cached copy of ``feed_name`` (None if never fetched)."""
+
+        entry = self._entries.get(feed_name)
+        return None if entry is None else entry.version
+
+    def stats(self):
+        """Return a copy of the hit/miss/refresh counters."""
+
+        with self._lock:
+            return dict(self._stats)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
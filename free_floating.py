@@ -0,0 +1,75 @@
+## Free-floating Vehicles (free_bike_status)--------------------------------------------------------------------------------
+"""Compact ingestion of the GBFS ``free_bike_status`` feed.
+
+Cities like Zurich have thousands of free-floating bikes and scooters, the whole
+Swiss feed tens of thousands. Vehicles are parsed straight into columnar arrays
+(float32 coordinates, categorical provider ids). Only the rentable vehicles in the
+served region are kept, and those are capped at ``max_vehicles`` to keep memory
+bounded; a cap that cuts vehicles is logged. Provider details are only joined by
+``provider_id`` for the vehicles a query actually returns (see MobilitySnapshot.frame).
+Radius queries use the same StationIndex and haversine path as the stations.
+
+Free-floating vehicles are enabled per region by BFS district number, e.g.
+
+    WELINK_FREE_FLOATING_DISTRICTS=112,113 streamlit run sourcecode_welink.py
+"""
+
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from spatial import StationIndex
+
+
+FREE_FLOATING_DISTRICTS = frozenset(int(d) for d in os.environ.get("WELINK_FREE_FLOATING_DISTRICTS", "").split(",") if d.strip())
+FREE_FLOATING_MAX_VEHICLES = int(os.environ.get("WELINK_FREE_FLOATING_MAX_VEHICLES", 200_000))
+
+FREE_FLOATING_INFORMATION = "Free-floating vehicle"
+
+logger = logging.getLogger("welink.free_floating")
+
+
+def free_floating_enabled(district_ids, enabled_districts=FREE_FLOATING_DISTRICTS):
+    return bool(enabled_districts.intersection(district_ids))
+
+
+def parse_free_bike_status(bikes, region=None, max_vehicles=FREE_FLOATING_MAX_VEHICLES):
+    """Columnar table of the rentable vehicles in ``region`` (all if None) of a parsed ``free_bike_status`` bike list."""
+
+    n = len(bikes)
+    latitudes = np.fromiter((bike["lat"] for bike in bikes), dtype=np.float64, count=n)
+    longitudes = np.fromiter((bike["lon"] for bike in bikes), dtype=np.float64, count=n)
+
+    ## Reserved and disabled vehicles cannot be rented, and vehicles outside the region are never shown, so both are dropped before the cap--------------------
+
+    keep = np.fromiter((not (bike.get("is_reserved") or bike.get("is_disabled")) for bike in bikes), dtype=bool, count=n)
+    if region is not None:
+        keep &= region.contains(longitudes, latitudes)
+    kept = np.flatnonzero(keep)
+    if len(kept) > max_vehicles:
+        logger.warning("free_bike_status: %d rentable vehicles in the region, keeping the first %d (WELINK_FREE_FLOATING_MAX_VEHICLES)", len(kept), max_vehicles)
+        kept = kept[:max_vehicles]
+
+    return pd.DataFrame({
+        "station_id": pd.array([bikes[i].get("bike_id") for i in kept.tolist()], dtype="string"),
+        "latitude": latitudes[kept].astype(np.float32),
+        "longitude": longitudes[kept].astype(np.float32),
+        "provider_id": pd.Categorical([bikes[i].get("provider_id") for i in kept.tolist()]),
+    })
+
+
+class FreeFloatingFleet:
+    """One snapshot of free-floating vehicles in a region with its spatial index.
+
+    The table comes from ``parse_free_bike_status``, which already kept only the
+    vehicles in the region.
+    """
+
+    def __init__(self, vehicles):
+        self.vehicles = vehicles
+        self.index = StationIndex(vehicles["latitude"].to_numpy(), vehicles["longitude"].to_numpy())
+
+    def __len__(self):
+        return len(self.vehicles)
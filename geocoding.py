@@ -0,0 +1,385 @@
+## Geocoding Caches--------------------------------------------------------------------------------
+"""Persistent geocoding caches for station addresses and the address box.
+
+Station addresses come from the free but slow Nominatim API. Stations almost never
+move, so every resolved address is stored in a local SQLite database keyed by the
+rounded station coordinates and shared by all sessions and restarts. Entries older
+than ``max_age_days`` are resolved again.
+
+Addresses typed by users go through ForwardGeocoder: a normalized-query LRU, the same
+SQLite database and an optional offline gazetteer (CSV/Parquet with street, number,
+lat, lon). A geocode only takes an exact gazetteer match; prefix and fuzzy matching are
+only used for suggestions, a close match would silently pick a neighboring house
+number. Nominatim is only the fallback.
+
+Warm the cache for a region before going live:
+
+    python geocoding.py warm-up                     # St. Gallen
+    python geocoding.py warm-up --districts 261 262
+"""
+
+import argparse
+import bisect
+import difflib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, namedtuple
+
+
+GEOCODE_DB_PATH = os.environ.get("WELINK_GEOCODE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "geocode_cache.sqlite"))
+GEOCODE_MAX_AGE_DAYS = float(os.environ.get("WELINK_GEOCODE_MAX_AGE_DAYS", 30))
+
+GAZETTEER_PATH = os.environ.get("WELINK_GAZETTEER", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.csv"))
+
+## 5 decimals are about 1 m, well below the precision of the station coordinates--------------------
+
+COORDINATE_PRECISION = 5
+ADDRESS_NOT_FOUND = "No address found."
+
+## SQLite limits the number of bound parameters per statement--------------------
+
+_SQL_CHUNK = 500
+
+
+## Same interface as the geopy Location the app used before (address, latitude, longitude)--------------------
+
+GeocodedLocation = namedtuple("GeocodedLocation", ["address", "latitude", "longitude"])
+
+
+def coordinate_key(latitude, longitude, precision=COORDINATE_PRECISION):
+    return f"{float(latitude):.{precision}f},{float(longitude):.{precision}f}"
+
+
+def _connect(path):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    return connection
+
+
+## Query normalization--------------------
+
+_ABBREVIATIONS = [
+    (re.compile(r"str\.?(?=\s|$)"), "strasse"),
+    (re.compile(r"\bst\.?\s*gallen\b"), "st gallen"),
+    (re.compile(r"\bhbf\b"), "hauptbahnhof"),
+]
+
+
+def normalize_query(query):
+    """Lowercase, fold accents and umlauts, expand common abbreviations and collapse separators."""
+
+    text = unicodedata.normalize("NFKD", str(query).casefold().replace("ß", "ss"))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    for pattern, replacement in _ABBREVIATIONS:
+        text = pattern.sub(replacement, text)
+    text = re.sub(r"[,;/]+", " ", text)
+    return " ".join(text.split())
+
+
+class ReverseGeocodeCache:
+    """SQLite backed cache in front of Nominatim reverse geocoding."""
+
+    def __init__(self, path=GEOCODE_DB_PATH, max_age_days=GEOCODE_MAX_AGE_DAYS, geolocator=None, precision=COORDINATE_PRECISION, clock=time.time,
+                 min_delay_seconds=1):
+        self.path = path
+        self.max_age_seconds = max_age_days * 86400
+        self.precision = precision
+        self.min_delay_seconds = min_delay_seconds
+        self._clock = clock
+        self._geolocator = geolocator
+        self._reverse = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+        self._connection = _connect(path)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS reverse_geocode ("
+                "key TEXT PRIMARY KEY, address TEXT NOT NULL, resolved_at REAL NOT NULL)"
+            )
+
+    def _resolver(self):
+
+        ## Nominatim allows one request per second, the rate limiter keeps warm-ups within the usage policy--------------------
+
+        if self._reverse is None:
+            from geopy.extra.rate_limiter import RateLimiter
+            from geopy.geocoders import Nominatim
+            geolocator = self._geolocator or Nominatim(user_agent="address_finder")
+            self._reverse = RateLimiter(geolocator.reverse, min_delay_seconds=self.min_delay_seconds, max_retries=2, swallow_exceptions=True)
+        return self._reverse
+
+    def lookup_many(self, keys):
+        """Return {key: address} for all keys with a cached, unexpired address."""
+
+        oldest = self._clock() - self.max_age_seconds
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _SQL_CHUNK):
+                chunk = keys[start:start + _SQL_CHUNK]
+                rows = self._connection.execute(
+                    f"SELECT key, address FROM reverse_geocode WHERE resolved_at >= ? AND key IN ({','.join('?' * len(chunk))})",
+                    [oldest, *chunk],
+                )
+                found.update(rows)
+        return found
+
+    def store(self, key, address):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO reverse_geocode (key, address, resolved_at) VALUES (?, ?, ?)",
+                (key, address, self._clock()),
+            )
+
+    def resolve(self, latitude, longitude):
+        """Ask Nominatim for the address of one coordinate and store it."""
+
+        location = self._resolver()((latitude, longitude), language="en")
+        if location is None:
+
+            ## Timeouts are not cached, so the coordinate is retried on the next rerun--------------------
+
+            return ADDRESS_NOT_FOUND
+        address = location.address or ADDRESS_NOT_FOUND
+        self.store(coordinate_key(latitude, longitude, self.precision), address)
+        return address
+
+    def addresses(self, latitudes, longitudes, resolve_missing=True):
+        """Return the address of every coordinate, resolving only the ones not in the cache."""
+
+        keys = [coordinate_key(lat, lon, self.precision) for lat, lon in zip(latitudes, longitudes)]
+        found = self.lookup_many(keys)
+        with self._lock:
+            self._stats["hits"] += len(found)
+            self._stats["misses"] += len(set(keys)) - len(found)
+
+        if resolve_missing:
+            for key, lat, lon in zip(keys, latitudes, longitudes):
+                if key not in found:
+                    found[key] = self.resolve(lat, lon)
+
+        return [found.get(key, ADDRESS_NOT_FOUND) for key in keys]
+
+    def stats(self):
+        """Return a copy of the hit/miss counters of ``addresses`` (per distinct coordinate)."""
+
+        with self._lock:
+            return dict(self._stats)
+
+    def warm_up(self, latitudes, longitudes, progress=None):
+        """Resolve every coordinate not yet cached. Returns the number of new lookups."""
+
+        keys = [coordinate_key(lat, lon, self.precision) for lat, lon in zip(latitudes, longitudes)]
+        found = self.lookup_many(keys)
+        missing = {key: (lat, lon) for key, lat, lon in zip(keys, latitudes, longitudes) if key not in found}
+
+        for i, (lat, lon) in enumerate(missing.values(), start=1):
+            self.resolve(lat, lon)
+            if progress:
+                progress(i, len(missing))
+        return len(missing)
+
+
+## Offline address index--------------------------------------------------------------------------------
+
+class Gazetteer:
+    """In-memory street + number index loaded from a local CSV or Parquet file.
+
+    Expected columns: ``street``, ``lat``, ``lon`` and optionally ``number`` and ``city``.
+    """
+
+    def __init__(self, labels, latitudes, longitudes):
+        entries = {}
+        for label, lat, lon in zip(labels, latitudes, longitudes):
+            entries.setdefault(normalize_query(label), (label, float(lat), float(lon)))
+        self._keys = sorted(entries)
+        self._entries = entries
+
+    @classmethod
+    def load(cls, path=GAZETTEER_PATH):
+        """Load the gazetteer, or return None if the file does not exist."""
+
+        if not path or not os.path.exists(path):
+            return None
+
+        import pandas as pd
+
+        table = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path, dtype=str)
+        labels = table["street"].fillna("").astype(str)
+        if "number" in table:
+            labels = labels + " " + table["number"].fillna("").astype(str)
+        if "city" in table:
+            labels = labels.str.strip() + ", " + table["city"].fillna("").astype(str)
+        return cls(labels.str.strip(" ,"), table["lat"], table["lon"])
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _location(self, key):
+        label, lat, lon = self._entries[key]
+        return GeocodedLocation(label, lat, lon)
+
+    def exact(self, normalized):
+        if normalized in self._entries:
+            return self._location(normalized)
+
+        ## "Street 1" should also find the entry stored as "Street 1, City"--------------------
+
+        matches = self.prefix(normalized + " ", limit=1)
+        return matches[0] if matches else None
+
+    def prefix(self, normalized, limit=5):
+        """Entries whose normalized label starts with ``normalized`` (binary search on sorted keys)."""
+
+        start = bisect.bisect_left(self._keys, normalized)
+        matches = []
+        for key in self._keys[start:start + limit]:
+            if not key.startswith(normalized):
+                break
+            matches.append(self._location(key))
+        return matches
+
+    def fuzzy(self, normalized, limit=5, cutoff=0.85):
+        """Close matches for typos, compared only against keys sharing the first letter."""
+
+        if not normalized:
+            return []
+        start = bisect.bisect_left(self._keys, normalized[0])
+        end = bisect.bisect_left(self._keys, chr(ord(normalized[0]) + 1))
+        return [self._location(key) for key in difflib.get_close_matches(normalized, self._keys[start:end], n=limit, cutoff=cutoff)]
+
+    def suggest(self, query, limit=5):
+        normalized = normalize_query(query)
+        return self.prefix(normalized, limit) or self.fuzzy(normalized, limit, cutoff=0.6)
+
+
+class ForwardGeocoder:
+    """Address box geocoding: LRU, then gazetteer, then SQLite, then Nominatim."""
+
+    def __init__(self, path=GEOCODE_DB_PATH, gazetteer=None, geolocator=None, lru_size=1024, max_age_days=GEOCODE_MAX_AGE_DAYS, clock=time.time,
+                 min_delay_seconds=1):
+        self.gazetteer = gazetteer
+        self.max_age_seconds = max_age_days * 86400
+        self.lru_size = lru_size
+        self.min_delay_seconds = min_delay_seconds
+        self._lru = OrderedDict()
+        self._geolocator = geolocator
+        self._geocode = None
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        self._connection = _connect(path)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS forward_geocode ("
+                "query TEXT PRIMARY KEY, address TEXT NOT NULL, latitude REAL NOT NULL, longitude REAL NOT NULL, resolved_at REAL NOT NULL)"
+            )
+
+    def geocode(self, query):
+        """Return a GeocodedLocation for the query, or None if nothing was found."""
+
+        normalized = normalize_query(query)
+        if not normalized:
+            return None
+
+        with self._lock:
+            location = self._lru.get(normalized)
+            if location is not None:
+                self._lru.move_to_end(normalized)
+                return location
+
+        location = self._lookup(query, normalized)
+
+        ## Failed lookups are not kept, the next click asks again--------------------
+
+        if location is not None:
+            with self._lock:
+                self._lru[normalized] = location
+                if len(self._lru) > self.lru_size:
+                    self._lru.popitem(last=False)
+        return location
+
+    def suggest(self, query, limit=5):
+        if self.gazetteer is None:
+            return []
+        return self.gazetteer.suggest(query, limit)
+
+    def _resolver(self):
+
+        ## Like ReverseGeocodeCache: one request per second, a batch of addresses from welink_cli.py stays within the usage policy--------------------
+        # Failed requests are retried and then swallowed, the address counts as not found and is not cached
+
+        if self._geocode is None:
+            from geopy.extra.rate_limiter import RateLimiter
+            from geopy.geocoders import Nominatim
+            geolocator = self._geolocator or Nominatim(user_agent="geocoding_app")
+            self._geocode = RateLimiter(geolocator.geocode, min_delay_seconds=self.min_delay_seconds, max_retries=2, swallow_exceptions=True)
+        return self._geocode
+
+    def _lookup(self, query, normalized):
+        if self.gazetteer is not None:
+
+            ## Fuzzy matches are only suggestions: "Rosenbergstrasse 20" is close to "Rosenbergstrasse 2", but a different house--------------------
+
+            location = self.gazetteer.exact(normalized)
+            if location is not None:
+                return location
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT address, latitude, longitude FROM forward_geocode WHERE query = ? AND resolved_at >= ?",
+                (normalized, self._clock() - self.max_age_seconds),
+            ).fetchone()
+        if row is not None:
+            return GeocodedLocation(*row)
+
+        found = self._resolver()(query)
+        if found is None:
+            return None
+
+        location = GeocodedLocation(found.address, found.latitude, found.longitude)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO forward_geocode (query, address, latitude, longitude, resolved_at) VALUES (?, ?, ?, ?, ?)",
+                (normalized, *location, self._clock()),
+            )
+        return location
+
+
+## Warm-up command--------------------------------------------------------------------------------
+
+def _region_stations(district_ids):
+    from districts import Districts
+    from feed_cache import FeedCache
+
+    stations = FeedCache().get("station_information").get("data").get("stations")
+    latitudes = [station["lat"] for station in stations]
+    longitudes = [station["lon"] for station in stations]
+    mask = Districts.load().region(district_ids).contains(longitudes, latitudes)
+    return [lat for lat, keep in zip(latitudes, mask) if keep], [lon for lon, keep in zip(longitudes, mask) if keep]
+
+
+def main(argv=None):
+    from districts import ST_GALLEN_DISTRICT_IDS
+
+    parser = argparse.ArgumentParser(description="Manage the persistent reverse-geocoding cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    warm = subparsers.add_parser("warm-up", help="Pre-resolve the address of every station in a region.")
+    warm.add_argument("--districts", nargs="+", type=int, default=list(ST_GALLEN_DISTRICT_IDS), help="BFS district numbers of the region")
+    warm.add_argument("--db", default=GEOCODE_DB_PATH)
+    warm.add_argument("--max-age-days", type=float, default=GEOCODE_MAX_AGE_DAYS)
+    args = parser.parse_args(argv)
+
+    latitudes, longitudes = _region_stations(args.districts)
+    cache = ReverseGeocodeCache(path=args.db, max_age_days=args.max_age_days)
+    resolved = cache.warm_up(latitudes, longitudes, progress=lambda i, n: print(f"\r{i}/{n}", end="", flush=True))
+    print(f"\n{len(latitudes)} stations in region, {resolved} addresses resolved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+## Hot-Path Instrumentation--------------------------------------------------------------------------------
+"""Timing spans, counters and sizes per rerun, per session and per process.
+
+Every rerun of the app gets a Rerun from ``Metrics.start_rerun``. Pipeline stages and
+external calls are wrapped in ``rerun.span(name)``; a span can carry attributes such
+as payload sizes or whether a cache was hit. ``Metrics.finish`` adds the rerun to the
+per-session and per-process totals and, if configured, appends it as one JSON line.
+``Metrics.prometheus`` renders the process totals in the Prometheus text exposition
+format, which can be written to a file for the node exporter's textfile collector.
+
+A Streamlit fragment rerun only runs the fragment, with the globals (and so the Rerun)
+of the last full script run, which is already finished. ``Metrics.fragment_rerun``
+gives such a run a Rerun of its own, finished when the fragment is done.
+
+Recording is off unless ``WELINK_METRICS=1``. While it is off, ``start_rerun`` returns
+a shared no-op rerun whose spans cost one method call each.
+
+    WELINK_METRICS=1                            # record and show the debug panel
+    WELINK_METRICS_JSONL=/var/log/welink.jsonl  # one line per rerun
+    WELINK_METRICS_PROM=/var/lib/node_exporter/welink.prom
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+METRICS_ENABLED = os.environ.get("WELINK_METRICS", "") not in ("", "0", "false")
+METRICS_JSONL = os.environ.get("WELINK_METRICS_JSONL") or None
+METRICS_PROM = os.environ.get("WELINK_METRICS_PROM") or None
+
+## Attributes with these suffixes are summed up in the totals, everything else only kept per rerun--------------------
+
+SUMMED_SUFFIXES = ("_bytes", "_hits", "_misses", "_count")
+
+
+class Span:
+    __slots__ = ("name", "start", "duration", "attributes")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start = None
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Rerun:
+    """Spans and counters of one script run."""
+
+    enabled = True
+
+    def __init__(self, session_id, clock=time.time):
+        self.session_id = session_id
+        self.started_at = clock()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.counters = {}
+
+    def span(self, name, **attributes):
+        span = Span(name, attributes)
+        self.spans.append(span)
+        return span
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self):
+        """The rerun as a JSON-serializable dict."""
+
+        return {
+            "session": self.session_id,
+            "started_at": self.started_at,
+            "duration_s": self.duration,
+            "spans": [
+                {"name": span.name, "duration_s": span.duration, **span.attributes}
+                for span in self.spans if span.duration is not None
+            ],
+            "counters": dict(self.counters),
+        }
+
+
+class _NullRerun:
+    enabled = False
+    spans = ()
+    counters = {}
+
+    def span(self, name, **attributes):
+        return _NULL_SPAN
+
+    def count(self, name, value=1):
+        pass
+
+
+NULL_RERUN = _NullRerun()
+
+
+class Totals:
+    """Count, total and maximum duration per span name, plus summed counters and attributes."""
+
+    def __init__(self):
+        self.spans = {}
+        self.counters = {}
+        self.reruns = 0
+
+    def add(self, rerun):
+        self.reruns += 1
+        for span in rerun.spans:
+            if span.duration is None:
+                continue
+            count, total, maximum = self.spans.get(span.name, (0, 0.0, 0.0))
+            self.spans[span.name] = (count + 1, total + span.duration, max(maximum, span.duration))
+            for key, value in span.attributes.items():
+                if key.endswith(SUMMED_SUFFIXES) and isinstance(value, (int, float)):
+                    self._add_counter(f"{span.name}_{key}", value)
+        for name, value in rerun.counters.items():
+            self._add_counter(name, value)
+
+    def _add_counter(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def rows(self):
+        """One row per span name for display, slowest total first."""
+
+        return sorted(
+            ({"stage": name, "count": count, "total ms": round(total * 1e3, 2), "mean ms": round(total / count * 1e3, 2), "max ms": round(maximum * 1e3, 2)}
+             for name, (count, total, maximum) in self.spans.items()),
+            key=lambda row: -row["total ms"],
+        )
+
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() else "_" for c in name.lower()).strip("_")
+
+
+class Metrics:
+    """Process-wide recorder, shared by all sessions."""
+
+    def __init__(self, enabled=METRICS_ENABLED, jsonl_path=METRICS_JSONL, prometheus_path=METRICS_PROM):
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.totals = Totals()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def start_rerun(self, session_id=None):
+        return Rerun(session_id) if self.enabled else NULL_RERUN
+
+    @contextmanager
+    def fragment_rerun(self, rerun, session_totals=None):
+        """The Rerun a fragment records into: ``rerun`` while the whole script runs, a new one when only the fragment reruns."""
+
+        if not rerun.enabled or rerun.duration is None:
+            yield rerun
+            return
+
+        fragment_rerun = self.start_rerun(rerun.session_id)
+        fragment_rerun.count("fragment_reruns")
+        try:
+            yield fragment_rerun
+        finally:
+            self.finish(fragment_rerun, session_totals)
+
+    def finish(self, rerun, session_totals=None, gauges=None):
+        """Close the rerun and add it to the session and process totals."""
+
+        if not rerun.enabled:
+            return None
+        rerun.duration = time.perf_counter() - rerun._start
+        if session_totals is not None:
+            session_totals.add(rerun)
+
+        record = rerun.record()
+        with self._lock:
+            self.totals.add(rerun)
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+        if self.prometheus_path:
+            self._write_prometheus(gauges)
+        return record
+
+    def prometheus(self, gauges=None):
+        """Process totals in the Prometheus text exposition format.
+
+        ``gauges`` maps a metric name to a number or to a dict of numbers (e.g. the
+        stats of the feed cache), which are exported as labelled values.
+        """
+
+        with self._lock:
+            spans = dict(self.totals.spans)
+            counters = dict(self.totals.counters)
+            reruns = self.totals.reruns
+
+        lines = [
+            "# HELP welink_reruns_total Script reruns recorded.",
+            "# TYPE welink_reruns_total counter",
+            f"welink_reruns_total {reruns}",
+            "# HELP welink_span_seconds Time spent per pipeline stage.",
+            "# TYPE welink_span_seconds summary",
+        ]
+        for name, (count, total, _) in sorted(spans.items()):
+            lines.append(f'welink_span_seconds_count{{stage="{name}"}} {count}')
+            lines.append(f'welink_span_seconds_sum{{stage="{name}"}} {total:.6f}')
+
+        for name, value in sorted(counters.items()):
+            metric = f"welink_{_metric_name(name)}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+
+        for name, value in sorted((gauges or {}).items()):
+            metric = f"welink_{_metric_name(name)}"
+            lines.append(f"# TYPE {metric} gauge")
+            if isinstance(value, dict):
+                lines += [f'{metric}{{key="{key}"}} {number}' for key, number in sorted(value.items()) if isinstance(number, (int, float))]
+            else:
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _write_prometheus(self, gauges):
+
+        ## Write to a temporary file and rename, so the collector never reads a half-written file--------------------
+
+        text = self.prometheus(gauges)
+        tmp_path = f"{self.prometheus_path}.tmp"
+        with self._write_lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self.prometheus_path)
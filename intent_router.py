@@ -0,0 +1,152 @@
+## Local Intent Router--------------------------------------------------------------------------------
+"""Answers the preset questions locally instead of sending them to the OpenAI assistant.
+
+Four of the five preset questions have fixed answers in the prompt and the first one
+is a group-by over the vehicles already in memory. The router matches a prompt
+against the presets (exact after normalization, or a near-duplicate by token overlap
+and sequence similarity) and answers those from templates in milliseconds. A prompt
+only counts as a near-duplicate if every content word of it appears in the preset, so
+anything that adds a place, a vehicle type or another detail ("e-bikes near the
+train station", "vehicles in Zurich") is escalated to the assistant, like everything
+else that does not match. Every decision is logged to the
+``welink.router`` logger and counted, so we can see how much traffic skips the LLM.
+"""
+
+import difflib
+import logging
+import re
+import threading
+import unicodedata
+
+
+logger = logging.getLogger("welink.router")
+
+PRESET_QUESTIONS = [
+    "What types of vehicles are currently available for rent in my area?",
+    "How can I reserve a specific vehicle or check its availability for a particular date and time?",
+    "What are the rental rates and are there any ongoing promotions or discounts?",
+    "Can you provide details on the pickup and drop-off locations near me?",
+    "What is the process for extending my rental period, and are there any additional charges associated with it?",
+]
+
+## The fixed answers of questions 2-5, as given to the assistant in the prompt--------------------
+
+FIXED_ANSWERS = {
+    1: "To reserve a vehicle 1. download the app, the links to the ios and andorid app are provided on the tiles.\n"
+       "2. Create a user account in the app. 3. Type in the address of the car that you found on WeLink 4. rent the vehicle.",
+    2: "Currently you dont have any information about pricing. Users have to check the app.",
+    3: "Currently you dont have any information about pricing. Users have to check the app.",
+    4: "Users have to check the app.",
+}
+
+CLOSING = "good travel 🛵"
+
+## A prompt counts as a near-duplicate of a preset above this similarity, if it has no content words the preset does not have--------------------
+
+MATCH_THRESHOLD = 0.75
+
+_STOPWORDS = {"a", "an", "the", "is", "are", "and", "or", "of", "for", "to", "in", "on", "my", "me", "i", "can", "you", "it", "with", "any", "there", "what", "how", "do"}
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFKD", str(text).casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+
+def _tokens(normalized):
+    return {token for token in normalized.split() if token not in _STOPWORDS}
+
+
+_PRESETS = [(_normalize(question), _tokens(_normalize(question))) for question in PRESET_QUESTIONS]
+
+
+def similarity(normalized, preset_index):
+    """Similarity in [0, 1] between a normalized prompt and a preset question."""
+
+    preset_text, preset_tokens = _PRESETS[preset_index]
+    if normalized == preset_text:
+        return 1.0
+    tokens = _tokens(normalized)
+    overlap = len(tokens & preset_tokens) / len(tokens | preset_tokens) if tokens or preset_tokens else 0.0
+    sequence = difflib.SequenceMatcher(None, normalized, preset_text).ratio()
+    return max(overlap, sequence)
+
+
+def covers(normalized, preset_index):
+    """Whether every content word of a normalized prompt appears in the preset question."""
+
+    return _tokens(normalized) <= _PRESETS[preset_index][1]
+
+
+class Route:
+    __slots__ = ("preset", "score")
+
+    def __init__(self, preset, score):
+        self.preset = preset
+        self.score = score
+
+    @property
+    def local(self):
+        return self.preset is not None
+
+
+def vehicles_summary(vehicles, location=None, max_stations_per_provider=5):
+    """Answer to preset 1: the available vehicles grouped by vehicle type and provider."""
+
+    if vehicles is None or len(vehicles) == 0:
+        return "Sorry, there are currently no vehicles available in your area. " + CLOSING
+
+    where = f" near **{location}**" if location else ""
+    lines = [f"These vehicles are currently available for rent{where}:", ""]
+
+    for vehicle_type, by_type in vehicles.groupby("vehicle type", sort=True, dropna=False):
+        lines.append(f"**{vehicle_type}** ({len(by_type)})")
+        for provider, by_provider in by_type.groupby("provider name", sort=True, dropna=False):
+            nearest = by_provider.sort_values("Distance").head(max_stations_per_provider)
+            places = ", ".join(f"{information} ({round(distance)} m)" for information, distance in zip(nearest["further information"], nearest["Distance"]))
+            more = f" and {len(by_provider) - len(nearest)} more" if len(by_provider) > len(nearest) else ""
+            lines.append(f"- {provider}: {places}{more}")
+        lines.append("")
+
+    lines.append("You find the links to the providers' apps on the tiles above. " + CLOSING)
+    return "\n".join(lines)
+
+
+class IntentRouter:
+    """Routes prompts to a local template answer or to the assistant."""
+
+    def __init__(self, threshold=MATCH_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._counts = {"local": 0, "assistant": 0}
+
+    def route(self, prompt):
+        normalized = _normalize(prompt)
+        scores = [similarity(normalized, i) for i in range(len(_PRESETS))]
+        best = max(range(len(scores)), key=scores.__getitem__)
+
+        ## Words the preset does not have change the question, however similar the rest is--------------------
+
+        local = scores[best] >= self.threshold and covers(normalized, best)
+        route = Route(best if local else None, scores[best])
+        with self._lock:
+            self._counts["local" if route.local else "assistant"] += 1
+        logger.info("route=%s preset=%s score=%.2f prompt=%r", "local" if route.local else "assistant", route.preset, route.score, prompt[:200])
+        return route
+
+    def answer(self, route, vehicles=None, location=None):
+        """Template answer of a local route."""
+
+        if route.preset == 0:
+            return vehicles_summary(vehicles, location)
+        return FIXED_ANSWERS[route.preset] + "\n\n" + CLOSING
+
+    def stats(self):
+        """Number of prompts answered locally and escalated to the assistant."""
+
+        with self._lock:
+            counts = dict(self._counts)
+        total = counts["local"] + counts["assistant"]
+        counts["local share"] = counts["local"] / total if total else 0.0
+        return counts
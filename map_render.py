@@ -0,0 +1,237 @@
+## Interactive Map Rendering--------------------------------------------------------------------------------
+"""Folium map of the vehicles around the user's location.
+
+The map is rendered to HTML once per (location, radius, data snapshot) by the caller's
+cache, so reruns that do not change the map (slider moves, chat messages) reuse the
+same HTML. Marker coordinates are shipped as compact rounded arrays inlined into the
+page. Vehicle types with many points are clustered on the server per zoom level and
+the browser only draws the clusters of the current zoom level that lie inside the
+viewport. The raw points are only inlined as well if clustering stops reducing them
+before the maximum zoom level; otherwise the page holds just the clusters, so its
+size grows with the number of clusters rather than with the number of vehicles.
+"""
+
+import json
+
+import folium
+import numpy as np
+from branca.element import CssLink, MacroElement
+from folium.plugins import FastMarkerCluster
+from jinja2 import Template
+
+
+## Custom markers for the different vehicle types--------------------
+
+ICON_URLS = {
+    "Car": "https://symbl-world.akamaized.net/i/webp/b9/1633134b6b244b50ccea983841c0f0.webp",
+    "E-Car": "https://cdn3d.iconscout.com/3d/premium/thumb/car-8341798-6648075.png",
+    "E-CargoBike": "https://em-content.zobj.net/source/apple/271/bicycle_1f6b2.png",
+}
+CLUSTER_CSS = {
+    "markerclustercss": "https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/1.1.0/MarkerCluster.css",
+    "markerclusterdefaultcss": "https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/1.1.0/MarkerCluster.Default.css",
+}
+LOCATION_ICON_URL = "https://em-content.zobj.net/source/apple/232/man-standing_1f9cd-200d-2642-fe0f.png"
+
+## Above this many markers per vehicle type, clusters are computed on the server--------------------
+
+SERVER_CLUSTER_THRESHOLD = 2000
+CLUSTER_MIN_ZOOM = 8
+CLUSTER_MAX_ZOOM = 17
+CLUSTER_CELL_PX = 60
+
+## 5 decimals are about 1 m, enough for a marker--------------------
+
+COORDINATE_DECIMALS = 5
+
+
+def get_icon_url_for_vehicle_type(vehicle_type):
+    return ICON_URLS.get(vehicle_type, "DEFAULT_ICON_URL")
+
+
+def _compact(values):
+    return np.round(np.asarray(values, dtype=np.float64), COORDINATE_DECIMALS)
+
+
+def grid_clusters(latitudes, longitudes, zoom, cell_px=CLUSTER_CELL_PX):
+    """Cluster points into web-mercator grid cells of ``cell_px`` pixels at ``zoom``.
+
+    Returns an (n, 3) array of cluster centroid latitude, longitude and point count.
+    """
+
+    lat = np.asarray(latitudes, dtype=np.float64)
+    lon = np.asarray(longitudes, dtype=np.float64)
+    scale = 256 * 2 ** zoom / cell_px
+
+    sin_lat = np.clip(np.sin(np.radians(lat)), -0.9999, 0.9999)
+    cell_x = np.floor((lon + 180) / 360 * scale).astype(np.int64)
+    cell_y = np.floor((0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * scale).astype(np.int64)
+
+    _, cluster, counts = np.unique(cell_x * (int(scale) + 1) + cell_y, return_inverse=True, return_counts=True)
+    cluster = cluster.ravel()
+    centroid_lat = np.bincount(cluster, weights=lat) / counts
+    centroid_lon = np.bincount(cluster, weights=lon) / counts
+    return np.column_stack([_compact(centroid_lat), _compact(centroid_lon), counts])
+
+
+def cluster_pyramid(latitudes, longitudes, min_zoom=CLUSTER_MIN_ZOOM, max_zoom=CLUSTER_MAX_ZOOM):
+    """Clusters per zoom level. Levels where clustering no longer reduces the points are left out,
+    the browser shows the raw points from there on."""
+
+    levels = {}
+    for zoom in range(min_zoom, max_zoom + 1):
+        clusters = grid_clusters(latitudes, longitudes, zoom)
+        if len(clusters) > 0.8 * len(latitudes):
+            break
+        levels[zoom] = clusters.tolist()
+    return levels
+
+
+class ServerClusterLayer(MacroElement):
+    """Leaflet layer drawing precomputed clusters of the current zoom level inside the viewport."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function () {
+            var map = {{ this._parent.get_name() }};
+            var levels = {{ this.levels_json }};
+            var points = {{ this.points_json }};
+            var layer = L.layerGroup().addTo(map);
+            var icon = L.icon({iconUrl: {{ this.icon_url_json }}, iconSize: [50, 50], iconAnchor: [25, 50], popupAnchor: [0, -50]});
+
+            function clusterIcon(count) {
+                var size = count < 10 ? "small" : (count < 100 ? "medium" : "large");
+                return L.divIcon({html: "<div><span>" + count + "</span></div>", className: "marker-cluster marker-cluster-" + size, iconSize: L.point(40, 40)});
+            }
+
+            function draw() {
+                var zoom = map.getZoom(), bounds = map.getBounds().pad(0.2);
+                var rows = levels[Math.min(Math.max(zoom, {{ this.min_zoom }}), {{ this.max_zoom }})] || points;
+                layer.clearLayers();
+                for (var i = 0; i < rows.length; i++) {
+                    var row = rows[i], latlng = L.latLng(row[0], row[1]);
+                    if (!bounds.contains(latlng)) { continue; }
+                    var count = row.length > 2 ? row[2] : 1;
+                    var marker = L.marker(latlng, {icon: count > 1 ? clusterIcon(count) : icon});
+                    if (count > 1) {
+                        marker.on("click", function (e) { map.setView(e.latlng, map.getZoom() + 2); });
+                    }
+                    layer.addLayer(marker);
+                }
+            }
+
+            map.on("zoomend moveend", draw);
+            draw();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, latitudes, longitudes, icon_url):
+        super().__init__()
+        self._name = "ServerClusterLayer"
+        levels = cluster_pyramid(latitudes, longitudes)
+        self.min_zoom = min(levels) if levels else CLUSTER_MAX_ZOOM + 1
+        self.levels_json = json.dumps(levels, separators=(",", ":"))
+
+        ## With clusters up to the maximum zoom level, zooming in further keeps the finest clusters and the raw points are never drawn--------------------
+
+        if CLUSTER_MAX_ZOOM in levels:
+            self.max_zoom = CLUSTER_MAX_ZOOM
+            self.points_json = "[]"
+        else:
+            self.max_zoom = 99
+            self.points_json = json.dumps(np.column_stack([_compact(latitudes), _compact(longitudes)]).tolist(), separators=(",", ":"))
+        self.icon_url_json = json.dumps(icon_url)
+
+    def render(self, **kwargs):
+        super().render(**kwargs)
+
+        ## Reuse the marker cluster styles for the cluster bubbles--------------------
+
+        figure = self.get_root()
+        for name, url in CLUSTER_CSS.items():
+            figure.header.add_child(CssLink(url), name=name)
+
+
+def _marker_callback(icon_url):
+
+    ## JavaScript callback for custom markers--------------------
+    # Documentation: https://python-visualization.github.io/folium/latest/user_guide/plugins/marker_cluster.html
+
+    return f"""
+    function (row) {{
+        var icon, marker;
+        icon = L.icon({{
+            iconUrl: "{icon_url}",
+            iconSize: [50, 50],
+            iconAnchor: [25, 50],
+            popupAnchor: [0, -50]
+        }});
+        marker = L.marker(new L.LatLng(row[0], row[1]), {{icon: icon}});
+        return marker;
+    }};
+    """
+
+
+def create_interactive_map(latitude, longitude, circle_geometry, vehicles, draw_circle=True):
+    """Folium map centered on the user with the walking radius and one marker layer per vehicle type.
+
+    With ``draw_circle=False`` (distances on foot) the straight-line circle only sets the
+    zoom; the map then shows just the vehicles that are reachable on foot.
+    """
+
+    ## We use the Folium map and load our current location--------------------
+
+    m = folium.Map(
+        location=[latitude, longitude],
+        zoom_start=9,
+
+        ## Map style: Open Street Map Style--------------------
+
+        tiles="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png",
+        attr="OpenStreetMap"
+
+        ## To change the map style to satelite--------------------
+        #tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
+        #attr="Esri World Imagery"
+    )
+
+    ## Map the walking radius circle--------------------
+    # A walk can only be shorter than the radius along a straight line, so in walking mode the circle would promise too much
+
+    circle = folium.GeoJson(circle_geometry)
+    if draw_circle:
+        circle.add_to(m)
+
+    ## Define custom icon for current location marker--------------------
+
+    custom_icon = folium.CustomIcon(icon_image=LOCATION_ICON_URL, icon_size=(50, 50))
+    folium.Marker([latitude, longitude], icon=custom_icon).add_to(m)
+
+    ## Fit the map bounds to the circle's bounds (zoom level)--------------------
+
+    m.fit_bounds(circle.get_bounds())
+
+    ## Add the markers of each vehicle type--------------------
+
+    for v_type, group in vehicles.groupby("vehicle type", sort=False):
+        icon_url = get_icon_url_for_vehicle_type(v_type)
+
+        if len(group) > SERVER_CLUSTER_THRESHOLD:
+            m.add_child(ServerClusterLayer(group["latitude"].to_numpy(), group["longitude"].to_numpy(), icon_url))
+        else:
+
+            ## FastMarkers enable faster loading by clustering in the browser--------------------
+
+            data = np.column_stack([_compact(group["latitude"]), _compact(group["longitude"])]).tolist()
+            m.add_child(FastMarkerCluster(data=data, callback=_marker_callback(icon_url)))
+
+    return m
+
+
+def render_map_html(latitude, longitude, circle_geometry, vehicles, draw_circle=True):
+    """Standalone HTML document of the map, ready for streamlit.components.v1.html."""
+
+    figure = folium.Figure()
+    figure.add_child(create_interactive_map(latitude, longitude, circle_geometry, vehicles, draw_circle))
+    return figure.render()
@@ -0,0 +1,121 @@
+## Local Retrieval over the Vehicle Snapshot--------------------------------------------------------------------------------
+"""Selects the vehicles relevant to a question so they can be inlined into the chat message.
+
+Instead of uploading every station in range and letting the assistant search the file
+remotely, VehicleRetriever ranks the vehicles locally: BM25 over provider, vehicle type,
+address and further information, narrowed by filters parsed from the question (a
+vehicle type that is mentioned, a distance like "within 500 m"). The top-k rows are
+serialized with the compact assistant payload format and sent as context with the
+question, so nothing has to be uploaded or indexed per session.
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from assistant_payload import build_assistant_payload
+
+
+RETRIEVAL_TOP_K = 15
+CONTEXT_MAX_BYTES = 8_000
+
+TEXT_FIELDS = ["provider name", "vehicle type", "address", "further information"]
+
+_DISTANCE = re.compile(r"(\d+(?:[.,]\d+)?)\s*(km|kilometers?|kilometres?|m|meters?|metres?)\b")
+
+
+def tokenize(text):
+    text = unicodedata.normalize("NFKD", str(text).casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r"[a-z0-9]+", text)
+
+
+def parse_max_distance(question):
+    """Distance limit in meters mentioned in the question ("within 800 m", "2 km"), or None."""
+
+    match = _DISTANCE.search(str(question).casefold())
+    if match is None:
+        return None
+    value = float(match.group(1).replace(",", "."))
+    return value * 1000 if match.group(2).startswith("k") else value
+
+
+class VehicleRetriever:
+    """BM25 index over the text fields of one vehicle table (sorted nearest first)."""
+
+    def __init__(self, vehicles, k1=1.2, b=0.75):
+        self.vehicles = vehicles
+        self.k1 = k1
+        self.b = b
+
+        text = vehicles[TEXT_FIELDS].fillna("").astype(str).agg(" ".join, axis=1) if len(vehicles) else []
+        self._documents = [Counter(tokenize(document)) for document in text]
+        self._lengths = np.array([sum(document.values()) for document in self._documents], dtype=np.float64)
+        self._average_length = self._lengths.mean() if len(self._lengths) else 0.0
+
+        self._postings = {}
+        for position, document in enumerate(self._documents):
+            for term, count in document.items():
+                self._postings.setdefault(term, []).append((position, count))
+
+        ## Vehicle types of this snapshot, matched against the question as token sequences--------------------
+
+        types = vehicles["vehicle type"].dropna().unique() if len(vehicles) else []
+        self._type_tokens = {vehicle_type: tokenize(vehicle_type) for vehicle_type in types}
+        self._distances = vehicles["Distance"].to_numpy(dtype=np.float64) if len(vehicles) else np.empty(0)
+
+    def scores(self, question):
+        """BM25 score of every vehicle for the question."""
+
+        scores = np.zeros(len(self._documents))
+        n = len(self._documents)
+        for term in set(tokenize(question)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            positions = np.fromiter((position for position, _ in postings), dtype=np.int64, count=len(postings))
+            counts = np.fromiter((count for _, count in postings), dtype=np.float64, count=len(postings))
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[positions] / self._average_length)
+            scores[positions] += idf * counts * (self.k1 + 1) / (counts + norm)
+        return scores
+
+    def mentioned_types(self, question):
+        tokens = " " + " ".join(tokenize(question)) + " "
+        return [vehicle_type for vehicle_type, type_tokens in self._type_tokens.items() if type_tokens and f" {' '.join(type_tokens)} " in tokens]
+
+    def search(self, question, k=RETRIEVAL_TOP_K, available=None, renting=None):
+        """The ``k`` most relevant vehicles for the question, best first (nearest first on ties).
+
+        ``available`` and ``renting`` are the current availability of the indexed rows,
+        in their order; the index itself is only rebuilt when the stations change.
+        """
+
+        if not len(self.vehicles):
+            return self.vehicles
+
+        keep = np.ones(len(self.vehicles), dtype=bool) if renting is None else np.asarray(renting, dtype=bool).copy()
+        types = self.mentioned_types(question)
+        if types:
+            keep &= self.vehicles["vehicle type"].isin(types).to_numpy()
+        max_distance = parse_max_distance(question)
+        if max_distance is not None:
+            keep &= self._distances <= max_distance
+
+        ## Rows are sorted by distance, so a stable sort on the score keeps nearer vehicles first on ties--------------------
+
+        scores = self.scores(question)
+        candidates = np.flatnonzero(keep)
+        order = candidates[np.argsort(-scores[candidates], kind="stable")][:k]
+        result = self.vehicles.iloc[order]
+        if available is not None:
+            result = result.assign(**{"vehicles available": np.asarray(available)[order]})
+        return result
+
+    def context(self, question, location=None, k=RETRIEVAL_TOP_K, max_bytes=CONTEXT_MAX_BYTES, available=None, renting=None):
+        """Compact JSON context of the relevant vehicles to send along with the question."""
+
+        return build_assistant_payload(self.search(question, k, available, renting), location=location, max_bytes=max_bytes).decode()
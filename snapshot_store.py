@@ -0,0 +1,412 @@
+## Persisted Snapshots--------------------------------------------------------------------------------
+"""Versioned, columnar snapshots of the region's stations on disk, and the service that keeps them current.
+
+Every snapshot the app builds is written to ``WELINK_SNAPSHOT_DIR`` as one directory
+of NumPy arrays: the stations of the region already filtered and sorted by district,
+the free-floating vehicles, the station status, and the providers as JSON. Text
+columns are stored as categorical codes plus their categories. Loading maps the
+arrays into memory and wraps them without copying, so the numeric columns are read
+from the page cache and shared by all processes on the machine; only the categories
+and the spatial index are built per process.
+
+Feed versions are digests of the feed content (see feed_cache.py), so a refresh that
+brings the same data neither rebuilds nor stores anything. A snapshot whose stations
+did not change (only the station status) hard-links the station files of the
+previous one instead of writing them again.
+
+SnapshotService serves the current MobilitySnapshot. At startup it loads the latest
+stored snapshot right away and refreshes the feeds in a background thread; only a
+cold start without any stored snapshot waits for the network. Stale feeds are
+refreshed in the background as well, while sessions keep using the previous
+snapshot.
+
+Replay mode runs the app against a stored snapshot without ever refreshing it:
+
+    WELINK_REPLAY_SNAPSHOT=20240501T081500-000 streamlit run sourcecode_welink.py
+    WELINK_REPLAY_SNAPSHOT=latest streamlit run sourcecode_welink.py
+    python snapshot_store.py list
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from free_floating import FreeFloatingFleet
+from station_status import StationStatusStore
+from welink_core import MobilitySnapshot, build_providers, feed_versions
+
+
+logger = logging.getLogger("welink.snapshots")
+
+SNAPSHOT_DIR = os.environ.get("WELINK_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots"))
+SNAPSHOT_KEEP = int(os.environ.get("WELINK_SNAPSHOT_KEEP", 500))
+REPLAY_SNAPSHOT = os.environ.get("WELINK_REPLAY_SNAPSHOT") or None
+
+## A changed station status is written at most every 5 minutes--------------------
+
+SNAPSHOT_MIN_INTERVAL_SECONDS = 300
+SNAPSHOT_FORMAT = 2
+LATEST = "latest"
+
+## Tables that only depend on the station and provider feeds, shared with the previous snapshot when those did not change--------------------
+
+STATION_TABLES = ("stations", "district_of", "free_floating")
+
+
+def _strings(values):
+    return np.array(["" if value is None else str(value) for value in values], dtype=str)
+
+
+def _numbers(values, dtype=np.float64):
+    return np.array([np.nan if value is None else value for value in values], dtype=dtype)
+
+
+def _status_columns(stations):
+    available = [station.get("num_vehicles_available", station.get("num_bikes_available")) for station in stations]
+    return {
+        "station_id": _strings([station.get("station_id") for station in stations]),
+        "num_vehicles_available": _numbers(available),
+        "is_renting": np.array([bool(station.get("is_renting", True)) for station in stations], dtype=bool),
+        "last_reported": _numbers([station.get("last_reported") if isinstance(station.get("last_reported"), (int, float)) else None for station in stations]),
+    }
+
+
+def _table_columns(table):
+    """Arrays of a table: numbers as they are, everything else as categorical codes plus the categories."""
+
+    arrays, categories = {}, {}
+    for column in table.columns:
+        values = table[column]
+        if not isinstance(values.dtype, pd.CategoricalDtype) and values.dtype.kind in "biuf":
+            arrays[column] = values.to_numpy()
+            continue
+        values = values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype(object).astype("category")
+        arrays[column] = values.cat.codes.to_numpy()
+        categories[column] = values.cat.categories.tolist()
+    return arrays, categories
+
+
+def _table_from_columns(arrays, categories):
+    """Wrap the (memory-mapped) arrays into a table without copying the numeric columns or the codes."""
+
+    return pd.DataFrame({
+        column: pd.Categorical.from_codes(values, categories[column]) if column in categories else values
+        for column, values in arrays.items()
+    }, copy=False)
+
+
+def _region_key(region):
+    return sorted(int(district_id) for district_id in region.district_ids)
+
+
+class StoredSnapshot:
+    """One snapshot read back from disk; the columns are memory-mapped arrays."""
+
+    def __init__(self, snapshot_id, meta, providers, tables):
+        self.id = snapshot_id
+        self.created_at = meta["created_at"]
+        self.versions = meta["versions"]
+        self.region = meta["region"]
+        self.providers = providers
+        self.stations = tables["stations"]
+        self.district_of = tables["district_of"]["district"].to_numpy()
+        self.free_floating = tables.get("free_floating")
+        self.status = tables.get("status")
+
+    def version(self, feeds):
+        return tuple(self.versions.get(feed) for feed in feeds)
+
+    def status_rows(self):
+        """The station status as the list of dicts StationStatusStore.apply expects."""
+
+        if self.status is None:
+            return []
+        status = self.status
+        available = [None if np.isnan(value) else value for value in status["num_vehicles_available"].tolist()]
+        last_reported = [None if np.isnan(value) else value for value in status["last_reported"].tolist()]
+        return [
+            {"station_id": station_id, "num_vehicles_available": count, "is_renting": renting, "last_reported": reported}
+            for station_id, count, renting, reported in zip(status["station_id"].astype(str).tolist(), available, status["is_renting"].tolist(), last_reported)
+        ]
+
+
+class SnapshotStore:
+    """Directory of snapshots, one subdirectory per snapshot, named so that they sort by time."""
+
+    def __init__(self, directory=SNAPSHOT_DIR, keep=SNAPSHOT_KEEP, clock=time.time):
+        self.directory = directory
+        self.keep = keep
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def ids(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if not name.startswith(".") and os.path.exists(os.path.join(self.directory, name, "meta.json")))
+
+    def latest(self):
+        ids = self.ids()
+        return ids[-1] if ids else None
+
+    def resolve(self, snapshot_id):
+        """The id itself, or the newest id for ``latest``."""
+
+        if snapshot_id == LATEST:
+            snapshot_id = self.latest()
+            if snapshot_id is None:
+                raise FileNotFoundError(f"No snapshots in {self.directory}")
+        return snapshot_id
+
+    def _meta(self, snapshot_id):
+        with open(os.path.join(self.directory, snapshot_id, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def _same_stations(self, region, station_versions):
+        """Path of the latest snapshot with the same region and station feed versions, or None."""
+
+        snapshot_id = self.latest()
+        if snapshot_id is None:
+            return None
+        try:
+            meta = self._meta(snapshot_id)
+        except (OSError, ValueError):
+            return None
+        same = meta.get("format") == SNAPSHOT_FORMAT and meta.get("region") == region and all(meta["versions"].get(feed) == version for feed, version in station_versions.items())
+        return os.path.join(self.directory, snapshot_id) if same else None
+
+    def save(self, snapshot, providers, versions, status=None):
+        """Write a snapshot, the parsed ``providers`` list it was built from and the parsed station status. Returns its id."""
+
+        created_at = self._clock()
+        snapshot_id = time.strftime("%Y%m%dT%H%M%S", time.gmtime(created_at)) + f"-{int(created_at * 1000) % 1000:03d}"
+        region = _region_key(snapshot.region)
+
+        tables = {
+            "stations": _table_columns(snapshot.stations),
+            "district_of": ({"district": np.asarray(snapshot.district_of, dtype=np.int64)}, {}),
+        }
+        if snapshot.fleet is not None:
+            tables["free_floating"] = _table_columns(snapshot.fleet.vehicles)
+        if status is not None:
+            tables["status"] = (_status_columns(status), {})
+
+        with self._lock:
+            previous = self._same_stations(region, {feed: version for feed, version in versions.items() if feed != "station_status"})
+
+            ## Written to a hidden directory first and renamed, so readers never see a half-written snapshot--------------------
+
+            os.makedirs(self.directory, exist_ok=True)
+            while os.path.exists(os.path.join(self.directory, snapshot_id)):
+                snapshot_id += "+"
+            tmp_path = os.path.join(self.directory, f".{snapshot_id}.tmp")
+            os.makedirs(tmp_path)
+
+            for table, (columns, _) in tables.items():
+                os.makedirs(os.path.join(tmp_path, table))
+                for column in columns:
+                    self._write_array(tmp_path, previous, table, column, columns[column])
+            with open(os.path.join(tmp_path, "providers.json"), "w", encoding="utf-8") as f:
+                json.dump(providers, f)
+            with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    "format": SNAPSHOT_FORMAT,
+                    "created_at": created_at,
+                    "versions": versions,
+                    "region": region,
+                    "tables": {table: {"columns": list(columns), "categories": categories} for table, (columns, categories) in tables.items()},
+                }, f)
+
+            os.rename(tmp_path, os.path.join(self.directory, snapshot_id))
+            self._prune()
+        return snapshot_id
+
+    @staticmethod
+    def _write_array(path, previous, table, column, values):
+        target = os.path.join(path, table, f"{column}.npy")
+
+        ## Unchanged station tables are hard links to the files of the previous snapshot--------------------
+
+        if previous is not None and table in STATION_TABLES:
+            try:
+                os.link(os.path.join(previous, table, f"{column}.npy"), target)
+                return
+            except OSError:
+                pass
+        np.save(target, values)
+
+    def _prune(self):
+        for snapshot_id in self.ids()[:-self.keep] if self.keep else []:
+            shutil.rmtree(os.path.join(self.directory, snapshot_id), ignore_errors=True)
+
+    def load(self, snapshot_id=LATEST):
+        """Read a snapshot back, with every column memory-mapped."""
+
+        snapshot_id = self.resolve(snapshot_id)
+        path = os.path.join(self.directory, snapshot_id)
+        meta = self._meta(snapshot_id)
+        if meta.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Snapshot {snapshot_id} has an older format")
+        with open(os.path.join(path, "providers.json"), encoding="utf-8") as f:
+            providers = json.load(f)
+
+        tables = {
+            table: _table_from_columns(
+                {column: np.load(os.path.join(path, table, f"{column}.npy"), mmap_mode="r") for column in spec["columns"]},
+                spec["categories"],
+            )
+            for table, spec in meta["tables"].items()
+        }
+        return StoredSnapshot(snapshot_id, meta, providers, tables)
+
+
+class SnapshotService:
+    """The current MobilitySnapshot and station status of a region, refreshed in the background."""
+
+    def __init__(self, feed_cache, region, store=None, status_store=None, replay=REPLAY_SNAPSHOT, min_save_interval=SNAPSHOT_MIN_INTERVAL_SECONDS, clock=time.time):
+        self.feed_cache = feed_cache
+        self.region = region
+        self.store = store
+        self.status_store = status_store or StationStatusStore()
+        self.replay = replay
+        self.min_save_interval = min_save_interval
+        self.feeds = MobilitySnapshot.feeds(region)
+        self.stored_id = None
+        self._clock = clock
+        self._snapshot = None
+        self._providers = None
+        self._saved_versions = None
+        self._last_saved = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+        if replay is not None:
+            if store is None:
+                raise ValueError("Replay needs a snapshot store")
+            self._use_stored(store.load(replay))
+        elif store is not None and store.latest() is not None:
+
+            ## A damaged snapshot only costs the warm start, the feeds are fetched as on a cold start--------------------
+
+            try:
+                self._use_stored(store.load(LATEST))
+            except (OSError, ValueError, KeyError):
+                logger.exception("Could not load the latest snapshot from %s", store.directory)
+
+    def _use_stored(self, stored):
+        if stored.region != _region_key(self.region):
+            raise ValueError(f"Snapshot {stored.id} was stored for another region")
+
+        ## The stored stations are already filtered and sorted by district, they are used as mapped from disk--------------------
+
+        fleet = FreeFloatingFleet(stored.free_floating) if stored.free_floating is not None and "free_bike_status" in self.feeds else None
+        self._snapshot = MobilitySnapshot(
+            build_providers(stored.providers),
+            stored.stations,
+            self.region,
+            version=stored.version(self.feeds),
+            fleet=fleet,
+            district_of=stored.district_of,
+        )
+        self._providers = stored.providers
+        if stored.status is not None:
+            self.status_store.apply(stored.status_rows(), source_version=stored.versions.get("station_status"))
+        self._saved_versions = dict(stored.versions)
+        self.stored_id = stored.id
+
+    @property
+    def refreshing(self):
+        return self._refreshing
+
+    def current(self):
+        """Return ``(snapshot, status_store)`` without waiting for the network, unless nothing is loaded yet."""
+
+        if self.replay is not None:
+            return self._snapshot, self.status_store
+        if self._snapshot is None:
+            self.refresh()
+        elif self.feed_cache.stale(self.feeds + ("station_status",)):
+            self.refresh_in_background()
+        return self._snapshot, self.status_store
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name="snapshot-refresh", daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Background refresh of the feeds failed")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def refresh(self):
+        """Fetch the stale feeds, rebuild the snapshot if its feeds changed and store it."""
+
+        with self._refresh_lock:
+            feeds = self.feeds + ("station_status",)
+            versions = feed_versions(self.feed_cache, feeds)
+            snapshot_version = versions[:len(self.feeds)]
+
+            ## Without the base feeds the previous snapshot is kept; on a cold start from_feed_cache raises the fetch error--------------------
+
+            changed = self._snapshot is None or self._snapshot.version != snapshot_version
+            if changed and (self._snapshot is None or None not in snapshot_version[:2]):
+                self._snapshot = MobilitySnapshot.from_feed_cache(self.feed_cache, self.region)
+                self._providers = self.feed_cache.get("providers").get("data").get("providers")
+                self.stored_id = None
+            if versions[-1] is not None:
+                self.status_store.sync(self.feed_cache)
+
+            ## Nothing is written while the content is the same as in the last stored snapshot--------------------
+            # A changed station status alone is written at most every min_save_interval seconds
+
+            saved_versions = {**dict(zip(self.feeds, self._snapshot.version)), "station_status": self.status_store.source_version}
+            if self.store is None or saved_versions == self._saved_versions:
+                return
+            stations_changed = self._saved_versions is None or any(saved_versions[feed] != self._saved_versions.get(feed) for feed in self.feeds)
+            if stations_changed or self._clock() - self._last_saved >= self.min_save_interval:
+                self._save(saved_versions)
+
+    def _save(self, versions):
+        status = None
+        if versions["station_status"] is not None and self.feed_cache.version("station_status") == versions["station_status"]:
+            status = self.feed_cache.get("station_status").get("data").get("stations")
+        try:
+            self.stored_id = self.store.save(self._snapshot, self._providers, versions, status=status)
+            self._saved_versions = versions
+            self._last_saved = self._clock()
+        except OSError:
+            logger.exception("Could not write the snapshot to %s", self.store.directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the stored GBFS snapshots.")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List the stored snapshots, oldest first.")
+    args = parser.parse_args(argv)
+
+    store = SnapshotStore(args.dir)
+    for snapshot_id in store.ids():
+        with open(os.path.join(args.dir, snapshot_id, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        print(snapshot_id, " ".join(f"{feed}={version}" for feed, version in meta["versions"].items()))
+
+
+if __name__ == "__main__":
+    main()
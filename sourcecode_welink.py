@@ -2,19 +2,19 @@
 
 ## Import Packages--------------------------------------------------------------------------------
 
-import pandas as pd
-from gbfs.client import GBFSClient
+import json
+import os
+import uuid
+
 import streamlit as st
-import geopandas as gpd
-from shapely.geometry import Point
-import folium
-from folium.plugins import FastMarkerCluster
-from geopy.geocoders import Nominatim
-from streamlit_folium import folium_static
-import time
-from haversine import haversine, Unit
-import io
-from openai import OpenAI
+import streamlit.components.v1 as components
+from intent_router import PRESET_QUESTIONS, IntentRouter
+from geocoding import ForwardGeocoder, Gazetteer, ReverseGeocodeCache
+from tiles import TILE_PAGE_SIZE, TileRenderer, split_columns
+from instrumentation import Metrics, Totals
+
+## The heavy packages (pandas, shapely, scipy, folium, openai, requests) are imported where they are first needed--------------------
+# The first screen only needs a text input and a radio button, so it is shown before any of them is loaded
 
 
 
@@ -42,8 +42,8 @@ if "range_to_walk" not in st.session_state:
 if "data_loaded" not in st.session_state:
     st.session_state.data_loaded = False
 
-if "ai_file" not in st.session_state:
-    st.session_state.ai_file = None
+if "selection" not in st.session_state:
+    st.session_state.selection = None
 
 if "circle_geometry" not in st.session_state:
     st.session_state.circle_geometry = ""
@@ -57,41 +57,180 @@ if "AI_ready" not in st.session_state:
 if "show_vehicles" not in st.session_state:
     st.session_state.show_vehicles = False
 
-if "available_vehicles" not in st.session_state:
-    st.session_state.available_vehicles = False
-
 if "range_walk" not in st.session_state:
     st.session_state.range_walk = 1
 
+if "tiles_shown" not in st.session_state:
+    st.session_state.tiles_shown = TILE_PAGE_SIZE
+
+if "tiles" not in st.session_state:
+    st.session_state.tiles = {}
+
+if "walking" not in st.session_state:
+    st.session_state.walking = False
+
 for i in range(1, 6):
         prompt_name = f"prompt_{i}"
         if prompt_name not in st.session_state:
             st.session_state[prompt_name] = False
             st.session_state[f"{prompt_name}_question"] = ""
 
+## Timing spans of this rerun--------------------
+# Only recorded with WELINK_METRICS=1, otherwise every span is a no-op, see instrumentation.py
+
+@st.cache_resource
+def get_metrics():
+    return Metrics()
+
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:12]
+    st.session_state.session_metrics = Totals()
+
+metrics = get_metrics()
+rerun = metrics.start_rerun(st.session_state.session_id)
+
+def stats_delta(before, after):
+    return {f"{key}_count": after[key] - before.get(key, 0) for key in after}
+
+## Shared GBFS feed cache--------------------
+# One cache per process, shared by all sessions. It refreshes a feed only after its published ttl ran out
+
+@st.cache_resource
+def get_feed_cache():
+    from feed_cache import FeedCache
+    return FeedCache()
+
+## District boundaries--------------------
+# Parsed once per process. The served region is St. Gallen unless WELINK_DISTRICTS selects other districts (or "all")
+# Source: https://github.com/mikpan/ch-maps
+
+@st.cache_resource
+def get_districts():
+    from districts import Districts
+    return Districts.load()
+
+@st.cache_resource
+def get_region():
+    from districts import region_district_ids
+    return get_districts().region(region_district_ids())
+
+## Stations of the region with their spatial index and live availability--------------------
+# Shared by all sessions. Loaded from the latest stored snapshot at startup and refreshed in the background, see snapshot_store.py
+# The store diffs every new station_status feed against the previous one and only applies changed stations
+
+@st.cache_resource
+def get_snapshot_service():
+    from snapshot_store import SnapshotService, SnapshotStore
+    return SnapshotService(get_feed_cache(), get_region(), store=SnapshotStore())
+
+## Rendered map HTML--------------------
+# Cached by location, radius, distance mode and station snapshot, so slider moves, chat messages and availability changes do not rebuild the map
+# The map shows where the stations are, including the ones that are not renting at the moment
+
+@st.cache_data(max_entries=64)
+def render_map_html_cached(latitude, longitude, range_walk, walking, snapshot_version, _circle_geometry, _snapshot, _selection):
+    from map_render import render_map_html
+    return render_map_html(latitude, longitude, _circle_geometry, _selection.frame(_snapshot, slice(None)), draw_circle=not walking)
+
+## Streamlit fragments--------------------
+# A widget inside a fragment only reruns that fragment instead of the whole page
+
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+## Vehicle tiles--------------------
+# The static part of every tile is cached per station, availability and station snapshot and shared by all sessions
+
+@st.cache_resource
+def get_tile_renderer():
+    return TileRenderer()
+
+def show_more_tiles():
+    st.session_state.tiles_shown += TILE_PAGE_SIZE
+
+## OpenAI assistant--------------------
+# Reused by name across restarts (created only if there is none yet) and shared by all sessions, see assistant.py
+
+@st.cache_resource
+def get_assistant_manager():
+    from assistant import AssistantManager
+    return AssistantManager()
+
+## Local answers for the preset questions--------------------
+
+@st.cache_resource
+def get_intent_router():
+    return IntentRouter()
+
+## Walking network--------------------
+# Only available with WELINK_WALKING_GRAPH set to a local OSM extract of the region. Parsed once per process, see walking.py
+
+WALKING_GRAPH_PATH = os.environ.get("WELINK_WALKING_GRAPH") or None
+
+@st.cache_resource
+def get_walking_network():
+    from walking import WalkingNetwork
+    return WalkingNetwork.load(WALKING_GRAPH_PATH)
+
+## Persistent station address cache--------------------
+# Shared by all sessions and restarts, only stations without a cached address go to Nominatim
+
+@st.cache_resource
+def get_reverse_geocoder():
+    return ReverseGeocodeCache()
+
+## Vehicle tables for the chat--------------------
+# Sessions only keep a selection of the shared snapshot, the table with provider details and addresses is built from the current snapshot when it is needed
+# Addresses come from the cache only; stations that are not cached yet are resolved by the tiles, never for a whole table in a chat answer
+
+def vehicle_table(snapshot, selection, rows=None):
+    from welink_core import VEHICLE_COLUMNS, add_addresses
+    return add_addresses(selection.frame(snapshot, rows), get_reverse_geocoder(), resolve_missing=False)[VEHICLE_COLUMNS]
+
+## Local retrieval index over the vehicles around a location--------------------
+# Shared by all sessions at the same location, radius, distance mode and station snapshot
+# It indexes all stations of the selection, the current availability is passed in per question
+# Built on the first question that goes to the assistant, the preset questions never need it
+
+@st.cache_resource(max_entries=64)
+def get_vehicle_retriever(snapshot_version, latitude, longitude, range_walk, walking, _snapshot, _selection):
+    from retrieval import VehicleRetriever
+    return VehicleRetriever(vehicle_table(_snapshot, _selection, slice(None)))
+
 ## Location input--------------------
 
 col1.subheader("Where are you located?")
 
 ## Geocode location--------------------
 # To save costs, we used the much slower but free Nominatim API instead of the Google Geocoding API
+# Repeated addresses are answered from a local cache and the optional offline gazetteer, Nominatim is only the fallback
+
+@st.cache_resource
+def get_forward_geocoder():
+    return ForwardGeocoder(gazetteer=Gazetteer.load())
 
 def geocode_address(location):
-    geolocator = Nominatim(user_agent="geocoding_app")
-    location = geolocator.geocode(location)
-    return location
+    return get_forward_geocoder().geocode(location)
 
 ## Get user input address--------------------
 
-from shapely.geometry import Point
-
 location = col1.text_input("Enter the address:")
 
+## Type-ahead suggestions from the offline gazetteer (no network round-trip)--------------------
+
+if location:
+    suggestions = get_forward_geocoder().suggest(location)
+    if suggestions and suggestions[0].address.casefold() != location.casefold():
+        col1.caption("Suggestions: " + " · ".join(suggestion.address for suggestion in suggestions))
+
 range_to_walk = col1.radio(
     "How far are you willing to walk to your vehicle?",
     ["***<3 km*** :woman-walking:", "***3 to 5 km*** :man-running:", "***<10 km*** :bicyclist:"],
     captions = ["Lazy", "Short walk", "For the athletes"])
 
+## Distances along streets and paths instead of straight lines, if a walking network is configured--------------------
+
+walking_mode = WALKING_GRAPH_PATH is not None and col1.checkbox("Use walking distances along streets and paths")
+
 ## Create location search button--------------------
 
 find_location_button = col1.button("Find available vehicles")
@@ -102,7 +241,9 @@ if find_location_button:
 
         ## Geocode the address--------------------
 
-        coordinates = geocode_address(location)
+        with rerun.span("geocode_address") as span:
+            coordinates = geocode_address(location)
+            span.set(found=coordinates is not None)
         
         ## Display location in the map--------------------
 
@@ -121,16 +262,23 @@ if find_location_button:
                 circle_radius_km = 10
                 st.session_state.range_walk = 10
 
-            point = Point(coordinates.longitude, coordinates.latitude)
+            ## Metric circle for the map, a degree buffer would be an ellipse at 47°N--------------------
+
+            from spatial import metric_circle
+            circle = metric_circle(coordinates.latitude, coordinates.longitude, circle_radius_km * 1000)
 
-            ## 1 degree is approximately 111.32 km (because of earth radius; commonly used)--------------------
+            ## Detect the district of the address, queries then only search the districts around it--------------------
 
-            circle = point.buffer(circle_radius_km / 111.32)
+            district = get_districts().locate(coordinates.longitude, coordinates.latitude)
+            if district not in get_region().district_ids:
+                col1.info("This address is outside the area WeLink covers, only vehicles inside it are shown.")
 
             st.session_state.location = coordinates
             st.session_state.range_to_walk = range_to_walk
+            st.session_state.walking = walking_mode
             st.session_state.circle_geometry = circle
             st.session_state.location_found = True
+            st.session_state.tiles_shown = TILE_PAGE_SIZE
 
         else:
             st.error("Please enter a valid address.")
@@ -145,118 +293,111 @@ if st.session_state.location_found:
 
     with st.spinner("Loading the shared mobility data from Switzerland..."):
 
-        client = GBFSClient("https://sharedmobility.ch/gbfs.json", "en")
-
-        ## Get provider data--------------------
-
-        providers = client.request_feed("providers").get("data").get("providers")
-        providers = pd.DataFrame(providers)
-        providers = providers[["provider_id", "name", "vehicle_type", "rental_apps", "email", "phone_number"]]
-
-        ## Rename the columns--------------------
-
-        rename_cols = {
-            "provider_id" : "provider_id",
-            "name" : "provider name",
-            "vehicle_type" : "vehicle type",
-            "rental_apps" : "provider apps",
-            "email" : "provider email",
-            "phone_number" : "provider phone"
-        }
-
-        providers.rename(columns = rename_cols, inplace=True)
-
-        ## Set index to provider id for merging--------------------
-
-        providers.set_index("provider_id", inplace = True)
-
-        providers = providers.fillna("No information from provider.")
+        feed_cache = get_feed_cache()
 
-        ## Function to extract iOS and Android App links--------------------
+        ## Get provider and station data, merged and filtered for vehicles in the region--------------------
+        # Stale feeds are refreshed concurrently in the background, only a cold start without a stored snapshot waits for them
 
-        def extract_links(app_info, platform):
-            try:
-                return app_info[platform]["store_uri"]
-            except (TypeError, KeyError):
-                return None
+        with rerun.span("snapshot") as span:
+            feed_stats = feed_cache.stats()
+            snapshot_service = get_snapshot_service()
+            snapshot, station_status = snapshot_service.current()
+            span.set(stations_count=len(snapshot), stored=snapshot_service.stored_id, refreshing=snapshot_service.refreshing, **stats_delta(feed_stats, feed_cache.stats()))
 
-        ## Apply the function to dataframe--------------------
+        if snapshot_service.replay is not None:
+            col1.caption(f"Replaying the stored snapshot {snapshot_service.stored_id}")
 
-        providers["iOS link"] = providers["provider apps"].apply(lambda x: extract_links(x, "ios"))
-        providers["Android link"] = providers["provider apps"].apply(lambda x: extract_links(x, "android"))
-        providers = providers.drop("provider apps", axis = 1)
+        ## Query the spatial index for the vehicles within the walking radius, with live availability from station_status--------------------
+        # Once per location, radius and station snapshot; other reruns (slider moves, chat messages) reuse the distance-sorted selection
 
-        ## Get data about vehicle locations--------------------
-
-        vehicle_locations = client.request_feed("station_information").get("data").get("stations")
-        vehicle_locations = pd.DataFrame(vehicle_locations)
-        vehicle_locations = vehicle_locations[["lat", "lon", "provider_id", "station_id", "name"]]
-
-        ## Rename the columns--------------------
-
-        rename_cols = {
-            "region_id" : "region_id",
-            "station_id" : "station_id",
-            "name" : "further information",
-            "lat" : "latitude",
-            "lon" : "longitude",
-        }
-
-        vehicle_locations.rename(columns = rename_cols, inplace=True)
-
-        ## Set index to provider id for merging--------------------
-
-        vehicle_locations.set_index("provider_id", inplace = True)
-
-        ## Merge station with provider data--------------------
-
-        vehicle_locations_provider = pd.merge(vehicle_locations, providers, left_index=True, right_index=True, how="left")
-
-        ## This code snippet gets the data for scooters and bikes in switzerland. Unfortunately there are no
-        # providers providing bike and scooter data in St. Gallen. Therefore, we didn't activate the code.
-        # In Zurich for example are over +1000 bikes and scooters in the dataframe. If you want to use the code
-        # in another place in switzerland, just activate this part of the code and use also the scooter and bike data.
+        selection_key = (snapshot.version, st.session_state.location, st.session_state.range_walk, st.session_state.walking)
+        if st.session_state.get("selection_key") != selection_key:
+            with rerun.span("nearby") as span:
+                selection = snapshot.select(
+                    st.session_state.location.latitude,
+                    st.session_state.location.longitude,
+                    st.session_state.range_walk * 1000,
+                    status_store=station_status,
+                )
+                span.set(vehicles_count=len(selection), session_bytes=selection.nbytes)
+
+            ## In walking mode, the vehicles in the straight-line radius are ranked by their distance on foot--------------------
+            # A walk is never shorter than the straight line, so no vehicle within the budget is missed
+
+            if st.session_state.walking:
+                from walking import walking_selection
+                with rerun.span("walking") as span:
+                    selection = walking_selection(
+                        selection,
+                        snapshot,
+                        get_walking_network(),
+                        st.session_state.location.latitude,
+                        st.session_state.location.longitude,
+                        st.session_state.range_walk * 1000,
+                    )
+                    span.set(vehicles_count=len(selection))
+
+            ## Save the selection in session state: positions, distances and availability of the vehicles and the snapshot version--------------------
+            # The snapshot itself is shared and not referenced, every rerun resolves the selection against the current one
+
+            st.session_state.selection = selection
+            st.session_state.selection_key = selection_key
+            st.session_state.tiles = {}
+
+        ## A new station_status only patches the rows of the stations it changed, and drops their rendered tiles--------------------
+
+        elif st.session_state.selection.status_version != station_status.version:
+            with rerun.span("status_patch") as span:
+                changed_rows = st.session_state.selection.patch(snapshot, station_status)
+                for row in changed_rows.tolist():
+                    st.session_state.tiles.pop(row, None)
+                span.set(rows_count=len(changed_rows))
+        st.session_state.data_loaded = True
 
-        #bikes_and_scooters = client.request_feed("free_bike_status").get("data").get("bikes")
 
-        #bikes_and_scooters = pd.DataFrame(bikes_and_scooters)
-        #bikes_and_scooters = bikes_and_scooters[["lat", "lon", "provider_id", "rental_uris"]]
+## Create interactive Map----------------------------------------------------------------------------------------------------
 
-        #vehicle_locations_provider = pd.merge(vehicle_locations_provider, bikes_and_scooters, left_on="latitude", right_on="lat", how="outer")
-        #vehicle_locations_provider = vehicle_locations_provider.fillna("No information from provider.")
+## The map is a fragment of its own, it is only sent again when the whole page reruns--------------------
 
-        ## Filter for Vehicles in St. Gallen only--------------------
+@fragment
+def show_map(snapshot):
 
-        ## Read GeoJson of Swiss Cantons--------------------
-        # Source: https://github.com/mikpan/ch-maps
+    ## Spans go to this run's timings, or to a run of their own when only the fragment reruns--------------------
 
-        gdf = gpd.read_file("ch-districts.geojson")
+    with metrics.fragment_rerun(rerun, st.session_state.session_metrics) as fragment_rerun:
+        draw_map(snapshot, fragment_rerun)
 
-        ## Extract coordinates of Canton St. Gallen--------------------
 
-        gdf = gdf.drop(index=range(0, 71))
-        gdf = gdf.drop(index=range(80, 148))
+def draw_map(snapshot, rerun):
 
-        ## Convert Coordinates to GeoData--------------------
+    ## Get the selection from streamlit session_state--------------------
 
-        vehicle_locations_provider["geometry"] = vehicle_locations_provider.apply(lambda row: Point(row["longitude"], row["latitude"]), axis=1)
-        gdf_vehicle_locations_provider = gpd.GeoDataFrame(vehicle_locations_provider, geometry="geometry", crs="EPSG:4326")
+    selection = st.session_state.selection
 
-        ## Spatial Join to drop Coordinates outside of St. Gallen--------------------
+    ## Render the map once per location, radius and data snapshot and reuse the HTML on every other rerun--------------------
 
-        circle_polygon = st.session_state.circle_geometry
-        circle_gdf = gpd.GeoDataFrame(geometry=[circle_polygon], crs="EPSG:4326")
+    with rerun.span("map_html") as span:
+        map_html = render_map_html_cached(
+            st.session_state.location.latitude,
+            st.session_state.location.longitude,
+            st.session_state.range_walk,
+            st.session_state.walking,
+            snapshot.version,
+            st.session_state.circle_geometry,
+            snapshot,
+            selection,
+        )
+        span.set(html_bytes=len(map_html))
 
-        vehicle_locations_provider = gpd.sjoin(gdf_vehicle_locations_provider, gdf, how="inner", predicate = "within")
-        vehicle_locations_provider = gpd.sjoin(gdf_vehicle_locations_provider, circle_gdf, how="inner", predicate = "within")
+    ## Display map in column 2--------------------
 
-        ## Save file in session state--------------------
+    components.html(map_html, width=700, height=510)
 
-        st.session_state.ai_file = vehicle_locations_provider
-        st.session_state.data_loaded = True
+    ## In walking mode the selection only holds the vehicles reachable on foot, there is no circle to show the limit--------------------
 
+    if st.session_state.walking:
+        st.caption(f"Only vehicles within {st.session_state.range_walk} km on foot along streets and paths are shown.")
 
-## Create interactive Map----------------------------------------------------------------------------------------------------
 
 if st.session_state.data_loaded:
     with col2:
@@ -266,209 +407,81 @@ if st.session_state.data_loaded:
         for _ in range(2): 
             col2.markdown("<br>", unsafe_allow_html=True)
 
-        ## Get DataFrame from streamlit session_state--------------------
-
-        ai_file = st.session_state.ai_file
-
-        ## Find unique vehicle types--------------------
-
-        vehicle_types = ai_file["vehicle type"].unique()
-
-        ## Create GeoCoorinates for each longitude and latitude--------------------
-        
-        geo_df_dict = {}
-
-        for v_type in vehicle_types:
-            ai_file_filtered = ai_file[ai_file["vehicle type"] == v_type]
-            geometry = [Point(longitude, latitude) for longitude, latitude in zip(ai_file_filtered["longitude"], ai_file_filtered["latitude"])]
-            geo_df_dict[v_type] = gpd.GeoDataFrame(ai_file_filtered, geometry=geometry, crs="EPSG:4326")
-
-        ## Function to define custom markers for different vehicle types--------------------
-
-        def get_icon_url_for_vehicle_type(vehicle_type):
-            icon_mapping = {
-                "Car": "https://symbl-world.akamaized.net/i/webp/b9/1633134b6b244b50ccea983841c0f0.webp",
-                "E-Car": "https://cdn3d.iconscout.com/3d/premium/thumb/car-8341798-6648075.png",
-                "E-CargoBike": "https://em-content.zobj.net/source/apple/271/bicycle_1f6b2.png",
-            }
-            return icon_mapping.get(vehicle_type, "DEFAULT_ICON_URL")
-
-        ## Function to create the interacitve map--------------------
-
-        def create_interactive_map(geo_df_dict):
-
-            ## We use the Folium map and load our current location data we saved to the session state in the beginning--------------------
-
-            m = folium.Map(
-                location=[st.session_state.location.latitude, st.session_state.location.longitude],
-                zoom_start=9,
-
-                ## Map style: Open Street Map Style--------------------
-
-                tiles="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png",
-                attr="OpenStreetMap"
-
-                ## To change the map style to satelite--------------------
-                #tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
-                #attr="Esri World Imagery"
-            )
-
-            ## Map the walking radius circle--------------------
-
-            circle = folium.GeoJson(st.session_state.circle_geometry)
-            circle.add_to(m)
-            circle_bounds = circle.get_bounds()
-
-            ## Define custom icon for current location marker--------------------
-
-            custom_icon = folium.CustomIcon(icon_image="https://em-content.zobj.net/source/apple/232/man-standing_1f9cd-200d-2642-fe0f.png", 
-                                        icon_size=(50, 50))
-        
-            
-            folium.Marker([st.session_state.location.latitude, st.session_state.location.longitude], icon=custom_icon).add_to(m)
-
-            ## Fit the map bounds to the circle's bounds (zoom level)--------------------
-
-            m.fit_bounds(circle_bounds)
-
-            ## Loop through each vehicle type in the dictionary to add the markers of the vehicles to the map--------------------
-
-            for v_type, geo_df in geo_df_dict.items():
-
-                ## JavaScript callback for custom markers--------------------
-                # Documentation: https://python-visualization.github.io/folium/latest/user_guide/plugins/marker_cluster.html
-
-                callback = f"""
-                function (row) {{
-                    var icon, marker;
-                    icon = L.icon({{
-                        iconUrl: "{get_icon_url_for_vehicle_type(v_type)}",
-                        iconSize: [50, 50],
-                        iconAnchor: [25, 50],
-                        popupAnchor: [0, -50]
-                    }});
-                    marker = L.marker(new L.LatLng(row[0], row[1]), {{icon: icon}});
-                    return marker;
-                }};
-                """
-                
-                ## FastMarkers enable faster loading by clustering--------------------
-                
-                fm = FastMarkerCluster(data=list(zip(geo_df["latitude"], geo_df["longitude"])), callback=callback)
-                m.add_child(fm)
-
-            return m
-        
-        ## Display map in column 2--------------------
-
-        folium_map = create_interactive_map(geo_df_dict)
-        folium_static(folium_map)
+        show_map(snapshot)
         st.session_state.show_vehicles = True
 
 ## Show all available vehicles in the filtered area--------------------
+# A fragment: moving the slider or loading more tiles only reruns this part of the page, the map and the chat are not sent again
 
-if st.session_state.show_vehicles:
+@fragment
+def show_vehicle_tiles(snapshot):
 
-    with st.spinner("Geocoding Addresses"):
+    ## Slider moves and "Load more" clicks only rerun this fragment, they are recorded as runs of their own--------------------
 
-        ## Load available_vehicles from session_state--------------------
+    with metrics.fragment_rerun(rerun, st.session_state.session_metrics) as fragment_rerun:
+        draw_vehicle_tiles(snapshot, fragment_rerun)
 
-        available_vehicles = st.session_state.ai_file
 
-        ## This geocoding function, geocodes based on the latitude and longitude--------------------
-        # To save costs, we used the much slower but free Nominatim API instead of the Google Geocoding API
-
-        def get_address(latitude, longitude):
-            geolocator = Nominatim(user_agent="address_finder")
-        
-            location = geolocator.reverse((latitude, longitude), language="en")
-            return location.address
+def draw_vehicle_tiles(snapshot, rerun):
 
-        ## Apply the function to create a new "address" column--------------------
+    from welink_core import VEHICLE_COLUMNS, add_addresses
 
-        available_vehicles["address"] = available_vehicles.apply(lambda row: get_address(row["latitude"], row["longitude"]), axis=1)
-        
-        ## Keep relevant columns--------------------
-
-        available_vehicles = available_vehicles[["provider name", "further information", "latitude", "longitude", "iOS link", "address", "Android link", "provider phone", "provider email", "vehicle type"]]
+    with st.spinner("Geocoding Addresses"):
 
-        ## Load current locatin from session_state as coordinates--------------------
+        ## Load the selection from session_state--------------------
 
-        current_location = (st.session_state.location.latitude, st.session_state.location.longitude)
+        selection = st.session_state.selection
 
         ## Create a slidebar to sort for vehicles in the preferred distance in meters--------------------
 
         proximity_threshold = st.slider("Filter for closest vehicles (meters)", min_value=1, max_value=st.session_state.range_walk*1000 , value=600)
-        
-        ## Calculates distance--------------------
-        
-        available_vehicles["Distance"] = available_vehicles.apply(lambda row: haversine(current_location, (row["latitude"], row["longitude"]), unit=Unit.METERS), axis=1)
-        available_vehicles["Distance"] = available_vehicles["Distance"].round(2)
 
         ## Filter for vehicles, whose distance is smaller than the treshold set by the slidebar--------------------
+        # The distances come from the spatial index query and are already sorted, nearest first
 
-        filtered_df = available_vehicles[available_vehicles["Distance"] <= proximity_threshold].sort_values(by="Distance")
-        
-        ## Function to create visually appealing tiles, representing each row of the filtered dataframe--------------------
-
-        def create_tile(row):
-            
-            ## We used ChatGPT for HTML and CSS--------------------
-
-            return f"""
-            <div style="
-                border: 1px solid #ddd;
-                padding: 10px;
-                margin: 5px;
-                border-radius: 5px;
-                display: flex;
-                flex-direction: column;
-                width: 100%; /* Take up full width */
-                box-sizing: border-box; /* Include padding and border in the width */
-            ">
-                <h3>{row["provider name"]}</h3>
-                <p><strong>{round(row["Distance"])} meters away</strong></p>
-                <p>{row["vehicle type"]}</p>
-                <p>{row["address"]}</p>
-                <p style="color: grey;">{row["further information"]}</p>
-                <div style="display: flex; justify-content: flex-end; align-items: flex-end; gap: 10px; margin-top: auto;">
-                    <a href="{row["iOS link"]}" target="_blank">
-                        <button style="background-color: white; border: 1px solid #888; border-radius: 5px; padding: 5px 10px;">iOS link</button>
-                    </a>
-                    <a href="{row["Android link"]}" target="_blank">
-                        <button style="background-color: white; border: 1px solid #888; border-radius: 5px; padding: 5px 10px;">Android link</button>
-                    </a>
-                </div>
-            </div>
-            """
+        filtered = selection.visible(proximity_threshold)
 
         ## Create Subheader--------------------
 
-        st.subheader(f"{len(filtered_df)} available vehicles within {proximity_threshold} meters")
+        st.subheader(f"{len(filtered)} available vehicles within {proximity_threshold} meters")
 
         ## Use st.columns to create two columns and create containers for each column--------------------
         col8, col9 = st.columns(2)
         container8 = col8.empty()
         container9 = col9.empty()
 
-        ## Concatenate HTML content for each column--------------------
+        ## Render visually appealing tiles for the nearest vehicles, every even tile goes to container 8, every odd one to container 9--------------------
+        # The tiles rendered so far are kept per selection row, moving the slider only renders the ones it newly includes
+        # A station_status change only drops the tiles of the rows it changed, see the patch above
+
+        shown_rows = filtered[:st.session_state.tiles_shown].tolist()
+        rendered_tiles = st.session_state.tiles
+        missing_rows = [row for row in shown_rows if row not in rendered_tiles]
+        if missing_rows:
+
+            ## Only the new tiles are turned into a table with the provider details--------------------
 
-        html_content_col8 = ""
-        html_content_col9 = ""
+            new_vehicles = selection.frame(snapshot, missing_rows)
 
-        ## Iterate over rows of the filtered_df--------------------
+            ## Look up the station addresses, geocoding based on the latitude and longitude--------------------
+            # To save costs, we used the much slower but free Nominatim API instead of the Google Geocoding API
 
-        for i in range(len(filtered_df)):
+            reverse_geocoder = get_reverse_geocoder()
+            with rerun.span("reverse_geocode") as span:
+                geocode_stats = reverse_geocoder.stats()
+                new_vehicles = add_addresses(new_vehicles, reverse_geocoder)
+                span.set(**stats_delta(geocode_stats, reverse_geocoder.stats()))
 
-            ## Every even index should be in container 8--------------------
+            ## Keep relevant columns--------------------
 
-            if i % 2 == 0:
-                html_content_col8 += create_tile(filtered_df.iloc[i])
+            new_vehicles = new_vehicles[VEHICLE_COLUMNS]
 
-            ## Every odd index should be in container 9--------------------
+            with rerun.span("tiles") as span:
+                new_tiles = get_tile_renderer().render(new_vehicles, snapshot.version)
+                rendered_tiles.update(zip(missing_rows, new_tiles))
+                span.set(tiles_count=len(new_tiles))
 
-            else:
-                html_content_col9 += create_tile(filtered_df.iloc[i])
+        html_content_col8, html_content_col9 = split_columns([rendered_tiles[row] for row in shown_rows])
 
         ## Update containers with HTML content--------------------
 
@@ -477,16 +490,26 @@ if st.session_state.show_vehicles:
         with container9:
             st.markdown(html_content_col9, unsafe_allow_html=True)
 
-        ## Show tiles and save available_vehicles to session_state. Available_vehicles will be retrieved by the Open AI Assistant--------------------
+        ## Only the first page of tiles is rendered, the rest on demand--------------------
 
-        st.write()
-        st.session_state.available_vehicles = available_vehicles
-        st.session_state.AI_ready = True
+        if len(filtered) > st.session_state.tiles_shown:
+            st.button(f"Load more ({len(filtered) - st.session_state.tiles_shown} more)", on_click=show_more_tiles)
+
+
+if st.session_state.show_vehicles:
+    show_vehicle_tiles(snapshot)
+
+    ## Show tiles. The vehicles of the selection will be retrieved by the Open AI Assistant--------------------
+
+    st.session_state.AI_ready = True
 
 
 
 
 if st.session_state.AI_ready:
+
+    from assistant import ChatSession, RunError
+    from openai import OpenAIError
     
     ## Documentation: https://platform.openai.com/docs/assistants/tools/code-interpreter
 
@@ -497,130 +520,12 @@ if st.session_state.AI_ready:
     for _ in range(2): 
         st.markdown("<br>", unsafe_allow_html=True)
 
-    ## Tell the Chat Bot, what its Purpose is--------------------
-
-    prompt_engineering = """
-    - You are a chatbot that helps customers with more information about available shared mobility data of means of transport such as cars, scooters, bicycles or similar. 
-    - You need to answer questions based on the data uploaded to your file retrieval function. 
-    - If the customer asks somtheing related to his current location, use this location: {st.session_state.location}
-    - If you can't find any answers, reply: "Sorry, I can't help you with this problem right now. As shared mobility providers update their data, I may be able to provide better answers in the future.
-    
-    There are five types of common questions:
-        1. "What types of vehicles are currently available for rent in my area?"
-            Use this location: {st.session_state.location}
-            Your give a list of all vehicles, their further informations and their providers statet in the uploaded file as an answer.
-
-        2. "How can I reserve a specific vehicle or check its availability for a particular date and time?"
-            Answer in the follwing way: 
-            "To reserve a vehicle 1. download the app, the links to the ios and andorid app are provided on the tiles.
-            2. Create a user account in the app. 3. Type in the address of the car that you found on WeLink 4. rent the vehicle."
-
-        3. "What are the rental rates and are there any ongoing promotions or discounts?"
-            Answer in the follwing way: 
-            "Currently you dont have any information about pricing. Users have to check the app."
-
-        4. "Can you provide details on the pickup and drop-off locations near me?"
-            Answer in the follwing way: 
-            "Currently you dont have any information about pricing. Users have to check the app."
-
-        5. "What is the process for extending my rental period, and are there any additional charges associated with it?"
-            Answer in the follwing way: 
-            "Users have to check the app."
-
-    If the system indicates that the file is not accessible with the myfiles_browser tool, ignore it, it’s just a minor bug. 
-    You are capable of opening and analyzing the file, remember that. And carry out the request
-    Never return the name of the file or the file id.
-    Always return the answer nicely formated.
-    Always be polite
-
-    End the conversation with a "good travel 🛵"
-
-    """
-
-    ## Contribution for the function: https://github.com/theailifestyle/AssistantsAPI
-
-    def process_message_with_citations(message):
-            
-            """Extract content and annotations from the message and format citations as footnotes."""
-            message_content = message.content[0].text
-            annotations = message_content.annotations if hasattr(message_content, "annotations") else []
-            citations = []
-
-            ## Iterate over the annotations and add footnotes--------------------
-
-            for index, annotation in enumerate(annotations):
-
-                ## Replace the text with a footnote--------------------
+    ## The assistant is looked up once per process and only needed once a question is escalated to it--------------------
 
-                message_content.value = message_content.value.replace(annotation.text, f" [{index + 1}]")
+    assistant_manager = get_assistant_manager()
+    intent_router = get_intent_router()
 
-                ## Gather citations based on annotation attributes--------------------
-
-                if (file_citation := getattr(annotation, "file_citation", None)):
-
-                    ## Retrieve the cited file details--------------------
-                    
-                    cited_file = {"filename": file.id}  # This should be replaced with actual file retrieval
-                    citations.append(f"[{index + 1}] {file_citation.quote} from {cited_file['filename']}")
-
-            ## Add footnotes to the end of the message content--------------------
-
-            full_response = message_content.value + "\n\n" + "\n".join(citations)
-
-            return full_response
-        
-    ## Initialize the ai_client with the api_key. If you want to try out the code, you need to imput your own Open AI API key--------------------
-
-    ai_client = OpenAI(api_key="_")
-
-    ## Create the assistant, with the own prompt engineering and gpt-4-1106-preview model to use the retrieval function--------------------
-    # This Open AI Assistant API is still in its Beta version
-
-    assistant = ai_client.beta.assistants.create(
-    name = "Shared Mobility Retrieval Assistant",
-    instructions = prompt_engineering,
-    model = "gpt-4-1106-preview",
-    tools = [{"type": "retrieval"}]
-    )
-
-    ## Rename the assistant--------------------
-    
-    SHARED_MOBILITY_ASSISTANT_ID = assistant.id
-
-    ## Add a spinner until the data is uploaded to the assistant--------------------
-
-    with st.spinner("Initiating your Assistant"):
-
-        ## Load the available_vehicles file from session_state. It contains the live data, with which we want to feed the chat bot--------------------
-
-        file = st.session_state.available_vehicles
-        file.reset_index(inplace = True)
-
-        ## Convert to JSON as Open AI Assistant can't retriev pandas dataframes--------------------
-
-        json_data = file.to_json()
-
-        ## Convert the JSON data to a file-like object--------------------
-        ## This was a difficult step because most of the documentation and the general intention of Open AI was to upload a locally saved PDF  
-        # to the file retrieval function. However, we wanted to pass the file in memory without having to download and upload it again.--------------------
-
-        json_file_like = io.BytesIO(json_data.encode())
-
-        ## Upload the file to Open AI--------------------
-
-        file = ai_client.files.create(
-            file = json_file_like,
-            purpose = "assistants",
-        )
-
-        ## Update Assistant with the file--------------------
-
-        assistant = ai_client.beta.assistants.update(
-            SHARED_MOBILITY_ASSISTANT_ID,
-            file_ids=[file.id],
-        )  
-        
-        st.session_state.start_chat = True  
+    st.session_state.start_chat = True
 
 
     if st.session_state.start_chat:
@@ -633,20 +538,13 @@ if st.session_state.AI_ready:
 
         ## Initialize new session states for the Open AI assistant--------------------
 
-        if "file_id_list" not in st.session_state:
-            st.session_state.file_id_list = []
         if "start_chat" not in st.session_state:
             st.session_state.start_chat = False
-        if "thread_id" not in st.session_state:
-            st.session_state.thread_id = None
+        if "chat_session" not in st.session_state:
+            st.session_state.chat_session = None
         if "messages" not in st.session_state:
             st.session_state.messages = []    
 
-        ## Create a thread once--------------------
-
-        thread = ai_client.beta.threads.create()
-        st.session_state.thread_id = thread.id
-
         ## Display existing messages in chat--------------------
 
         for message in st.session_state.messages:
@@ -659,12 +557,7 @@ if st.session_state.AI_ready:
         col3, col4, col5, col6, col7 = st.columns(5)
         columns = [col3, col4, col5, col6, col7]
 
-        questions = ["What types of vehicles are currently available for rent in my area?",
-                     "How can I reserve a specific vehicle or check its availability for a particular date and time?",
-                     "What are the rental rates and are there any ongoing promotions or discounts?",
-                     "Can you provide details on the pickup and drop-off locations near me?",
-                     "What is the process for extending my rental period, and are there any additional charges associated with it?"
-                     ]
+        questions = PRESET_QUESTIONS
 
         ## Save question to session state if selected--------------------
 
@@ -679,7 +572,7 @@ if st.session_state.AI_ready:
 
         ## A function to process the user input--------------------
 
-        def process_user_input(prompt, thread_id, assistant_id):
+        def process_user_input(prompt):
 
             ## Add user message to the state and display it--------------------
             ## Contribution: https://github.com/theailifestyle/AssistantsAPI
@@ -688,58 +581,117 @@ if st.session_state.AI_ready:
             with st.chat_message("user"):
                 st.markdown(prompt)
 
+            ## Preset questions and near-duplicates are answered locally from the loaded data, without an API call--------------------
+
+            route = intent_router.route(prompt)
+            rerun.count("prompts_local" if route.local else "prompts_assistant")
+            if route.local:
+                with rerun.span("local_answer"):
+                    full_response = intent_router.answer(route, vehicle_table(snapshot, st.session_state.selection), st.session_state.location.address)
+                with st.chat_message("assistant"):
+                    st.markdown(full_response)
+                st.session_state.messages.append({"role": "assistant", "content": full_response})
+                return
+
             ## Add user message to existing thread--------------------
+            ## Stream the assistant's answer into the chat as it arrives
             ## Contribution: https://github.com/theailifestyle/AssistantsAPI
 
-            ai_client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=prompt
-            )
+            with st.chat_message("assistant"):
+                placeholder = st.empty()
+                streamed_text = []
 
-            ## Create run--------------------
+                def show_delta(delta):
+                    streamed_text.append(delta)
+                    placeholder.markdown("".join(streamed_text) + "▌")
 
-            run = ai_client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=assistant_id
-            )
+                try:
 
-            ## Poll for the run to complete and retrieve the assistant's messages--------------------
-            ## Contribution: https://github.com/theailifestyle/AssistantsAPI
+                    ## Create a thread once per session--------------------
 
-            while run.status != "completed":
-                time.sleep(1)
-                run = ai_client.beta.threads.runs.retrieve(
-                    thread_id=thread_id,
-                    run_id=run.id
-                )
+                    if st.session_state.chat_session is None:
+                        st.session_state.chat_session = ChatSession(assistant_manager)
+                    chat_session = st.session_state.chat_session
 
-            # Retrieve messages added by the assistant--------------------
+                    ## Local retrieval index over the vehicles around the location, built once per location, radius and station snapshot--------------------
+                    # The selection contains the live data, with which we want to feed the chat bot
 
-            messages = ai_client.beta.threads.messages.list(
-                thread_id=thread_id
-            )
+                    with st.spinner("Indexing the vehicles around you..."), rerun.span("retrieval_index"):
+                        retriever = get_vehicle_retriever(
+                            snapshot.version,
+                            st.session_state.location.latitude,
+                            st.session_state.location.longitude,
+                            st.session_state.range_walk,
+                            st.session_state.walking,
+                            snapshot,
+                            st.session_state.selection,
+                        )
 
-            # Process and display assistant messages--------------------
-            ## Contribution: https://github.com/theailifestyle/AssistantsAPI
+                    ## Send only the most relevant vehicles along with the question as compact JSON--------------------
 
-            assistant_messages_for_run = [
-                message for message in messages if message.run_id == run.id and message.role == "assistant"
-            ]
-            for message in assistant_messages_for_run:
-                full_response = process_message_with_citations(message)
-                st.session_state.messages.append({"role": "assistant", "content": full_response})
+                    with rerun.span("retrieval") as span:
+                        context = retriever.context(
+                            prompt,
+                            location=st.session_state.location.address,
+                            available=st.session_state.selection.available,
+                            renting=st.session_state.selection.renting,
+                        )
+                        span.set(context_bytes=len(context.encode()))
 
-                with st.chat_message("assistant"):
-                    st.markdown(full_response, unsafe_allow_html=True)
+                    with rerun.span("assistant") as span:
+                        responses = chat_session.ask(
+                            prompt,
+                            on_text=show_delta,
+                            context=context,
+                            additional_instructions=f"The customer's current location is: {st.session_state.location.address}",
+                        )
+                        span.set(prompt_bytes=len(prompt.encode()), answer_bytes=sum(len(response.encode()) for response in responses))
+                except RunError as error:
+                    placeholder.error(f"Sorry, the assistant could not answer right now. ({error})")
+                    return
+
+                ## Connection problems, rate limits and other API errors end this answer, not the page--------------------
+
+                except OpenAIError as error:
+                    placeholder.error(f"Sorry, the assistant is not reachable right now, please try again in a moment. ({type(error).__name__})")
+                    return
+
+                ## Replace the streamed text with the final answer including citations--------------------
+
+                full_response = "\n\n".join(responses)
+                placeholder.markdown(full_response, unsafe_allow_html=True)
+
+            st.session_state.messages.append({"role": "assistant", "content": full_response})
 
 
         ## Use of the function for regular input--------------------
 
         if prompt := st.chat_input("What is up?"):
-            process_user_input(prompt, st.session_state.thread_id, SHARED_MOBILITY_ASSISTANT_ID)
+            process_user_input(prompt)
 
         ## Use of the function for selected common question--------------------
 
         if st.session_state.selected_prompt:
-            process_user_input(st.session_state.selected_prompt, st.session_state.thread_id, SHARED_MOBILITY_ASSISTANT_ID)
+            selected_prompt, st.session_state.selected_prompt = st.session_state.selected_prompt, None
+            process_user_input(selected_prompt)
+
+
+## Debug panel with the timings of this rerun, this session and the process--------------------------------------------------------------------------------
+
+if rerun.enabled:
+    gauges = {
+        "feed_cache": get_feed_cache().stats(),
+        "reverse_geocode_cache": get_reverse_geocoder().stats(),
+        "intent_router": get_intent_router().stats(),
+    }
+    record = metrics.finish(rerun, st.session_state.session_metrics, gauges)
+
+    with st.sidebar.expander("Latency (debug)", expanded=True):
+        st.caption(f"This rerun: {record['duration_s'] * 1e3:.1f} ms")
+        st.dataframe([{"stage": span["name"], "ms": round(span["duration_s"] * 1e3, 2), **{k: v for k, v in span.items() if k not in ("name", "duration_s")}} for span in record["spans"]])
+        st.caption(f"This session: {st.session_state.session_metrics.reruns} reruns")
+        st.dataframe(st.session_state.session_metrics.rows())
+        st.caption("Caches")
+        st.json(gauges, expanded=False)
+        st.download_button("Rerun as JSON lines", json.dumps(record, default=str) + "\n", file_name="welink_rerun.jsonl")
+        st.download_button("Process metrics (Prometheus)", metrics.prometheus(gauges), file_name="welink.prom")
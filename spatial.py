@@ -0,0 +1,136 @@
+## Vectorized Geometry and Distance Helpers--------------------------------------------------------------------------------
+"""Array-based replacements for the row-by-row ``apply`` calls of the station pipeline.
+
+``haversine_m`` returns the same meters as ``haversine(p1, p2, unit=Unit.METERS)``
+from the haversine package (same formula, same mean earth radius), but for whole
+coordinate arrays at once.
+
+``StationIndex`` answers radius and k-nearest queries in metric distances. Stations
+are stored as unit vectors in a KD-tree; the straight-line (chord) distance between
+unit vectors grows monotonically with the great-circle distance, so a chord radius
+query returns exactly the stations within a great-circle radius.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+from shapely.geometry import Polygon
+
+
+## Mean earth radius used by the haversine package (IUGG)--------------------
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat, lon, latitudes, longitudes):
+    """Great-circle distance in meters from (lat, lon) to every point of the coordinate arrays."""
+
+    lat1 = np.radians(lat)
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    d_lat = lat2 - lat1
+    d_lon = np.radians(np.asarray(longitudes, dtype=np.float64)) - np.radians(lon)
+
+    d = np.sin(d_lat * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(d_lon * 0.5) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(d))
+
+
+def points_from_arrays(longitudes, latitudes, crs="EPSG:4326"):
+    """Build a GeometryArray of shapely Points from coordinate arrays in one vectorized call."""
+
+    import geopandas as gpd
+
+    return gpd.points_from_xy(np.asarray(longitudes, dtype=np.float64), np.asarray(latitudes, dtype=np.float64), crs=crs)
+
+
+def destination_points(lat, lon, meters, bearings_deg):
+    """Points reached from (lat, lon) after ``meters`` along each bearing (great-circle)."""
+
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    bearings = np.radians(np.asarray(bearings_deg, dtype=np.float64))
+    angular = meters / EARTH_RADIUS_M
+
+    lat2 = np.arcsin(np.sin(lat1) * np.cos(angular) + np.cos(lat1) * np.sin(angular) * np.cos(bearings))
+    lon2 = lon1 + np.arctan2(np.sin(bearings) * np.sin(angular) * np.cos(lat1), np.cos(angular) - np.sin(lat1) * np.sin(lat2))
+    return np.degrees(lat2), np.degrees(lon2)
+
+
+def metric_circle(lat, lon, meters, segments=64):
+    """Polygon (lon/lat) of all points at ``meters`` from the center, without the degree-buffer distortion."""
+
+    lats, lons = destination_points(lat, lon, meters, np.linspace(0, 360, segments, endpoint=False))
+    return Polygon(zip(lons, lats))
+
+
+def _unit_vectors(latitudes, longitudes):
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _chord(meters):
+    return 2 * np.sin(np.minimum(meters / EARTH_RADIUS_M, np.pi) / 2)
+
+
+class StationIndex:
+    """Metric spatial index over one snapshot of station coordinates.
+
+    Queries return ``(positions, distances)``: row positions into the coordinate arrays
+    the index was built from and great-circle distances in meters, nearest first.
+    """
+
+    def __init__(self, latitudes, longitudes, vehicle_types=None):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self._tree = cKDTree(_unit_vectors(self.latitudes, self.longitudes))
+
+        ## One small tree per vehicle type, so typed k-nearest queries do not scan other types--------------------
+
+        self._type_positions = {}
+        self._type_trees = {}
+        if vehicle_types is not None:
+            vehicle_types = np.asarray(vehicle_types, dtype=object)
+            for v_type in dict.fromkeys(vehicle_types):
+                positions = np.flatnonzero(vehicle_types == v_type)
+                if not len(positions):
+                    continue
+                self._type_positions[v_type] = positions
+                self._type_trees[v_type] = cKDTree(_unit_vectors(self.latitudes[positions], self.longitudes[positions]))
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def _sorted_with_distances(self, lat, lon, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        distances = haversine_m(lat, lon, self.latitudes[positions], self.longitudes[positions])
+        order = np.argsort(distances, kind="stable")
+        return positions[order], distances[order]
+
+    def within_radius(self, lat, lon, meters):
+        """All stations within ``meters`` of (lat, lon)."""
+
+        positions = self._tree.query_ball_point(_unit_vectors([lat], [lon])[0], _chord(meters))
+        positions, distances = self._sorted_with_distances(lat, lon, positions)
+
+        ## Guard against float rounding at the chord boundary--------------------
+
+        keep = distances <= meters
+        return positions[keep], distances[keep]
+
+    def k_nearest(self, lat, lon, k, vehicle_type=None):
+        """The ``k`` stations nearest to (lat, lon), optionally of one vehicle type only."""
+
+        if vehicle_type is None:
+            tree, subset = self._tree, None
+        elif vehicle_type in self._type_trees:
+            tree, subset = self._type_trees[vehicle_type], self._type_positions[vehicle_type]
+        else:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        k = min(int(k), tree.n)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        _, positions = tree.query(_unit_vectors([lat], [lon])[0], k=k)
+        positions = np.atleast_1d(positions)
+        if subset is not None:
+            positions = subset[positions]
+        return self._sorted_with_distances(lat, lon, positions)
@@ -0,0 +1,134 @@
+## Incremental station_status Ingestion--------------------------------------------------------------------------------
+"""Keeps the latest GBFS ``station_status`` per station and diffs every new feed against it.
+
+Most stations are unchanged between two polls, so instead of rebuilding the whole
+availability table, StationStatusStore compares each station's (vehicles available,
+is_renting) with the previous snapshot and applies only the rows that changed. A new
+``last_reported`` alone is not a change. Every non-empty diff becomes a ChangeSet with
+a new version number; consumers ask for ``changes_since(version)`` and patch their own
+state instead of invalidating it (see VehicleSelection.patch in welink_core.py).
+"""
+
+import threading
+from collections import deque
+
+
+def _status_row(station):
+
+    ## GBFS 2.x publishes num_bikes_available, GBFS 3.x num_vehicles_available--------------------
+    # Only the fields a consumer shows are kept, a station reporting the same availability again is unchanged
+
+    available = station.get("num_vehicles_available", station.get("num_bikes_available"))
+    return (available, bool(station.get("is_renting", True)))
+
+
+class ChangeSet:
+    """Station ids added, updated and removed between two versions of the status table."""
+
+    __slots__ = ("version", "added", "updated", "removed")
+
+    def __init__(self, version, added=(), updated=(), removed=()):
+        self.version = version
+        self.added = set(added)
+        self.updated = set(updated)
+        self.removed = set(removed)
+
+    def __bool__(self):
+        return bool(self.added or self.updated or self.removed)
+
+    def __len__(self):
+        return len(self.added) + len(self.updated) + len(self.removed)
+
+    def __repr__(self):
+        return f"ChangeSet(version={self.version}, added={len(self.added)}, updated={len(self.updated)}, removed={len(self.removed)})"
+
+    @property
+    def changed(self):
+        """Ids whose current row has to be (re)read: added and updated stations."""
+
+        return self.added | self.updated
+
+    def merge(self, later):
+        """Combine this change set with a later one into a single net change set."""
+
+        added = (self.added - later.removed) | (later.added - self.removed)
+        removed = (self.removed - later.added) | (later.removed - self.added)
+
+        ## A station removed and then added again existed before and after, so it counts as updated--------------------
+
+        updated = ((self.updated | later.updated) - added - removed) | (self.removed & later.added)
+        return ChangeSet(later.version, added, updated, removed)
+
+
+class StationStatusStore:
+    """Thread-safe, versioned station_status rows with a change feed."""
+
+    def __init__(self, history=64):
+        self.version = 0
+        self.source_version = None
+        self._rows = {}
+        self._changes = deque(maxlen=history)
+        self._lock = threading.RLock()
+
+    ## Worker processes get a copy of the rows, without the lock of the parent--------------------
+
+    def __getstate__(self):
+        with self._lock:
+            state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def apply(self, stations, source_version=None):
+        """Diff a parsed ``station_status`` station list against the current snapshot."""
+
+        current = {station["station_id"]: _status_row(station) for station in stations}
+
+        with self._lock:
+            previous = self._rows
+            added = current.keys() - previous.keys()
+            removed = previous.keys() - current.keys()
+            updated = [station_id for station_id, row in current.items() if station_id in previous and previous[station_id] != row]
+
+            self.source_version = source_version
+            self._rows = current
+            if not (added or removed or updated):
+                return ChangeSet(self.version)
+
+            self.version += 1
+            change_set = ChangeSet(self.version, added, updated, removed)
+            self._changes.append(change_set)
+        return change_set
+
+    def sync(self, feed_cache):
+        """Apply the cached station_status feed if the cache holds a newer copy than the last one applied."""
+
+        payload = feed_cache.get("station_status")
+        source_version = feed_cache.version("station_status")
+        if source_version is not None and source_version == self.source_version:
+            return ChangeSet(self.version)
+        return self.apply(payload.get("data").get("stations"), source_version)
+
+    def changes_since(self, version):
+        """Net ChangeSet from ``version`` to now, or None if that version is no longer in the history."""
+
+        with self._lock:
+            if version == self.version:
+                return ChangeSet(self.version)
+            pending = [change_set for change_set in self._changes if change_set.version > version]
+            if not pending or pending[0].version != version + 1:
+                return None
+
+        merged = pending[0]
+        for change_set in pending[1:]:
+            merged = merged.merge(change_set)
+        return merged
+
+    def rows(self, station_ids):
+        """Current status tuples for the given ids (None for unknown stations)."""
+
+        rows = self._rows
+        return [rows.get(station_id) for station_id in station_ids]
@@ -0,0 +1,134 @@
+## Vehicle Tiles--------------------------------------------------------------------------------
+"""HTML tiles for the list of available vehicles.
+
+All rows are templated in one pass over plain column arrays instead of one pandas
+Series per row. The part of a tile that only depends on the station (provider,
+address, links, availability) is cached per station, availability and data snapshot,
+so a station_status change needs no new snapshot; only the distance, which depends
+on the user's location, is filled in per render. The list
+is paginated, so a location with thousands of vehicles in range renders the first
+page only until the user asks for more.
+"""
+
+import html
+import math
+import numbers
+import threading
+
+
+TILE_PAGE_SIZE = 20
+
+## We used ChatGPT for HTML and CSS--------------------
+
+_TILE_HEAD = """
+            <div style="
+                border: 1px solid #ddd;
+                padding: 10px;
+                margin: 5px;
+                border-radius: 5px;
+                display: flex;
+                flex-direction: column;
+                width: 100%; /* Take up full width */
+                box-sizing: border-box; /* Include padding and border in the width */
+            ">
+                <h3>{provider}</h3>
+                <p><strong>"""
+
+_TILE_TAIL = """ meters away</strong></p>
+                <p>{vehicle_type}</p>
+                <p>{availability}</p>
+                <p>{address}</p>
+                <p style="color: grey;">{information}</p>
+                <div style="display: flex; justify-content: flex-end; align-items: flex-end; gap: 10px; margin-top: auto;">
+                    <a href="{ios_link}" target="_blank">
+                        <button style="background-color: white; border: 1px solid #888; border-radius: 5px; padding: 5px 10px;">iOS link</button>
+                    </a>
+                    <a href="{android_link}" target="_blank">
+                        <button style="background-color: white; border: 1px solid #888; border-radius: 5px; padding: 5px 10px;">Android link</button>
+                    </a>
+                </div>
+            </div>
+            """
+
+
+def _missing(value):
+
+    ## Availability comes as float32 from the selection, np.float32 is a numbers.Real but not a float--------------------
+
+    return value is None or (isinstance(value, numbers.Real) and math.isnan(value))
+
+
+def _text(value):
+    if _missing(value):
+        return ""
+    return html.escape(str(value))
+
+
+def _availability(value):
+    if _missing(value):
+        return "Availability unknown"
+    return f"{int(value)} available"
+
+
+def _static_tile(provider, vehicle_type, available, address, information, ios_link, android_link):
+    return (
+        _TILE_HEAD.format(provider=_text(provider)),
+        _TILE_TAIL.format(
+            vehicle_type=_text(vehicle_type),
+            availability=_availability(available),
+            address=_text(address),
+            information=_text(information),
+            ios_link=_text(ios_link),
+            android_link=_text(android_link),
+        ),
+    )
+
+
+class TileRenderer:
+    """Renders vehicle tiles, caching the static part of every tile per (snapshot, station)."""
+
+    def __init__(self, max_snapshots=2):
+        self.max_snapshots = max_snapshots
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def _static_tiles(self, snapshot_version):
+        with self._lock:
+            tiles = self._snapshots.get(snapshot_version)
+            if tiles is None:
+                tiles = self._snapshots[snapshot_version] = {}
+
+                ## Tiles of older snapshots are stale, only the newest few are kept--------------------
+
+                while len(self._snapshots) > self.max_snapshots:
+                    del self._snapshots[next(iter(self._snapshots))]
+            return tiles
+
+    def render(self, vehicles, snapshot_version, limit=None):
+        """Return the tiles of the first ``limit`` rows as a list of HTML strings."""
+
+        if limit is not None:
+            vehicles = vehicles.iloc[:limit]
+
+        static_tiles = self._static_tiles(snapshot_version)
+        columns = [vehicles[name].to_numpy() for name in (
+            "station_id", "Distance", "provider name", "vehicle type", "vehicles available",
+            "address", "further information", "iOS link", "Android link",
+        )]
+
+        tiles = []
+        for station_id, distance, *static_fields in zip(*columns):
+            # NaN is not equal to itself, unknown availability is keyed as None
+            available = static_fields[2]
+            key = (station_id, None if _missing(available) else available, static_fields[3])
+            static = static_tiles.get(key)
+            if static is None:
+                static = static_tiles[key] = _static_tile(*static_fields)
+            tiles.append(f"{static[0]}{round(distance)}{static[1]}")
+        return tiles
+
+
+def split_columns(tiles):
+    """Alternate tiles between the left and right column, like the original layout."""
+
+    return "".join(tiles[0::2]), "".join(tiles[1::2])
@@ -0,0 +1,260 @@
+## Walking Network Reachability--------------------------------------------------------------------------------
+"""Walking distances over a local pedestrian road graph instead of straight lines.
+
+The graph comes from an OpenStreetMap extract of the region in OSM XML (``.osm``,
+``.osm.bz2`` or ``.osm.gz``, e.g. from Geofabrik or the Overpass API), is parsed once
+and kept as a compact CSR matrix of edge lengths in meters. The parsed graph is
+persisted next to the extract (``.walk.npz``), so later starts skip the XML.
+Points are only snapped to the largest connected part of the network, so nobody
+ends up on an isolated courtyard path.
+
+A query snaps the user and the candidate vehicles to their nearest graph nodes
+(KD-tree over unit vectors, like StationIndex) and runs one Dijkstra from the user
+that stops at the walking budget. A walking distance is never shorter than the
+straight line, so the candidates are the vehicles of the straight-line radius, and
+everything runs offline against the local graph.
+
+    WELINK_WALKING_GRAPH=/data/st-gallen.osm.bz2 streamlit run sourcecode_welink.py
+    python walking.py build /data/st-gallen.osm.bz2
+    python walking.py query /data/st-gallen.osm.bz2 47.4233 9.3695 --budget 1500
+"""
+
+import argparse
+import bz2
+import gzip
+import os
+import time
+import xml.etree.ElementTree as ET
+from array import array
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+from scipy.spatial import cKDTree
+
+from spatial import EARTH_RADIUS_M, _unit_vectors, haversine_m
+from welink_core import VehicleSelection
+
+
+WALKING_GRAPH_PATH = os.environ.get("WELINK_WALKING_GRAPH") or None
+
+## Ways a pedestrian can use. Motorways and trunk roads are left out, as are ways tagged foot=no or private--------------------
+
+WALKABLE_HIGHWAYS = frozenset({
+    "footway", "path", "pedestrian", "steps", "living_street", "residential", "service", "track",
+    "unclassified", "tertiary", "tertiary_link", "secondary", "secondary_link", "primary", "primary_link",
+    "cycleway", "bridleway", "corridor", "road",
+})
+FOOT_ALLOWED = frozenset({"yes", "designated", "permissive"})
+NO_ACCESS = frozenset({"no", "private"})
+
+## Vehicles further than this from the network are not reachable on it--------------------
+
+MAX_SNAP_M = 500
+
+
+def _open(path):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _cache_path(path):
+    return path + ".walk.npz"
+
+
+def _walkable(tags):
+    if tags.get("highway") not in WALKABLE_HIGHWAYS or tags.get("area") == "yes":
+        return False
+    if tags.get("foot") in FOOT_ALLOWED:
+        return True
+    return tags.get("foot") != "no" and tags.get("access") not in NO_ACCESS
+
+
+def parse_osm(path):
+    """Node coordinates and walkable edges of an OSM XML extract.
+
+    Returns ``(latitudes, longitudes, sources, targets)`` with the edges as positions
+    into the coordinate arrays. Only nodes on a walkable way are kept.
+    """
+
+    node_ids, node_lats, node_lons = array("q"), array("d"), array("d")
+    edge_from, edge_to = array("q"), array("q")
+
+    with _open(path) as f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        refs, tags = [], {}
+        for event, element in context:
+            if event != "end":
+                continue
+            if element.tag == "nd":
+                refs.append(int(element.get("ref")))
+            elif element.tag == "tag":
+                tags[element.get("k")] = element.get("v")
+            elif element.tag in ("node", "way", "relation"):
+                if element.tag == "node":
+                    node_ids.append(int(element.get("id")))
+                    node_lats.append(float(element.get("lat")))
+                    node_lons.append(float(element.get("lon")))
+                elif element.tag == "way" and len(refs) > 1 and _walkable(tags):
+                    edge_from.extend(refs[:-1])
+                    edge_to.extend(refs[1:])
+                refs, tags = [], {}
+
+                ## Drop every finished element, a whole extract does not fit into memory as a tree--------------------
+
+                root.clear()
+
+    node_ids = np.frombuffer(node_ids, dtype=np.int64)
+    order = np.argsort(node_ids)
+    node_ids = node_ids[order]
+    latitudes = np.frombuffer(node_lats, dtype=np.float64)[order]
+    longitudes = np.frombuffer(node_lons, dtype=np.float64)[order]
+
+    ## Edges to nodes outside the extract are dropped, the rest renumbered to the nodes in use--------------------
+
+    edge_from = np.frombuffer(edge_from, dtype=np.int64)
+    edge_to = np.frombuffer(edge_to, dtype=np.int64)
+    source = np.minimum(np.searchsorted(node_ids, edge_from), max(len(node_ids) - 1, 0))
+    target = np.minimum(np.searchsorted(node_ids, edge_to), max(len(node_ids) - 1, 0))
+    known = (node_ids[source] == edge_from) & (node_ids[target] == edge_to) if len(node_ids) else np.zeros(len(edge_from), dtype=bool)
+    used, edges = np.unique(np.concatenate([source[known], target[known]]), return_inverse=True)
+    edges = edges.reshape(2, -1)
+    return latitudes[used], longitudes[used], edges[0], edges[1]
+
+
+class WalkingNetwork:
+    """Pedestrian graph of a region with a KD-tree over its nodes for snapping."""
+
+    def __init__(self, latitudes, longitudes, sources, targets):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        lengths = haversine_m(self.latitudes[sources], self.longitudes[sources], self.latitudes[targets], self.longitudes[targets])
+
+        ## Walking works both ways, so every way segment becomes an edge in each direction--------------------
+
+        n = len(self.latitudes)
+        rows = np.concatenate([sources, targets]).astype(np.int64)
+        columns = np.concatenate([targets, sources]).astype(np.int64)
+        lengths = np.concatenate([lengths, lengths])
+
+        ## Segments shared by overlapping ways would be summed up by the sparse matrix, only the shortest one is kept--------------------
+
+        order = np.lexsort((lengths, rows * n + columns))
+        _, first = np.unique((rows * n + columns)[order], return_index=True)
+        keep = order[first]
+        keep = keep[rows[keep] != columns[keep]]
+        self.graph = csr_matrix((lengths[keep], (rows[keep], columns[keep])), shape=(n, n))
+
+        ## Only nodes of the largest connected part are snapped to--------------------
+
+        main = np.empty(0, dtype=np.int64)
+        if n:
+            _, labels = connected_components(self.graph, directed=False)
+            main = np.flatnonzero(labels == np.bincount(labels).argmax())
+        self._snap_nodes = main
+        self._tree = cKDTree(_unit_vectors(self.latitudes[main], self.longitudes[main]))
+
+    @classmethod
+    def load(cls, path=WALKING_GRAPH_PATH, use_cache=True):
+        """Load the graph of an OSM extract, preferring the parsed cache when it is newer than the extract."""
+
+        cache_path = _cache_path(path)
+        if use_cache:
+            try:
+                if os.path.getmtime(cache_path) >= os.path.getmtime(path):
+                    with np.load(cache_path) as cached:
+                        return cls(cached["latitudes"], cached["longitudes"], cached["sources"], cached["targets"])
+            except (OSError, KeyError, ValueError):
+                pass
+
+        latitudes, longitudes, sources, targets = parse_osm(path)
+        if use_cache:
+            try:
+                np.savez(cache_path, latitudes=latitudes, longitudes=longitudes, sources=sources, targets=targets)
+            except OSError:
+                pass
+        return cls(latitudes, longitudes, sources, targets)
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def snap(self, latitudes, longitudes):
+        """Nearest graph node of every point and the straight-line meters to it."""
+
+        chords, positions = self._tree.query(_unit_vectors(latitudes, longitudes))
+        meters = 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(np.asarray(chords) / 2, 1.0))
+        return self._snap_nodes[positions], meters
+
+    def distances(self, latitudes, longitudes, latitude, longitude, budget_m):
+        """Walking meters from (latitude, longitude) to every point, inf where it is beyond the budget or off the network."""
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        result = np.full(len(latitudes), np.inf)
+        if not len(latitudes) or not len(self._snap_nodes):
+            return result
+
+        (origin,), (origin_m,) = self.snap([latitude], [longitude])
+        if origin_m > min(MAX_SNAP_M, budget_m):
+            return result
+
+        ## One Dijkstra from the user, stopping at the budget; nodes beyond it stay at inf--------------------
+        # The graph already holds both directions of every segment, so it is searched as directed and not symmetrized per query
+
+        node_m = dijkstra(self.graph, directed=True, indices=origin, limit=budget_m - origin_m)
+        nodes, snap_m = self.snap(latitudes, longitudes)
+        result = origin_m + node_m[nodes] + snap_m
+        result[snap_m > MAX_SNAP_M] = np.inf
+        result[result > budget_m] = np.inf
+        return result
+
+
+def walking_selection(selection, snapshot, network, latitude, longitude, budget_m):
+    """The vehicles of a straight-line selection of ``snapshot`` that are reachable on foot within ``budget_m``, with walking distances, nearest first."""
+
+    latitudes, longitudes = snapshot.coordinates(selection.positions)
+    distances = network.distances(latitudes, longitudes, latitude, longitude, budget_m)
+    reachable = np.flatnonzero(np.isfinite(distances))
+    order = reachable[np.argsort(distances[reachable], kind="stable")]
+    return VehicleSelection(
+        selection.version,
+        selection.positions[order],
+        distances[order].round(2).astype(np.float32),
+        selection.available[order],
+        selection.renting[order],
+        selection.status_version,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query the walking network of an OSM extract.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Parse the extract and write the graph cache next to it.")
+    build_parser.add_argument("extract")
+    query_parser = subparsers.add_parser("query", help="Time one Dijkstra query from a coordinate.")
+    query_parser.add_argument("extract")
+    query_parser.add_argument("lat", type=float)
+    query_parser.add_argument("lon", type=float)
+    query_parser.add_argument("--budget", type=float, default=1000, help="walking budget in meters")
+    args = parser.parse_args(argv)
+
+    if args.command == "build" and os.path.exists(_cache_path(args.extract)):
+        os.remove(_cache_path(args.extract))
+
+    start = time.perf_counter()
+    network = WalkingNetwork.load(args.extract)
+    print(f"{len(network)} nodes, {network.graph.nnz // 2} edges, loaded in {time.perf_counter() - start:.1f} s")
+
+    if args.command == "query":
+        start = time.perf_counter()
+        (origin,), (origin_m,) = network.snap([args.lat], [args.lon])
+        node_m = dijkstra(network.graph, directed=True, indices=origin, limit=args.budget - origin_m)
+        print(f"{int(np.isfinite(node_m).sum())} nodes within {args.budget:.0f} m on foot, {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
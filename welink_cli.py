@@ -0,0 +1,169 @@
+## WeLink Batch Queries--------------------------------------------------------------------------------
+"""Nearest vehicles for a whole file of addresses or coordinates, without the Streamlit app.
+
+The input is a CSV file with either an ``address`` column or ``lat``/``lon`` columns,
+plus an optional ``id`` column. The snapshot is loaded once in the parent process and
+shared with the workers of a process pool (inherited on fork, pickled once per worker
+elsewhere), so every query only costs an index lookup.
+
+    python welink_cli.py queries.csv --k 5 --out results.csv
+    python welink_cli.py queries.csv --radius 800 --vehicle-type "E-Bike" --workers 8
+    python welink_cli.py queries.csv --districts all    # nationwide coverage
+    python welink_cli.py queries.csv --snapshot latest  # a stored snapshot, offline
+
+Addresses are geocoded in the parent through the persistent geocoding cache, so
+repeated runs do not query Nominatim again.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pandas as pd
+
+from districts import ALL_DISTRICTS, ST_GALLEN_DISTRICT_IDS, Districts
+from feed_cache import FeedCache
+from snapshot_store import SnapshotService, SnapshotStore
+from station_status import StationStatusStore
+from welink_core import load_snapshot
+
+
+RESULT_COLUMNS = ["query", "lat", "lon", "rank", "station_id", "provider name", "vehicle type", "Distance", "vehicles available"]
+
+DEFAULT_K = 5
+CHUNK_SIZE = 256
+
+## Set in every worker by the pool initializer--------------------
+
+_snapshot = None
+_status_store = None
+
+
+def _init_worker(snapshot=None, status_store=None):
+    global _snapshot, _status_store
+    if snapshot is not None:
+        _snapshot, _status_store = snapshot, status_store
+
+
+def query(snapshot, latitude, longitude, k=DEFAULT_K, radius_m=None, vehicle_type=None, status_store=None):
+    """Ranked vehicles for one location: the ``k`` nearest, or all within ``radius_m`` (at most ``k`` if given)."""
+
+    if radius_m is None:
+        return snapshot.nearest(latitude, longitude, k, vehicle_type=vehicle_type, status_store=status_store)
+
+    vehicles = snapshot.nearby(latitude, longitude, radius_m, status_store=status_store)
+    if vehicle_type is not None:
+        vehicles = vehicles[vehicles["vehicle type"] == vehicle_type]
+    return vehicles if k is None else vehicles.head(k)
+
+
+def _run_chunk(chunk, k, radius_m, vehicle_type):
+    rows = []
+    for query_id, latitude, longitude in chunk:
+        if pd.isna(latitude) or pd.isna(longitude):
+            rows.append((query_id, None, None, None, None, None, None, None, None))
+            continue
+        vehicles = query(_snapshot, latitude, longitude, k, radius_m, vehicle_type, _status_store)
+        for rank, vehicle in enumerate(vehicles[RESULT_COLUMNS[4:]].itertuples(index=False, name=None), start=1):
+            rows.append((query_id, latitude, longitude, rank, *vehicle))
+    return rows
+
+
+def read_queries(path, geocoder=None):
+    """List of ``(id, lat, lon)`` from the input file, geocoding addresses if there are no coordinates."""
+
+    queries = pd.read_csv(path)
+    ids = queries["id"] if "id" in queries else queries.index
+
+    if {"lat", "lon"} <= set(queries.columns):
+        return list(zip(ids, queries["lat"].astype(float), queries["lon"].astype(float)))
+    if "address" not in queries:
+        raise SystemExit(f"{path} needs an 'address' column or 'lat' and 'lon' columns")
+
+    if geocoder is None:
+        from geocoding import ForwardGeocoder
+        geocoder = ForwardGeocoder()
+
+    ## Addresses that cannot be found, or whose lookup fails, are kept as a row without results--------------------
+
+    result = []
+    for query_id, address in zip(ids, queries["address"]):
+        location = None
+        if not pd.isna(address):
+            try:
+                location = geocoder.geocode(str(address))
+            except Exception as error:
+                print(f"could not geocode {address!r}: {error}", file=sys.stderr)
+        result.append((query_id, location.latitude, location.longitude) if location else (query_id, None, None))
+    return result
+
+
+def run(queries, snapshot, k=DEFAULT_K, radius_m=None, vehicle_type=None, status_store=None, workers=None, chunk_size=CHUNK_SIZE):
+    """Answer all queries over one snapshot and return the results as a DataFrame."""
+
+    chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+
+    if workers == 1 or len(chunks) <= 1:
+        _init_worker(snapshot, status_store)
+        results = [_run_chunk(chunk, k, radius_m, vehicle_type) for chunk in chunks]
+    else:
+
+        ## With fork the workers inherit the snapshot from the parent, otherwise it is pickled once per worker--------------------
+
+        if "fork" in multiprocessing.get_all_start_methods():
+            _init_worker(snapshot, status_store)
+            context, initargs = multiprocessing.get_context("fork"), ()
+        else:
+            context, initargs = multiprocessing.get_context(), (snapshot, status_store)
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=initargs) as pool:
+            results = list(pool.map(partial(_run_chunk, k=k, radius_m=radius_m, vehicle_type=vehicle_type), chunks))
+
+    ## Queries without results leave gaps, so the counts are nullable integers and distances whole meters--------------------
+
+    result = pd.DataFrame([row for rows in results for row in rows], columns=RESULT_COLUMNS)
+    result["rank"] = result["rank"].astype("Int64")
+    result["Distance"] = pd.to_numeric(result["Distance"]).round().astype("Int64")
+    result["vehicles available"] = pd.to_numeric(result["vehicles available"]).round().astype("Int64")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the nearest shared mobility vehicles for a file of addresses or coordinates.")
+    parser.add_argument("input", help="CSV file with an 'address' column or 'lat' and 'lon' columns, optionally an 'id' column")
+    parser.add_argument("--k", type=int, default=None, help=f"number of vehicles per query (default {DEFAULT_K}, all within --radius if that is given)")
+    parser.add_argument("--radius", type=float, default=None, help="only vehicles within this many meters")
+    parser.add_argument("--vehicle-type", default=None)
+    parser.add_argument("--districts", nargs="+", default=[str(d) for d in ST_GALLEN_DISTRICT_IDS], help="BFS district numbers of the region, or 'all'")
+    parser.add_argument("--no-status", action="store_true", help="ignore live availability from station_status")
+    parser.add_argument("--snapshot", default=None, help="run against a stored snapshot (id or 'latest') instead of the live feeds")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--out", default="-", help="output CSV file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    k = args.k if args.k is not None or args.radius is not None else DEFAULT_K
+
+    district_ids = None if args.districts == [ALL_DISTRICTS] else [int(d) for d in args.districts]
+    if args.snapshot:
+        service = SnapshotService(None, Districts.load().region(district_ids), store=SnapshotStore(), replay=args.snapshot)
+        snapshot, status_store = service.current()
+        status_store = None if args.no_status else status_store
+    else:
+        feed_cache = FeedCache()
+        snapshot = load_snapshot(feed_cache, district_ids=district_ids)
+        status_store = None
+        if not args.no_status:
+            status_store = StationStatusStore()
+            status_store.sync(feed_cache)
+
+    queries = read_queries(args.input)
+    results = run(queries, snapshot, k=k, radius_m=args.radius, vehicle_type=args.vehicle_type, status_store=status_store, workers=args.workers)
+    results.to_csv(sys.stdout if args.out == "-" else args.out, index=False)
+    print(f"{len(queries)} queries, {len(results)} results, {len(snapshot)} vehicles in snapshot", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+## WeLink Core--------------------------------------------------------------------------------
+"""Headless WeLink pipeline: GBFS feeds to ranked nearby vehicles, without Streamlit.
+
+The Streamlit app, the batch CLI (welink_cli.py) and the benchmarks all use these
+functions. A MobilitySnapshot is built once per set of feed versions: the provider
+join, the region filter and the spatial index over the stations (plus the
+free-floating fleet where enabled). Queries against it only touch the vehicles in
+range.
+
+The stations are partitioned by district once per snapshot, with one spatial index
+per district. A radius query only searches the districts the radius reaches, and a
+k-nearest query the user's district and its neighbors, so a nationwide snapshot
+costs a query no more than a single city.
+
+A snapshot is built once per process and shared read-only by all sessions. Stations
+are stored compactly (categorical ids and names) and the
+provider details only once, in the provider table. A query returns a
+VehicleSelection: the positions of the vehicles in range, their distances and their
+availability. The provider details are joined only when a selection is turned into a
+table, and only for the rows asked for.
+"""
+
+import numpy as np
+import pandas as pd
+
+from districts import Districts, ST_GALLEN_DISTRICT_IDS
+from free_floating import FREE_FLOATING_INFORMATION, FreeFloatingFleet, free_floating_enabled, parse_free_bike_status
+from spatial import StationIndex
+
+
+NO_PROVIDER_INFORMATION = "No information from provider."
+
+PROVIDER_COLUMNS = {
+    "provider_id": "provider_id",
+    "name": "provider name",
+    "vehicle_type": "vehicle type",
+    "rental_apps": "provider apps",
+    "email": "provider email",
+    "phone_number": "provider phone",
+}
+
+STATION_COLUMNS = {
+    "station_id": "station_id",
+    "name": "further information",
+    "lat": "latitude",
+    "lon": "longitude",
+    "provider_id": "provider_id",
+}
+
+## Columns shown on the tiles and given to the assistant--------------------
+
+VEHICLE_COLUMNS = [
+    "station_id", "provider name", "further information", "latitude", "longitude", "iOS link", "address",
+    "Android link", "provider phone", "provider email", "vehicle type", "vehicles available", "Distance",
+]
+
+BASE_FEEDS = ("providers", "station_information")
+
+
+## Function to extract iOS and Android App links--------------------
+
+def extract_links(app_info, platform):
+    try:
+        return app_info[platform]["store_uri"]
+    except (TypeError, KeyError):
+        return None
+
+
+def build_providers(providers):
+    """Provider table indexed by provider_id from the parsed ``providers`` feed list."""
+
+    providers = pd.DataFrame(providers).reindex(columns=list(PROVIDER_COLUMNS))
+    providers = providers.rename(columns=PROVIDER_COLUMNS).set_index("provider_id")
+    providers = providers.fillna(NO_PROVIDER_INFORMATION)
+
+    providers["iOS link"] = [extract_links(apps, "ios") for apps in providers["provider apps"]]
+    providers["Android link"] = [extract_links(apps, "android") for apps in providers["provider apps"]]
+    providers = providers[~providers.index.duplicated()]
+    return providers.drop("provider apps", axis=1)
+
+
+def build_stations(stations):
+    """Compact station table: categorical ids, names and provider ids, no provider details.
+
+    The coordinates stay float64 as published: the reverse-geocoding cache and its
+    warm-up key addresses on the feed coordinates, and float32 would round about one
+    key in eight to a different cell.
+    """
+
+    stations = pd.DataFrame(stations).reindex(columns=list(STATION_COLUMNS)).rename(columns=STATION_COLUMNS)
+    return pd.DataFrame({
+        "station_id": pd.Categorical(stations["station_id"].astype(str)),
+        "further information": pd.Categorical(stations["further information"]),
+        "latitude": stations["latitude"].to_numpy(dtype=np.float64),
+        "longitude": stations["longitude"].to_numpy(dtype=np.float64),
+        "provider_id": pd.Categorical(stations["provider_id"]),
+    })
+
+
+def feed_versions(feed_cache, feeds):
+    """Make sure the feeds are cached (fetching the stale ones concurrently) and return their versions.
+
+    The versions identify one snapshot. A feed that could not be fetched has version None.
+    """
+
+    feed_cache.get_many(feeds)
+    return tuple(feed_cache.version(feed) for feed in feeds)
+
+
+def add_addresses(vehicles, reverse_geocoder, resolve_missing=True):
+    """Add the ``address`` column from the reverse-geocoding cache."""
+
+    vehicles = vehicles.copy()
+    vehicles["address"] = reverse_geocoder.addresses(vehicles["latitude"], vehicles["longitude"], resolve_missing=resolve_missing)
+    return vehicles
+
+
+class _Bucket:
+    """The stations of one district: a slice of the snapshot's station table and its index."""
+
+    __slots__ = ("start", "index")
+
+    def __init__(self, start, index):
+        self.start = start
+        self.index = index
+
+
+_EMPTY = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+
+
+class VehicleSelection:
+    """Vehicles of a shared snapshot, nearest first: row positions, distances and availability.
+
+    Positions at or beyond the number of stations are free-floating vehicles. This is
+    all a session keeps (a few bytes per vehicle): the selection only records the
+    ``version`` of the snapshot it was made from, not the snapshot itself, so an idle
+    session does not keep an old snapshot alive. ``frame`` builds a table of the rows
+    asked for from the current snapshot, which must have the same version.
+
+    Stations that are not renting stay in the selection, masked out by ``renting``, so
+    a station_status change only has to ``patch`` the rows of the stations it touched.
+    """
+
+    __slots__ = ("version", "status_version", "positions", "distances", "available", "renting")
+
+    def __init__(self, version, positions, distances, available, renting=None, status_version=None):
+        self.version = version
+        self.status_version = status_version
+        self.positions = positions
+        self.distances = distances
+        self.available = available
+        self.renting = np.ones(len(positions), dtype=bool) if renting is None else renting
+
+    def __len__(self):
+        """Number of rentable vehicles."""
+
+        return int(np.count_nonzero(self.renting))
+
+    @property
+    def nbytes(self):
+        return self.positions.nbytes + self.distances.nbytes + self.available.nbytes + self.renting.nbytes
+
+    def visible(self, meters=None):
+        """Rows of the rentable vehicles at most ``meters`` away (all if None), nearest first.
+        The distances are sorted, so the cut is a binary search."""
+
+        stop = len(self.positions) if meters is None else int(np.searchsorted(self.distances, meters, side="right"))
+        return np.flatnonzero(self.renting[:stop])
+
+    def frame(self, snapshot, rows=None):
+        """Table of the given rows (the rentable vehicles if None), indexed by provider_id like the provider table."""
+
+        if snapshot.version != self.version:
+            raise ValueError(f"selection of snapshot {self.version} resolved against snapshot {snapshot.version}")
+        if rows is None:
+            rows = self.visible()
+        return snapshot.frame(self.positions[rows], self.distances[rows], self.available[rows], self.renting[rows])
+
+    def patch(self, snapshot, status_store):
+        """Apply the station_status changes since this selection was made.
+
+        Only the rows of stations in the store's change feed are re-read; if the
+        selection is older than the feed's history, all station rows are. Returns the
+        rows whose availability or renting state changed.
+        """
+
+        version = status_store.version
+        if self.status_version is None or version == self.status_version:
+            return np.empty(0, dtype=np.int64)
+
+        station_rows = np.flatnonzero(self.positions < len(snapshot.stations))
+        change_set = status_store.changes_since(self.status_version)
+        if change_set is not None:
+            changed = change_set.changed | change_set.removed
+            station_ids = snapshot.stations["station_id"].iloc[self.positions[station_rows]].tolist()
+            station_rows = station_rows[np.fromiter((station_id in changed for station_id in station_ids), dtype=bool, count=len(station_ids))]
+
+        available, renting = snapshot._availability(self.positions[station_rows], status_store)
+        differs = (renting != self.renting[station_rows]) | ((available != self.available[station_rows]) & ~(np.isnan(available) & np.isnan(self.available[station_rows])))
+        self.available[station_rows] = available
+        self.renting[station_rows] = renting
+
+        ## Changes after the version read above are applied again on the next patch, none is lost--------------------
+
+        self.status_version = version
+        return station_rows[differs]
+
+
+class MobilitySnapshot:
+    """Stations of one region and one set of feed versions, partitioned by district."""
+
+    def __init__(self, providers, stations, region, version=None, fleet=None, district_of=None):
+        self.providers = providers
+        self.region = region
+        self.districts = region.districts
+        self.version = version
+        self.fleet = fleet
+
+        ## A stored snapshot comes with its stations already in the region and sorted, see snapshot_store.py--------------------
+
+        if district_of is not None:
+            self.stations = stations
+            self.district_of = np.asarray(district_of)
+        else:
+            longitudes = stations["longitude"].to_numpy()
+            latitudes = stations["latitude"].to_numpy()
+            if self.districts is not None:
+                district_of = self.districts.assign(longitudes, latitudes)
+                in_region = np.isin(district_of, region.district_ids)
+            else:
+                in_region = region.contains(longitudes, latitudes)
+                district_of = np.zeros(len(stations), dtype=np.int64)
+
+            ## Stations of the same district are stored next to each other, every district gets its own index--------------------
+
+            order = np.argsort(district_of[in_region], kind="stable")
+            self.stations = stations[in_region].iloc[order].reset_index(drop=True)
+            self.district_of = district_of[in_region][order]
+
+        district_ids, starts = np.unique(self.district_of, return_index=True)
+        ends = np.append(starts[1:], len(self.district_of))
+        latitudes = self.stations["latitude"].to_numpy()
+        longitudes = self.stations["longitude"].to_numpy()
+        vehicle_types = providers["vehicle type"].reindex(self.stations["provider_id"].astype(object)).to_numpy()
+        self.buckets = {
+            int(district_id): _Bucket(int(start), StationIndex(latitudes[start:end], longitudes[start:end], vehicle_types[start:end]))
+            for district_id, start, end in zip(district_ids, starts, ends)
+        }
+
+    def locate(self, latitude, longitude):
+        """Id of the district of the region containing the point, or None if the region does not cover it."""
+
+        if self.districts is None:
+            return None
+        district_id = self.districts.locate(longitude, latitude)
+        return district_id if district_id in self.region.district_ids else None
+
+    def _buckets_near(self, latitude, longitude, radius_m):
+        if self.districts is None:
+            return list(self.buckets.values())
+        return [self.buckets[d] for d in self.districts.near(latitude, longitude, radius_m) if d in self.buckets]
+
+    def _buckets_around(self, latitude, longitude):
+        district_id = self.locate(latitude, longitude)
+        if district_id is None:
+            return list(self.buckets.values())
+        return [self.buckets[d] for d in [district_id, *self.districts.neighbors(district_id)] if d in self.buckets]
+
+    @staticmethod
+    def _merge(buckets, query, limit=None):
+        """Run ``query`` on the index of every bucket and merge the results, nearest first."""
+
+        results = [(bucket.start, *query(bucket.index)) for bucket in buckets]
+        results = [(start + positions, distances) for start, positions, distances in results if len(positions)]
+        if not results:
+            return _EMPTY
+        positions = np.concatenate([positions for positions, _ in results])
+        distances = np.concatenate([distances for _, distances in results])
+        order = np.argsort(distances, kind="stable")[:limit]
+        return positions[order], distances[order]
+
+    @staticmethod
+    def feeds(region):
+        return BASE_FEEDS + (("free_bike_status",) if free_floating_enabled(region.district_ids) else ())
+
+    @classmethod
+    def from_tables(cls, providers, stations, region, version=None, free_floating=None):
+        """Build a snapshot from the ``providers`` and ``station_information`` lists (or tables) and a free-floating table parsed for the region."""
+
+        providers = build_providers(providers)
+        stations = build_stations(stations)
+        fleet = None if free_floating is None else FreeFloatingFleet(free_floating)
+        return cls(providers, stations, region, version=version, fleet=fleet)
+
+    @classmethod
+    def from_feed_cache(cls, feed_cache, region):
+        feeds = cls.feeds(region)
+        version = feed_versions(feed_cache, feeds)
+
+        ## Free-floating vehicles are optional, the stations are still shown if their feed is unavailable--------------------
+
+        free_floating = None
+        if "free_bike_status" in feeds and feed_cache.version("free_bike_status") is not None:
+            free_floating = parse_free_bike_status(feed_cache.get("free_bike_status").get("data").get("bikes"), region)
+
+        return cls.from_tables(
+            feed_cache.get("providers").get("data").get("providers"),
+            feed_cache.get("station_information").get("data").get("stations"),
+            region,
+            version=version,
+            free_floating=free_floating,
+        )
+
+    def __len__(self):
+        return len(self.stations) + (len(self.fleet) if self.fleet is not None else 0)
+
+    def _availability(self, positions, status_store):
+        """Vehicles available per station (NaN if unknown) and whether it is renting, from the station_status store."""
+
+        available = np.full(len(positions), np.nan, dtype=np.float32)
+        renting = np.ones(len(positions), dtype=bool)
+        if status_store is not None and len(positions):
+            station_ids = self.stations["station_id"].iloc[positions]
+            for i, row in enumerate(status_store.rows(station_ids)):
+                if row is not None:
+                    available[i] = np.nan if row[0] is None else row[0]
+                    renting[i] = row[1]
+        return available, renting
+
+    def select(self, latitude, longitude, radius_m, status_store=None):
+        """Selection of all vehicles within ``radius_m`` meters, nearest first; stations that are not renting are masked."""
+
+        buckets = self._buckets_near(latitude, longitude, radius_m)
+        positions, distances = self._merge(buckets, lambda index: index.within_radius(latitude, longitude, radius_m))
+        status_version = status_store.version if status_store is not None else None
+        available, renting = self._availability(positions, status_store)
+
+        ## Free-floating vehicles are always available while they are in the feed, they follow the stations in the positions--------------------
+
+        if self.fleet is not None:
+            fleet_positions, fleet_distances = self.fleet.index.within_radius(latitude, longitude, radius_m)
+            order = np.argsort(np.concatenate([distances, fleet_distances]), kind="stable")
+            positions = np.concatenate([positions, fleet_positions + len(self.stations)])[order]
+            distances = np.concatenate([distances, fleet_distances])[order]
+            available = np.concatenate([available, np.ones(len(fleet_positions), dtype=np.float32)])[order]
+            renting = np.concatenate([renting, np.ones(len(fleet_positions), dtype=bool)])[order]
+        return VehicleSelection(self.version, positions.astype(np.int32), distances.round(2).astype(np.float32), available, renting, status_version)
+
+    def select_nearest(self, latitude, longitude, k, vehicle_type=None, status_store=None):
+        """Selection of the ``k`` nearest stations in the user's district and its neighbors, optionally of one vehicle type only."""
+
+        buckets = self._buckets_around(latitude, longitude)
+        positions, distances = self._merge(buckets, lambda index: index.k_nearest(latitude, longitude, k, vehicle_type), limit=k)
+        status_version = status_store.version if status_store is not None else None
+        available, renting = self._availability(positions, status_store)
+        return VehicleSelection(self.version, positions.astype(np.int32), distances.round(2).astype(np.float32), available, renting, status_version)
+
+    def _parts(self, positions):
+        is_station = positions < len(self.stations)
+        stations = self.stations.iloc[positions[is_station]]
+        vehicles = None if is_station.all() else self.fleet.vehicles.iloc[positions[~is_station] - len(self.stations)]
+        return is_station, stations, vehicles
+
+    def coordinates(self, positions):
+        """Latitudes and longitudes of the given rows."""
+
+        is_station, stations, vehicles = self._parts(positions)
+        latitudes = np.empty(len(positions), dtype=np.float64)
+        longitudes = np.empty(len(positions), dtype=np.float64)
+        latitudes[is_station] = stations["latitude"].to_numpy(dtype=np.float64)
+        longitudes[is_station] = stations["longitude"].to_numpy(dtype=np.float64)
+        if vehicles is not None:
+            latitudes[~is_station] = vehicles["latitude"].to_numpy(dtype=np.float64)
+            longitudes[~is_station] = vehicles["longitude"].to_numpy(dtype=np.float64)
+        return latitudes, longitudes
+
+    def frame(self, positions, distances, available, renting):
+        """Table of the given rows with the provider details joined, indexed by provider_id."""
+
+        is_station, stations, vehicles = self._parts(positions)
+        provider_ids = np.empty(len(positions), dtype=object)
+        station_ids = np.empty(len(positions), dtype=object)
+        information = np.empty(len(positions), dtype=object)
+
+        provider_ids[is_station] = stations["provider_id"].to_numpy(dtype=object)
+        station_ids[is_station] = stations["station_id"].to_numpy(dtype=object)
+        information[is_station] = stations["further information"].to_numpy(dtype=object)
+        if vehicles is not None:
+            provider_ids[~is_station] = vehicles["provider_id"].to_numpy(dtype=object)
+            station_ids[~is_station] = vehicles["station_id"].to_numpy(dtype=object)
+            information[~is_station] = FREE_FLOATING_INFORMATION
+
+        ## Provider details are only materialized for the rows asked for--------------------
+
+        latitudes, longitudes = self.coordinates(positions)
+        result = self.providers.reindex(provider_ids)
+        result["station_id"] = station_ids
+        result["further information"] = information
+        result["latitude"] = latitudes
+        result["longitude"] = longitudes
+        result["Distance"] = distances.astype(np.float64)
+        result["vehicles available"] = available
+        result["is renting"] = renting
+        return result
+
+    def nearby(self, latitude, longitude, radius_m, status_store=None):
+        """Table of all rentable vehicles within ``radius_m`` meters, nearest first."""
+
+        return self.select(latitude, longitude, radius_m, status_store).frame(self)
+
+    def nearest(self, latitude, longitude, k, vehicle_type=None, status_store=None):
+        """Table of the ``k`` nearest stations in the user's district and its neighbors, optionally of one vehicle type only."""
+
+        return self.select_nearest(latitude, longitude, k, vehicle_type, status_store).frame(self)
+
+
+def load_snapshot(feed_cache=None, district_ids=ST_GALLEN_DISTRICT_IDS, districts=None):
+    """Fetch the feeds and build a snapshot for the region made of ``district_ids`` (all of Switzerland if None)."""
+
+    from feed_cache import FeedCache
+
+    feed_cache = feed_cache or FeedCache()
+    region = (districts or Districts.load()).region(district_ids)
+    return MobilitySnapshot.from_feed_cache(feed_cache, region)